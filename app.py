@@ -1,7 +1,7 @@
 """
 Osakeanalyysi Web-työkalu
 Versio: 1.5.0
-Teknologiat: Python, Streamlit, SQLite, yfinance, pandas, ta
+Teknologiat: Python, Streamlit, SQLite, yfinance, pandas, numpy
 
 Ominaisuudet:
 - Oma salkku: osakkeiden hallinta, txt-import, tallennus tietokantaan
@@ -23,18 +23,28 @@ import streamlit as st
 import sqlite3
 import yfinance as yf
 import pandas as pd
-import ta
 import plotly.graph_objects as go
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import numpy as np
+import copy
 import io
 import os
+import queue
+import sys
 import time
+import functools
 import hashlib
+import importlib
+import itertools
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from zoneinfo import ZoneInfo
 from deep_translator import GoogleTranslator
 
 # Asetukset
-VERSION = "1.13.0"
+VERSION = "1.38.0"
 # Käytetään absoluuttista polkua jotta tietokanta säilyy Streamlitin uudelleenkäynnistyksissä
 DB_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stocks.db")
 
@@ -51,6 +61,7 @@ TRANSLATIONS: dict[str, dict[str, str]] = {
         "tab_funds": "📒 Omat rahastot",
         "tab_backtest": "🔁 Backtesting",
         "tab_info": "📖 Käyttöohjeet",
+        "nav_label": "Näkymä",
         # Sivupalkki
         "sidebar_portfolios": "🗂️ Salkut",
         "sidebar_active": "Aktiivinen salkku",
@@ -74,6 +85,11 @@ TRANSLATIONS: dict[str, dict[str, str]] = {
         "profile_change_pw_btn": "🔄 Vaihda",
         "profile_language": "🌐 Kieli / Language",
         "profile_language_save": "💾 Tallenna kieli",
+        "profile_chart_downsample": "📉 Kevennä kaaviot",
+        "profile_chart_downsample_help": "Pitkistä historioista piirretään enintään {points} pistettä sarjaa kohden; ääriarvot ja kauppamerkit säilyvät.",
+        "profile_chart_method": "Harvennustapa",
+        "profile_chart_webgl": "⚡ WebGL-piirto",
+        "profile_chart_webgl_help": "Vähintään {points} pisteen sarjat piirretään WebGL:llä (Scattergl) – kevyempi selaimelle pitkillä historioilla.",
         "profile_logout": "🚪 Kirjaudu ulos",
         "profile_user_mgmt": "🔒 Käyttäjänhallinta",
         "profile_create_user": "**Luo uusi käyttäjä**",
@@ -129,6 +145,15 @@ TRANSLATIONS: dict[str, dict[str, str]] = {
         "fi_clear_cache": "🗑️ Tyhjennä cache",
         "fi_cache_cleared": "Cache tyhjennetty!",
         "fi_last_synced": "🕒 Viimeksi synkattu: **{ts}**",
+        "market_closed": "🌙 Pörssi on kiinni – automaattinen päivitys jatkuu avautumisen jälkeen ({ts}).",
+        "worker_active": "🤖 Taustapäivitys käynnissä – lista päivittyy automaattisesti ilman erillistä synkkausta.",
+        "yahoo_unavailable": "⏳ Yahoo Finance ei vastaa – näytetään viimeisin tallennettu data, joka päivittyy taustalla yhteyden palattua.",
+        "screener_stale": "⏳ {n} tunnuksen rivit ovat aiemmasta synkkauksesta, koska haku epäonnistui: {symbols}",
+        "screener_missing": "⚠️ Ei dataa {n} tunnukselle: {symbols}",
+        "analysis_stale": "⏳ Vanhentunutta dataa (Yahoo-haku epäonnistui, päivitetään taustalla): {symbols}",
+        "frames_unavailable": "Kaavion dataa ei saatu laskettua uudelleen – aja haku uudelleen.",
+        "session_trimmed": "Istunnon muistibudjetti ylittyi – vanhimmat tulokset poistettiin, aja ne tarvittaessa uudelleen.",
+        "info_session_memory": "Istunnon muisti {used} / {budget} · jaettu kehysvarasto {store} ({frames} kehystä)",
         "fi_search": "🔍 Hae yhtiötä tai tunnusta",
         "fi_signal_filter": "Signaali",
         "fi_signal_all": "Kaikki",
@@ -215,6 +240,39 @@ TRANSLATIONS: dict[str, dict[str, str]] = {
         "bt_run_btn": "▶️ Aja backtesting",
         "bt_no_stocks": "Lisää ensin osakkeita omaan salkkuun.",
         "bt_select_stock": "Valitse osake",
+        # Salkkutason backtest
+        "pf_header": "💼 Salkkutason backtest",
+        "pf_desc": "Yksi aloituspääoma jaetaan kaikkien valittujen osakkeiden kesken; "
+                   "eri pörssien kauppapäivät tasataan yhteiselle aikajanalle.",
+        "pf_weighting": "Painotus",
+        "pf_weighting_equal": "Tasapaino (1/N)",
+        "pf_weighting_signal": "Signaalipainotettu",
+        "pf_rebalance": "Tasapainotus",
+        "pf_rebalance_none": "Ei",
+        "pf_rebalance_monthly": "Kuukausittain",
+        "pf_rebalance_quarterly": "Kvartaaleittain",
+        "pf_run_btn": "▶️ Aja salkun backtest",
+        "pf_spinner": "Ajetaan salkun backtestingiä...",
+        "pf_strategy": "Strategia",
+        "pf_summary": "{strategy} · {n} osaketta · {trades} ostoa",
+        "pf_equity_name": "Salkku",
+        # Parametrioptimointi
+        "opt_header": "🔧 Parametrioptimointi",
+        "opt_desc": "Ajaa valitun strategian useilla parametriyhdistelmillä kaikille valituille osakkeille "
+                    "ja järjestää tulokset Sharpe-luvun mukaan (tunnusten keskiarvot).",
+        "opt_method": "Hakutapa",
+        "opt_method_grid": "Ruudukko (kaikki yhdistelmät)",
+        "opt_method_random": "Satunnaisotos",
+        "opt_method_halving": "Successive halving",
+        "opt_samples": "Otoksen koko",
+        "opt_params": "Parametrit: {grid}",
+        "opt_run_btn": "🚀 Optimoi parametrit",
+        "opt_spinner": "Optimoidaan parametreja...",
+        "opt_best": "🏆 Parhaat parametrit – {strategy}",
+        "opt_col_return": "Tuotto (%)",
+        "opt_col_drawdown": "Max Drawdown (%)",
+        "opt_col_trades": "Kauppoja",
+        "opt_download": "📥 Lataa optimointitulokset CSV",
         # Uutiset
         "news_no_news": "Ei uutisia saatavilla.",
         "news_fetch_error": "Uutisten haku epäonnistui.",
@@ -230,6 +288,7 @@ TRANSLATIONS: dict[str, dict[str, str]] = {
         "tab_funds": "📒 My Funds",
         "tab_backtest": "🔁 Backtesting",
         "tab_info": "📖 User Guide",
+        "nav_label": "View",
         # Sidebar
         "sidebar_portfolios": "🗂️ Portfolios",
         "sidebar_active": "Active portfolio",
@@ -253,6 +312,11 @@ TRANSLATIONS: dict[str, dict[str, str]] = {
         "profile_change_pw_btn": "🔄 Change",
         "profile_language": "🌐 Language / Kieli",
         "profile_language_save": "💾 Save language",
+        "profile_chart_downsample": "📉 Lighten charts",
+        "profile_chart_downsample_help": "Long histories are drawn with at most {points} points per series; extrema and trade markers are kept.",
+        "profile_chart_method": "Downsampling method",
+        "profile_chart_webgl": "⚡ WebGL rendering",
+        "profile_chart_webgl_help": "Series with at least {points} points are drawn with WebGL (Scattergl) – lighter for the browser on long histories.",
         "profile_logout": "🚪 Log out",
         "profile_user_mgmt": "🔒 User management",
         "profile_create_user": "**Create new user**",
@@ -308,6 +372,15 @@ TRANSLATIONS: dict[str, dict[str, str]] = {
         "fi_clear_cache": "🗑️ Clear cache",
         "fi_cache_cleared": "Cache cleared!",
         "fi_last_synced": "🕒 Last synced: **{ts}**",
+        "market_closed": "🌙 The exchange is closed – auto-refresh resumes when it opens ({ts}).",
+        "worker_active": "🤖 Background sync is running – the list updates automatically without a manual sync.",
+        "yahoo_unavailable": "⏳ Yahoo Finance is not responding – showing the last saved data, refreshed in the background once it recovers.",
+        "screener_stale": "⏳ Rows for {n} symbols are from an earlier sync because their fetch failed: {symbols}",
+        "screener_missing": "⚠️ No data for {n} symbols: {symbols}",
+        "analysis_stale": "⏳ Stale data (Yahoo fetch failed, refreshing in the background): {symbols}",
+        "frames_unavailable": "Chart data could not be recomputed – run the query again.",
+        "session_trimmed": "Session memory budget exceeded – the largest results were dropped, rerun them if needed.",
+        "info_session_memory": "Session memory {used} / {budget} · shared frame store {store} ({frames} frames)",
         "fi_search": "🔍 Search company or symbol",
         "fi_signal_filter": "Signal",
         "fi_signal_all": "All",
@@ -394,6 +467,39 @@ TRANSLATIONS: dict[str, dict[str, str]] = {
         "bt_run_btn": "▶️ Run backtesting",
         "bt_no_stocks": "First add stocks to your portfolio.",
         "bt_select_stock": "Select stock",
+        # Portfolio backtest
+        "pf_header": "💼 Portfolio backtest",
+        "pf_desc": "One starting capital is shared across all selected stocks; "
+                   "trading days of different exchanges are aligned on a common timeline.",
+        "pf_weighting": "Weighting",
+        "pf_weighting_equal": "Equal weight (1/N)",
+        "pf_weighting_signal": "Signal-weighted",
+        "pf_rebalance": "Rebalancing",
+        "pf_rebalance_none": "None",
+        "pf_rebalance_monthly": "Monthly",
+        "pf_rebalance_quarterly": "Quarterly",
+        "pf_run_btn": "▶️ Run portfolio backtest",
+        "pf_spinner": "Running portfolio backtest...",
+        "pf_strategy": "Strategy",
+        "pf_summary": "{strategy} · {n} stocks · {trades} buys",
+        "pf_equity_name": "Portfolio",
+        # Parameter optimization
+        "opt_header": "🔧 Parameter optimization",
+        "opt_desc": "Runs the selected strategy with many parameter combinations on all selected stocks "
+                    "and ranks the results by Sharpe ratio (averaged over symbols).",
+        "opt_method": "Search method",
+        "opt_method_grid": "Grid (all combinations)",
+        "opt_method_random": "Random sample",
+        "opt_method_halving": "Successive halving",
+        "opt_samples": "Sample size",
+        "opt_params": "Parameters: {grid}",
+        "opt_run_btn": "🚀 Optimize parameters",
+        "opt_spinner": "Optimizing parameters...",
+        "opt_best": "🏆 Best parameters – {strategy}",
+        "opt_col_return": "Return (%)",
+        "opt_col_drawdown": "Max Drawdown (%)",
+        "opt_col_trades": "Trades",
+        "opt_download": "📥 Download optimization results CSV",
         # News
         "news_no_news": "No news available.",
         "news_fetch_error": "Failed to fetch news.",
@@ -410,28 +516,6 @@ def t(key: str, **kwargs) -> str:
     return text.format(**kwargs) if kwargs else text
 
 
-def _remap_df_columns(df: "pd.DataFrame", col_keys: list) -> "pd.DataFrame":
-    """Uudelleennimeää DataFrame-sarakkeet nykyisen kielen mukaan.
-
-    Käsittelee tilanteen, jossa välimuistissa oleva data on tallennettu eri
-    kielellä kuin aktiivinen kieli – estää KeyError-virheet.
-
-    Args:
-        df: DataFrame, jonka sarakkeet halutaan kääntää.
-        col_keys: Lista TRANSLATIONS-avaimen arvoista (esim. ['col_symbol', ...]).
-    Returns:
-        DataFrame oikeilla sarakeotsikoilla.
-    """
-    remap = {}
-    for key in col_keys:
-        current_name = t(key)
-        for lang_dict in TRANSLATIONS.values():
-            other_name = lang_dict.get(key, "")
-            if other_name and other_name != current_name and other_name in df.columns:
-                remap[other_name] = current_name
-    return df.rename(columns=remap) if remap else df
-
-
 # --- Suomen pörssin osakkeet (Nasdaq Helsinki / OMXH) ---
 # Lähde: Nasdaq Helsinki listatut yhtiöt, Yahoo Finance .HE-suffiksi
 FINNISH_STOCKS = {
@@ -720,12 +804,133 @@ EU_ETFS = {
 }
 
 
+# --- Tietokantayhteydet ---
+# Yhteydet avataan kerran ja käytetään uudelleen prosessinlaajuisesta poolista
+# (st.cache_resource, avaimena tietokantatiedosto). Streamlit ajaa jokaisen
+# uudelleenajon uudessa säikeessä, joten yhteydet eivät ole säiekohtaisia vaan
+# palaavat close()-kutsulla pooliin seuraavan säikeen käyttöön. WAL-tila sallii
+# lukijat kirjoituksen aikana, joten samanaikaiset käyttäjät eivät estä toisiaan;
+# synchronous=NORMAL on WAL-tilassa turvallinen ja nopeampi kuin FULL.
+DB_TIMEOUT = 10
+DB_CACHE_SIZE_KIB = 16384
+# Poolissa odottavien (käyttämättömien) yhteyksien enimmäismäärä tilaa kohden;
+# ylimääräiset suljetaan palautettaessa
+DB_POOL_SIZE = 8
+
+class _PooledConnection(sqlite3.Connection):
+    """Uudelleenkäytettävä SQLite-yhteys prosessinlaajuisesta poolista.
+
+    ``close()`` ei sulje yhteyttä vaan peruu mahdollisen keskeneräisen
+    transaktion ja palauttaa yhteyden pooliin, joten apufunktioiden
+    ``try/finally: conn.close()`` -rakenne toimii sellaisenaan.
+    """
+
+    _pool = None
+
+    def close(self) -> None:
+        if self.in_transaction:
+            self.rollback()
+        if self._pool is not None:
+            self._pool.release(self)
+
+    def close_physically(self) -> None:
+        """Sulkee yhteyden oikeasti (esim. testeissä tai poolia tyhjennettäessä)."""
+        super().close()
+
+class _ConnectionPool:
+    """Tietokantatiedoston yhteyspooli: käyttämättömät yhteydet jaetaan säikeiden kesken.
+
+    Säie pitää lainaamaansa yhteyttä, kunnes jokainen sen ``acquire``-kutsu on
+    suljettu; sisäkkäiset apufunktiot saavat siis saman yhteyden kuin kutsuja.
+    Samanaikaiset säikeet saavat eri yhteydet (tarvittaessa avataan uusi).
+    """
+
+    def __init__(self, db_path: str, max_idle: int = DB_POOL_SIZE):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle: dict[bool, list] = {False: [], True: []}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def acquire(self, readonly: bool) -> _PooledConnection:
+        held = self._local.__dict__.get(readonly)
+        if held is not None:
+            held[1] += 1
+            return held[0]
+        with self._lock:
+            idle = self._idle[readonly]
+            conn = idle.pop() if idle else None
+        if conn is None:
+            if readonly and not os.path.exists(self.db_path):
+                # Uutta kantaa ei voi avata vain luku -tilassa; luodaan se kirjoitusyhteydellä
+                self.acquire(False).close()
+            conn = _open_connection(self.db_path, readonly)
+            conn._pool = self
+            conn._readonly = readonly
+        self._local.__dict__[readonly] = [conn, 1]
+        return conn
+
+    def release(self, conn: _PooledConnection) -> None:
+        held = self._local.__dict__.get(conn._readonly)
+        if held is None or held[0] is not conn:
+            return  # jo palautettu tai toisen säikeen lainaama
+        held[1] -= 1
+        if held[1]:
+            return
+        del self._local.__dict__[conn._readonly]
+        with self._lock:
+            idle = self._idle[conn._readonly]
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close_physically()
+
+    def idle(self, readonly: bool = False) -> int:
+        """Poolissa odottavien yhteyksien määrä."""
+        with self._lock:
+            return len(self._idle[readonly])
+
+@st.cache_resource
+def _connection_pool(db_path: str) -> _ConnectionPool:
+    """Prosessinlaajuinen yhteyspooli tietokantatiedostolle ``db_path``."""
+    return _ConnectionPool(db_path)
+
+def _sql_casefold(value):
+    """SQL-funktio casefold(x): Unicode-tietoinen pienaakkostus (NULL säilyy)."""
+    return value.casefold() if isinstance(value, str) else value
+
+def _open_connection(db_path: str, readonly: bool) -> _PooledConnection:
+    """Avaa uuden yhteyden ja asettaa suorituskykyasetukset."""
+    if readonly:
+        uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=DB_TIMEOUT, factory=_PooledConnection,
+                               check_same_thread=False)
+    else:
+        conn = sqlite3.connect(db_path, timeout=DB_TIMEOUT, factory=_PooledConnection,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.create_function("casefold", 1, _sql_casefold, deterministic=True)
+    return conn
+
+def get_connection(readonly: bool = False) -> sqlite3.Connection:
+    """Lainaa poolista yhteyden tietokantaan ``DB_NAME`` (avaa tarvittaessa).
+
+    Yhteys palautetaan pooliin ``close()``-kutsulla. ``readonly=True``
+    palauttaa erillisen vain luku -yhteyden (``mode=ro``) kyselyille;
+    kirjoitusyritys siinä nostaa ``sqlite3.OperationalError``-virheen.
+    """
+    return _connection_pool(DB_NAME).acquire(readonly)
+
 # --- Tietokanta ---
-def init_db():
-    """Alustaa SQLite-tietokannan ja ajaa tarvittavat migraatiot."""
-    conn = sqlite3.connect(DB_NAME, timeout=10)
-    c = conn.cursor()
+def _migration_001_baseline(c: sqlite3.Cursor) -> None:
+    """Perusrakenne: salkut, osakkeet, pörssilistojen välimuistit, rahastot ja käyttäjät.
 
+    Sisältää myös vanhojen kantojen sarakemigraatiot ja oletuskäyttäjät, joten
+    aiemmin ilman versiotaulua luodut kannat päivittyvät tällä askeleella.
+    """
     # Portfoliot-taulu (luodaan ensin jos ei ole olemassa)
     c.execute("""
         CREATE TABLE IF NOT EXISTS portfolios (
@@ -873,8 +1078,214 @@ def init_db():
         ("testuser", test_pw, "Test User", "", "user", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     )
 
-    conn.commit()
-    conn.close()
+def _migration_002_price_store(c: sqlite3.Cursor) -> None:
+    """Kurssivarasto: päivätason OHLCV-rivit ja tunnuskohtainen kattavuus."""
+    # Päivätason kurssihistoria (OHLCV) ja sen kattavuus per tunnus
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS price_bars (
+            symbol TEXT NOT NULL,
+            date   TEXT NOT NULL,
+            open   REAL,
+            high   REAL,
+            low    REAL,
+            close  REAL NOT NULL,
+            volume REAL,
+            PRIMARY KEY (symbol, date)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS price_bar_meta (
+            symbol       TEXT PRIMARY KEY,
+            covered_from TEXT NOT NULL,
+            last_date    TEXT,
+            refreshed_at TEXT
+        )
+    """)
+
+def _migration_003_fundamentals(c: sqlite3.Cursor) -> None:
+    """Fundamenttitietojen pysyvä välimuisti."""
+    # Fundamenttitiedot (Ticker.info) JSON-muodossa, oma pitkä TTL
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS fundamentals (
+            symbol     TEXT PRIMARY KEY,
+            data       TEXT NOT NULL,
+            fetched_at TEXT NOT NULL
+        )
+    """)
+
+def _migration_004_screener_rows(c: sqlite3.Cursor) -> None:
+    """Pörssilistojen tyypitetyt rivit JSON-blobien tilalle."""
+    # Yksi rivi per (markkina, tunnus): haku ja signaalisuodatus tehdään SQL:nä
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS screener_rows (
+            market     TEXT NOT NULL,
+            symbol     TEXT NOT NULL,
+            name       TEXT,
+            price      REAL,
+            change_pct REAL,
+            rsi        REAL,
+            sma50      REAL,
+            signal     TEXT,
+            currency   TEXT,
+            pe         REAL,
+            market_cap REAL,
+            synced_at  TEXT NOT NULL,
+            PRIMARY KEY (market, symbol)
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_screener_rows_signal ON screener_rows (market, signal)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_screener_rows_symbol ON screener_rows (symbol)")
+
+    # Siirretään vanhat JSON-välimuistit riveiksi, jotta taulukot eivät tyhjene päivityksessä
+    for market, table in (("fi", "fi_cache"), ("us", "us_cache"), ("eu", "eu_cache")):
+        exists = c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+        ).fetchone()
+        if not exists:
+            continue
+        row = c.execute(f"SELECT data, synced_at FROM {table} WHERE id = 1").fetchone()
+        if not row:
+            continue
+        try:
+            import json
+            legacy_rows = json.loads(row[0])
+            synced_at = datetime.strptime(row[1], "%d.%m.%Y %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError):
+            continue
+        converted = [_legacy_screener_row(r) for r in legacy_rows]
+        c.executemany(
+            _SCREENER_UPSERT_SQL,
+            [(market, *values, synced_at) for values in converted if values[0]],
+        )
+
+def _migration_005_screener_history(c: sqlite3.Cursor) -> None:
+    """Pörssilistojen synkronointihistoria kokonaislukuavaimilla."""
+    # Tunnukset numeroidaan kerran; historiarivit viittaavat kokonaislukuun
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS screener_symbols (
+            id     INTEGER PRIMARY KEY,
+            market TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            UNIQUE (market, symbol)
+        )
+    """)
+    # synced_at Unix-sekunteina, signaali SIGNAL_*-koodina
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS screener_history (
+            symbol_id  INTEGER NOT NULL REFERENCES screener_symbols(id),
+            synced_at  INTEGER NOT NULL,
+            price      REAL,
+            change_pct REAL,
+            rsi        REAL,
+            sma50      REAL,
+            signal     INTEGER,
+            PRIMARY KEY (symbol_id, synced_at)
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_screener_history_time ON screener_history (synced_at)")
+
+    # Nykyinen tilannekuva historian ensimmäiseksi riviksi
+    c.execute("INSERT OR IGNORE INTO screener_symbols (market, symbol) SELECT market, symbol FROM screener_rows")
+    rows = c.execute("""
+        SELECT s.id, r.synced_at, r.price, r.change_pct, r.rsi, r.sma50, r.signal
+        FROM screener_rows r JOIN screener_symbols s ON s.market = r.market AND s.symbol = r.symbol
+    """).fetchall()
+    c.executemany(
+        "INSERT OR IGNORE INTO screener_history VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(sid, _to_epoch(ts), *values, _screener_signal_code(sig))
+         for sid, ts, *values, sig in rows],
+    )
+
+def _migration_006_worker_status(c: sqlite3.Cursor) -> None:
+    """Taustapäivittäjän tila: viimeisin sykäys ja ajon yhteenveto."""
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS worker_status (
+            name         TEXT PRIMARY KEY,
+            heartbeat_at REAL NOT NULL,
+            summary      TEXT
+        )
+    """)
+
+def _migration_007_indicator_state(c: sqlite3.Cursor) -> None:
+    """Inkrementaalinen indikaattoritila kurssivaraston rinnalla: tunnuksen
+    viimeisimmän vahvistetun päivän liukuvat summat ja EMA-tilat (JSON)."""
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS indicator_state (
+            symbol     TEXT PRIMARY KEY,
+            last_date  TEXT NOT NULL,
+            state      TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+
+# Skeeman migraatiot järjestyksessä: (versio, kuvaus, funktio). Uusi muutos
+# lisätään aina listan loppuun uudella versionumerolla; vanhoja ei muokata.
+SCHEMA_MIGRATIONS = [
+    (1, "perusrakenne", _migration_001_baseline),
+    (2, "kurssivarasto", _migration_002_price_store),
+    (3, "fundamenttitiedot", _migration_003_fundamentals),
+    (4, "pörssilistojen rivit", _migration_004_screener_rows),
+    (5, "pörssilistojen historia", _migration_005_screener_history),
+    (6, "taustapäivittäjän tila", _migration_006_worker_status),
+    (7, "indikaattoritila", _migration_007_indicator_state),
+]
+
+def get_schema_version() -> int:
+    """Palauttaa tietokannan skeemaversion (0, jos migraatioita ei ole ajettu)."""
+    conn = get_connection()
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_version'"
+        ).fetchone()
+        if not exists:
+            return 0
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    finally:
+        conn.close()
+
+def init_db() -> list[int]:
+    """Alustaa SQLite-tietokannan ja ajaa puuttuvat migraatiot.
+
+    Jokainen askel ajetaan omassa ``BEGIN IMMEDIATE`` -transaktiossaan ja
+    kirjataan ``schema_version``-tauluun, joten samanaikaisesti käynnistyvät
+    prosessit eivät aja samaa askelta kahdesti. Palauttaa ajettujen askelten versiot.
+    """
+    conn = get_connection()
+    applied = []
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version     INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at  TEXT
+            )
+        """)
+        for version, description, migrate in SCHEMA_MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+            if version <= current:
+                conn.rollback()
+                continue
+            migrate(conn.cursor())
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+            conn.commit()
+            applied.append(version)
+    finally:
+        conn.close()
+    return applied
+
+@st.cache_resource
+def _ensure_schema(db_path: str) -> int:
+    """Ajaa migraatiot kerran prosessia (ja tietokantatiedostoa) kohden.
+
+    Streamlit ajaa main()-funktion jokaisella uudelleenajolla; skeematyö
+    tehdään vain ensimmäisellä kerralla. Palauttaa skeemaversion.
+    """
+    init_db()
+    return get_schema_version()
 
 # --- Käyttäjäfunktiot ---
 
@@ -884,7 +1295,7 @@ def _hash_pw(password: str) -> str:
 
 def get_user_by_username(username: str):
     """Palauttaa käyttäjärivin tai None."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection(readonly=True)
     try:
         row = conn.execute(
             "SELECT id, username, password_hash, display_name, email, role, language FROM users WHERE username = ?",
@@ -896,7 +1307,7 @@ def get_user_by_username(username: str):
 
 def get_all_users() -> list[tuple]:
     """Palauttaa kaikki käyttäjät listana (id, username, display_name, role). Vain adminille."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection(readonly=True)
     try:
         rows = conn.execute(
             "SELECT id, username, display_name, role FROM users ORDER BY id"
@@ -907,7 +1318,7 @@ def get_all_users() -> list[tuple]:
 
 def delete_user(user_id: int) -> None:
     """Poistaa käyttäjän ja hänen salkkujensa osakkeet tietokannasta."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute("DELETE FROM stocks WHERE portfolio_id IN (SELECT id FROM portfolios WHERE user_id=?)", (user_id,))
         conn.execute("DELETE FROM portfolios WHERE user_id=?", (user_id,))
@@ -925,7 +1336,7 @@ def verify_password(username: str, password: str) -> bool:
 
 def create_user(username: str, password: str, display_name: str = "", email: str = "", role: str = "user") -> tuple[bool, str]:
     """Luo uuden käyttäjän. Palauttaa (onnistui, viesti)."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute(
             "INSERT INTO users (username, password_hash, display_name, email, role, created_at) VALUES (?, ?, ?, ?, ?, ?)",
@@ -940,7 +1351,7 @@ def create_user(username: str, password: str, display_name: str = "", email: str
 
 def update_user_profile(user_id: int, display_name: str, email: str) -> None:
     """Päivittää käyttäjän kutsumanian ja sähköpostiosoitteen tietokantaan."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute(
             "UPDATE users SET display_name=?, email=? WHERE id=?",
@@ -952,7 +1363,7 @@ def update_user_profile(user_id: int, display_name: str, email: str) -> None:
 
 def update_user_language(user_id: int, language: str) -> None:
     """Päivittää käyttäjän kieliasetuksen tietokantaan."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute("UPDATE users SET language=? WHERE id=?", (language, user_id))
         conn.commit()
@@ -961,7 +1372,7 @@ def update_user_language(user_id: int, language: str) -> None:
 
 def change_password(user_id: int, old_password: str, new_password: str) -> tuple[bool, str]:
     """Vaihtaa käyttäjän salasanan. Vanhan salasanan on täsmättävä."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         row = conn.execute("SELECT password_hash FROM users WHERE id=?", (user_id,)).fetchone()
         if row is None or row[0] != _hash_pw(old_password):
@@ -976,7 +1387,7 @@ def change_password(user_id: int, old_password: str, new_password: str) -> tuple
 
 def get_portfolios(user_id: int) -> list[tuple]:
     """Palauttaa käyttäjän omat salkut listana (id, name)."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection(readonly=True)
     try:
         rows = conn.execute(
             "SELECT id, name FROM portfolios WHERE user_id = ? ORDER BY id",
@@ -999,7 +1410,7 @@ def ensure_user_portfolio_by_uname(username: str) -> None:
 
 def create_portfolio(name: str, user_id: int) -> int:
     """Luo uuden salkun käyttäjälle, palauttaa sen id:n."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         c = conn.cursor()
         c.execute(
@@ -1014,7 +1425,7 @@ def create_portfolio(name: str, user_id: int) -> int:
 
 def rename_portfolio(portfolio_id: int, new_name: str) -> None:
     """Nimeää salkun uudelleen."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute("UPDATE portfolios SET name = ? WHERE id = ?", (new_name, portfolio_id))
         conn.commit()
@@ -1023,7 +1434,7 @@ def rename_portfolio(portfolio_id: int, new_name: str) -> None:
 
 def delete_portfolio(portfolio_id: int) -> None:
     """Poistaa salkun ja sen kaikki osakkeet."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute("DELETE FROM stocks WHERE portfolio_id = ?", (portfolio_id,))
         conn.execute("DELETE FROM portfolios WHERE id = ?", (portfolio_id,))
@@ -1031,89 +1442,425 @@ def delete_portfolio(portfolio_id: int) -> None:
     finally:
         conn.close()
 
-def save_fi_cache(results: list, timestamp: str) -> None:
-    """Tallentaa Suomen pörssin datan tietokantaan JSON-muodossa."""
-    import json
-    conn = sqlite3.connect(DB_NAME)
+# --- Pörssilistojen tallennus ---
+
+# Tallennettavat kentät järjestyksessä (market ja synced_at lisätään erikseen)
+SCREENER_FIELDS = [
+    "symbol", "name", "price", "change_pct", "rsi", "sma50",
+    "signal", "currency", "pe", "market_cap",
+]
+
+_SCREENER_UPSERT_SQL = f"""
+    INSERT INTO screener_rows (market, {", ".join(SCREENER_FIELDS)}, synced_at)
+    VALUES (?, {", ".join("?" for _ in SCREENER_FIELDS)}, ?)
+    ON CONFLICT(market, symbol) DO UPDATE SET
+        {", ".join(f"{f}=excluded.{f}" for f in SCREENER_FIELDS[1:])},
+        synced_at=excluded.synced_at
+"""
+
+def _legacy_screener_row(row: dict) -> tuple:
+    """Muuntaa vanhan, käännetyillä otsikoilla tallennetun rivin SCREENER_FIELDS-järjestykseen."""
+    def pick(*keys):
+        for key in keys:
+            for lang_dict in TRANSLATIONS.values():
+                if lang_dict.get(key) in row:
+                    return row[lang_dict[key]]
+        return None
+
+    market_cap = pick("col_market_cap")
+    if isinstance(market_cap, str):
+        try:
+            market_cap = float(market_cap.split()[0]) * 1e9
+        except (ValueError, IndexError):
+            market_cap = None
+    values = {
+        "symbol": pick("col_symbol"),
+        "name": pick("col_company", "col_etf_name"),
+        "price": pick("col_price_eur", "col_price_usd"),
+        "change_pct": pick("col_change"),
+        "rsi": row.get("RSI"),
+        "sma50": pick("col_sma50"),
+        "signal": pick("col_signal"),
+        "currency": pick("col_currency"),
+        "pe": pick("col_pe"),
+        "market_cap": market_cap,
+    }
+    return tuple(values[f] for f in SCREENER_FIELDS)
+
+def save_screener_rows(market: str, rows: list[dict], synced_at: str | None = None) -> int:
+    """Tallentaa pörssilistan rivit tunnuskohtaisina upsertteina.
+
+    Args:
+        market: Markkinan tunniste ('fi', 'us', 'eu').
+        rows: Rivit sanakirjoina SCREENER_FIELDS-avaimilla.
+        synced_at: Synkronointiaika muodossa 'YYYY-MM-DD HH:MM:SS' (oletus: nyt).
+    Returns:
+        Tallennettujen rivien määrä.
+    """
+    synced_at = synced_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    params = [
+        (market, *(row.get(f) for f in SCREENER_FIELDS), synced_at)
+        for row in rows if row.get("symbol")
+    ]
+    conn = get_connection()
     try:
-        conn.execute("""
-            INSERT INTO fi_cache (id, data, synced_at)
-            VALUES (1, ?, ?)
-            ON CONFLICT(id) DO UPDATE SET data=excluded.data, synced_at=excluded.synced_at
-        """, (json.dumps(results, ensure_ascii=False), timestamp))
+        conn.executemany(_SCREENER_UPSERT_SQL, params)
+        # Sama synkronointi arkistoon; vanha historia harvennetaan samassa transaktiossa
+        _archive_screener_rows(conn, market, rows, synced_at)
+        _prune_screener_history(conn)
         conn.commit()
     finally:
         conn.close()
+    return len(params)
 
-def load_fi_cache() -> tuple[list | None, str | None]:
-    """Lataa Suomen pörssin datan tietokannasta. Palauttaa (list, str) tai (None, None)."""
-    import json
-    conn = sqlite3.connect(DB_NAME)
+def query_screener(market: str, search: str = "", signal: str | None = None) -> pd.DataFrame:
+    """Hakee pörssilistan rivit, suodatettuna tunnuksen/nimen ja signaalin mukaan SQL:ssä.
+
+    Haku ei erota kirjainkokoa myöskään ä/ö/å-kirjaimissa: SQLiten LIKE
+    tunnistaa vain ASCII-kirjaimet, joten vertailu tehdään yhteyteen
+    rekisteröidyllä Pythonin casefold-funktiolla (ks. _open_connection).
+
+    Returns:
+        DataFrame SCREENER_FIELDS-sarakkeilla tunnuksen mukaan järjestettynä.
+    """
+    where = ["market = ?"]
+    params: list = [market]
+    if search:
+        needle = search.casefold()
+        where.append("(instr(casefold(symbol), ?) > 0 OR instr(casefold(name), ?) > 0)")
+        params += [needle, needle]
+    if signal:
+        where.append("signal = ?")
+        params.append(signal)
+    conn = get_connection(readonly=True)
     try:
-        row = conn.execute("SELECT data, synced_at FROM fi_cache WHERE id = 1").fetchone()
+        return pd.read_sql_query(
+            f"SELECT {', '.join(SCREENER_FIELDS)} FROM screener_rows "
+            f"WHERE {' AND '.join(where)} ORDER BY symbol",
+            conn, params=params,
+        )
     finally:
         conn.close()
-    if row:
-        return json.loads(row[0]), row[1]
-    return None, None
 
-def save_us_cache(results: list, timestamp: str) -> None:
-    """Tallentaa USA:n pörssin datan tietokantaan JSON-muodossa."""
-    import json
-    conn = sqlite3.connect(DB_NAME)
+def get_screener_synced_at(market: str) -> str | None:
+    """Palauttaa markkinan viimeisimmän synkronointiajan ('YYYY-MM-DD HH:MM:SS') tai None."""
+    conn = get_connection(readonly=True)
     try:
-        conn.execute("""
-            INSERT INTO us_cache (id, data, synced_at)
-            VALUES (1, ?, ?)
-            ON CONFLICT(id) DO UPDATE SET data=excluded.data, synced_at=excluded.synced_at
-        """, (json.dumps(results, ensure_ascii=False), timestamp))
+        row = conn.execute(
+            "SELECT MAX(synced_at) FROM screener_rows WHERE market = ?", (market,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+def format_synced_at(ts: str | None) -> str | None:
+    """Muotoilee tallennetun synkronointiajan näytettäväksi (dd.mm.YYYY HH:MM:SS)."""
+    if not ts:
+        return None
+    return datetime.strptime(ts, "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y %H:%M:%S")
+
+def screener_display_frame(df: pd.DataFrame, name_key: str, price_key: str,
+                           fundamentals: bool = True) -> pd.DataFrame:
+    """Muuntaa query_screener-tuloksen näytettäväksi taulukoksi aktiivisen kielen otsikoilla."""
+    out = pd.DataFrame({
+        t("col_symbol"): df["symbol"],
+        t(name_key): df["name"],
+        t(price_key): df["price"],
+        t("col_change"): df["change_pct"],
+        "RSI": df["rsi"],
+        t("col_sma50"): df["sma50"],
+        t("col_signal"): df["signal"],
+        t("col_currency"): df["currency"],
+    })
+    if fundamentals:
+        out[t("col_pe")] = df["pe"]
+        out[t("col_market_cap")] = [
+            f"{cap/1e9:.1f} Mrd" if pd.notna(cap) else None for cap in df["market_cap"]
+        ]
+    return out
+
+# --- Pörssilistojen historia ---
+
+# Alle viikon vanhat synkronoinnit säilytetään kaikki, vanhemmista vain päivän viimeinen
+SCREENER_HISTORY_INTRADAY_DAYS = 7
+
+# Näytettävä signaali <-> tallennettu SIGNAL_*-koodi
+SCREENER_SIGNAL_LABELS = {1: "🟢 OSTA", -1: "🔴 MYY", 0: "🟡 PIDÄ"}
+
+def _screener_signal_code(label: str | None) -> int | None:
+    """Muuntaa näytettävän signaalin ("🟢 OSTA" jne.) kokonaislukukoodiksi."""
+    for code, text in SCREENER_SIGNAL_LABELS.items():
+        if label == text:
+            return code
+    return None
+
+def _to_epoch(value, end_of_day: bool = False) -> int:
+    """Muuntaa ajan (merkkijono, date, datetime) Unix-sekunneiksi paikallisessa ajassa.
+
+    Pelkkä päivämäärä tulkitaan päivän alkuna, tai loppuna jos end_of_day=True.
+    """
+    ts = pd.Timestamp(value)
+    date_only = (isinstance(value, str) and ":" not in value) or (
+        isinstance(value, date) and not isinstance(value, datetime)
+    )
+    if end_of_day and date_only:
+        ts = ts + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    return int(ts.to_pydatetime().timestamp())
+
+def _archive_screener_rows(conn: sqlite3.Connection, market: str, rows: list[dict],
+                           synced_at: str) -> None:
+    """Lisää synkronoinnin rivit historiaan (kutsujan transaktiossa)."""
+    symbols = [row["symbol"] for row in rows if row.get("symbol")]
+    if not symbols:
+        return
+    conn.executemany(
+        "INSERT OR IGNORE INTO screener_symbols (market, symbol) VALUES (?, ?)",
+        [(market, s) for s in symbols],
+    )
+    placeholders = ", ".join("?" for _ in symbols)
+    ids = dict(conn.execute(
+        f"SELECT symbol, id FROM screener_symbols WHERE market = ? AND symbol IN ({placeholders})",
+        (market, *symbols),
+    ).fetchall())
+    epoch = _to_epoch(synced_at)
+    conn.executemany(
+        "INSERT OR REPLACE INTO screener_history VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(ids[row["symbol"]], epoch, row.get("price"), row.get("change_pct"), row.get("rsi"),
+          row.get("sma50"), _screener_signal_code(row.get("signal")))
+         for row in rows if row.get("symbol")],
+    )
+
+def _prune_screener_history(conn: sqlite3.Connection, now: float | None = None,
+                            intraday_days: int = SCREENER_HISTORY_INTRADAY_DAYS) -> int:
+    """Harventaa yli intraday_days vanhan historian päivän viimeiseen synkronointiin.
+
+    Returns:
+        Poistettujen rivien määrä.
+    """
+    cutoff = int((now if now is not None else time.time()) - intraday_days * 86400)
+    cur = conn.execute("""
+        DELETE FROM screener_history
+        WHERE synced_at < :cutoff
+          AND (symbol_id, synced_at) NOT IN (
+              SELECT symbol_id, MAX(synced_at) FROM screener_history
+              WHERE synced_at < :cutoff
+              GROUP BY symbol_id, date(synced_at, 'unixepoch', 'localtime')
+          )
+    """, {"cutoff": cutoff})
+    return cur.rowcount
+
+def prune_screener_history(now: float | None = None,
+                           intraday_days: int = SCREENER_HISTORY_INTRADAY_DAYS) -> int:
+    """Ajaa historian harvennuksen omassa transaktiossaan. Palauttaa poistettujen rivien määrän."""
+    conn = get_connection()
+    try:
+        removed = _prune_screener_history(conn, now, intraday_days)
         conn.commit()
     finally:
         conn.close()
+    return removed
 
-def load_us_cache() -> tuple[list | None, str | None]:
-    """Lataa USA:n pörssin datan tietokannasta. Palauttaa (list, str) tai (None, None)."""
-    import json
-    conn = sqlite3.connect(DB_NAME)
+def _history_frame(rows: list, columns: list) -> pd.DataFrame:
+    """Muodostaa historiakyselyn tuloksesta DataFramen (aika datetimeksi, signaali tekstiksi)."""
+    df = pd.DataFrame(rows, columns=columns)
+    df["synced_at"] = pd.to_datetime([datetime.fromtimestamp(ts) for ts in df["synced_at"]])
+    df["signal"] = df["signal"].map(SCREENER_SIGNAL_LABELS)
+    return df
+
+def get_screener_as_of(market: str, as_of) -> pd.DataFrame:
+    """Palauttaa markkinan tilannekuvan annettuna hetkenä.
+
+    Jokaisesta tunnuksesta otetaan viimeisin synkronointi, joka on tehty
+    viimeistään as_of-hetkellä (pelkkä päivämäärä = päivän loppu). Mitään ei
+    haeta verkosta.
+
+    Returns:
+        DataFrame: symbol, synced_at, price, change_pct, rsi, sma50, signal.
+    """
+    conn = get_connection(readonly=True)
     try:
-        row = conn.execute("SELECT data, synced_at FROM us_cache WHERE id = 1").fetchone()
+        rows = conn.execute("""
+            SELECT s.symbol, h.synced_at, h.price, h.change_pct, h.rsi, h.sma50, h.signal
+            FROM screener_symbols s
+            JOIN screener_history h ON h.symbol_id = s.id
+            WHERE s.market = ?
+              AND h.synced_at = (
+                  SELECT MAX(synced_at) FROM screener_history
+                  WHERE symbol_id = s.id AND synced_at <= ?
+              )
+            ORDER BY s.symbol
+        """, (market, _to_epoch(as_of, end_of_day=True))).fetchall()
+    finally:
+        conn.close()
+    return _history_frame(rows, ["symbol", "synced_at", "price", "change_pct", "rsi", "sma50", "signal"])
+
+def get_symbol_history(symbol: str, market: str | None = None, start=None, end=None) -> pd.DataFrame:
+    """Palauttaa tunnuksen arkistoidut synkronoinnit aikajärjestyksessä.
+
+    Args:
+        symbol: Osaketunnus.
+        market: Rajaa markkinaan ('fi', 'us', 'eu'); None = kaikki.
+        start: Alkuhetki (mukaan lukien) tai None.
+        end: Loppuhetki (pelkkä päivämäärä = päivän loppu) tai None.
+    Returns:
+        DataFrame: market, synced_at, price, change_pct, rsi, sma50, signal.
+    """
+    where = ["s.symbol = ?"]
+    params: list = [symbol]
+    if market:
+        where.append("s.market = ?")
+        params.append(market)
+    if start is not None:
+        where.append("h.synced_at >= ?")
+        params.append(_to_epoch(start))
+    if end is not None:
+        where.append("h.synced_at <= ?")
+        params.append(_to_epoch(end, end_of_day=True))
+    conn = get_connection(readonly=True)
+    try:
+        rows = conn.execute(f"""
+            SELECT s.market, h.synced_at, h.price, h.change_pct, h.rsi, h.sma50, h.signal
+            FROM screener_symbols s JOIN screener_history h ON h.symbol_id = s.id
+            WHERE {' AND '.join(where)}
+            ORDER BY h.synced_at, s.market
+        """, params).fetchall()
+    finally:
+        conn.close()
+    return _history_frame(rows, ["market", "synced_at", "price", "change_pct", "rsi", "sma50", "signal"])
+
+# --- Kurssihistorian varasto ---
+
+PRICE_BAR_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+def get_price_bar_meta(symbol: str) -> tuple | None:
+    """Palauttaa tunnuksen varastotiedot (covered_from, last_date, refreshed_at) tai None."""
+    conn = get_connection(readonly=True)
+    try:
+        row = conn.execute(
+            "SELECT covered_from, last_date, refreshed_at FROM price_bar_meta WHERE symbol=?",
+            (symbol,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row
+
+def load_price_bars(symbol: str, start_date: str | None = None, end_date: str | None = None) -> pd.DataFrame:
+    """Lukee tunnuksen päiväkurssit varastosta.
+
+    Palauttaa DataFramen (Open, High, Low, Close, Volume), jonka indeksinä on
+    ``Date`` kuten ``Ticker.history``-kutsussa. ``end_date`` ei sisälly tulokseen.
+    """
+    query = "SELECT date, open, high, low, close, volume FROM price_bars WHERE symbol=?"
+    params: list = [symbol]
+    if start_date:
+        query += " AND date >= ?"
+        params.append(start_date)
+    if end_date:
+        query += " AND date < ?"
+        params.append(end_date)
+    query += " ORDER BY date"
+    conn = get_connection(readonly=True)
+    try:
+        df = pd.read_sql(query, conn, params=params)
+    finally:
+        conn.close()
+    df.columns = ["Date"] + PRICE_BAR_COLUMNS
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df.set_index("Date")
+
+def save_price_bars(symbol: str, df: pd.DataFrame, covered_from: str | None = None, replace: bool = False) -> None:
+    """Tallentaa päiväkurssit varastoon (upsert) ja päivittää tunnuksen kattavuustiedot.
+
+    Args:
+        symbol: Osaketunnus.
+        df: OHLCV-DataFrame, indeksinä päivämäärät.
+        covered_from: Haun alkupäivä, jos kyseessä oli täysi haku (laajentaa kattavuutta).
+        replace: Poistaa tunnuksen vanhat rivit ensin (esim. osinko-/splittikorjattu historia).
+    """
+    rows = []
+    if df is not None and not df.empty:
+        dates = pd.DatetimeIndex(df.index).strftime("%Y-%m-%d")
+        values = df.reindex(columns=PRICE_BAR_COLUMNS).astype(float).to_numpy()
+        rows = [
+            (symbol, d, *(None if pd.isna(v) else float(v) for v in vals))
+            for d, vals in zip(dates, values)
+            if not pd.isna(vals[3])
+        ]
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_connection()
+    try:
+        if replace:
+            conn.execute("DELETE FROM price_bars WHERE symbol=?", (symbol,))
+            conn.execute("DELETE FROM indicator_state WHERE symbol=?", (symbol,))
+        conn.executemany(
+            """
+            INSERT INTO price_bars (symbol, date, open, high, low, close, volume)
+            VALUES (?,?,?,?,?,?,?)
+            ON CONFLICT(symbol, date) DO UPDATE SET
+                open=excluded.open, high=excluded.high, low=excluded.low,
+                close=excluded.close, volume=excluded.volume
+            """,
+            rows,
+        )
+        last_date = conn.execute("SELECT MAX(date) FROM price_bars WHERE symbol=?", (symbol,)).fetchone()[0]
+        conn.execute(
+            """
+            INSERT INTO price_bar_meta (symbol, covered_from, last_date, refreshed_at)
+            VALUES (?,?,?,?)
+            ON CONFLICT(symbol) DO UPDATE SET
+                covered_from = CASE
+                    WHEN excluded.covered_from < price_bar_meta.covered_from OR ? THEN excluded.covered_from
+                    ELSE price_bar_meta.covered_from END,
+                last_date = excluded.last_date,
+                refreshed_at = excluded.refreshed_at
+            """,
+            (symbol, covered_from or "9999-12-31", last_date, now, 1 if replace else 0),
+        )
+        conn.commit()
     finally:
         conn.close()
-    if row:
-        return json.loads(row[0]), row[1]
-    return None, None
 
-def save_eu_cache(results: list, timestamp: str) -> None:
-    """Tallentaa EU ETF:ien datan tietokantaan JSON-muodossa."""
+# --- Fundamenttitiedot ---
+
+def save_fundamentals(symbol: str, info: dict) -> None:
+    """Tallentaa tunnuksen Ticker.info-tiedot tietokantaan JSON-muodossa."""
     import json
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute("""
-            INSERT INTO eu_cache (id, data, synced_at)
-            VALUES (1, ?, ?)
-            ON CONFLICT(id) DO UPDATE SET data=excluded.data, synced_at=excluded.synced_at
-        """, (json.dumps(results, ensure_ascii=False), timestamp))
+            INSERT INTO fundamentals (symbol, data, fetched_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(symbol) DO UPDATE SET data=excluded.data, fetched_at=excluded.fetched_at
+        """, (symbol, json.dumps(info, ensure_ascii=False, default=str),
+              datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
         conn.commit()
     finally:
         conn.close()
 
-def load_eu_cache() -> tuple[list | None, str | None]:
-    """Lataa EU ETF:ien datan tietokannasta. Palauttaa (list, str) tai (None, None)."""
+def load_fundamentals(symbol: str, max_age: float | None = None) -> dict | None:
+    """Lataa tunnuksen fundamenttitiedot tietokannasta.
+
+    Palauttaa None, jos tietoja ei ole tai ne ovat vanhempia kuin ``max_age`` sekuntia.
+    """
     import json
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection(readonly=True)
     try:
-        row = conn.execute("SELECT data, synced_at FROM eu_cache WHERE id = 1").fetchone()
+        row = conn.execute("SELECT data, fetched_at FROM fundamentals WHERE symbol=?", (symbol,)).fetchone()
     finally:
         conn.close()
-    if row:
-        return json.loads(row[0]), row[1]
-    return None, None
+    if row is None:
+        return None
+    if max_age is not None:
+        age = (datetime.now() - datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S")).total_seconds()
+        if not 0 <= age < max_age:
+            return None
+    return json.loads(row[0])
 
 # --- Omat rahastot -funktiot ---
 
 def get_funds(user_id: int) -> list[dict]:
     """Palauttaa käyttäjän kaikki rahastot listana."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection(readonly=True)
     try:
         rows = conn.execute(
             "SELECT id, name, isin, notes, created_at FROM funds WHERE user_id=? ORDER BY name",
@@ -1125,7 +1872,7 @@ def get_funds(user_id: int) -> list[dict]:
 
 def add_fund(user_id: int, name: str, isin: str, notes: str) -> tuple[bool, str]:
     """Lisää uuden rahaston. Palauttaa (onnistui, viesti)."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute(
             "INSERT INTO funds (user_id, name, isin, notes, created_at) VALUES (?,?,?,?,?)",
@@ -1140,7 +1887,7 @@ def add_fund(user_id: int, name: str, isin: str, notes: str) -> tuple[bool, str]
 
 def delete_fund(fund_id: int) -> None:
     """Poistaa rahaston ja kaikki sen NAV-kirjaukset."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute("DELETE FROM fund_nav WHERE fund_id=?", (fund_id,))
         conn.execute("DELETE FROM funds WHERE id=?", (fund_id,))
@@ -1150,7 +1897,7 @@ def delete_fund(fund_id: int) -> None:
 
 def add_fund_nav(fund_id: int, nav: float, nav_date: str) -> tuple[bool, str]:
     """Lisää tai päivittää NAV-arvon tietylle päivämäärälle. Palauttaa (onnistui, viesti)."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute(
             """
@@ -1169,7 +1916,7 @@ def add_fund_nav(fund_id: int, nav: float, nav_date: str) -> tuple[bool, str]:
 
 def get_fund_nav_history(fund_id: int) -> pd.DataFrame:
     """Palauttaa rahaston NAV-historian DataFramena (nav_date, nav)."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection(readonly=True)
     try:
         df = pd.read_sql(
             "SELECT nav_date, nav FROM fund_nav WHERE fund_id=? ORDER BY nav_date",
@@ -1181,7 +1928,7 @@ def get_fund_nav_history(fund_id: int) -> pd.DataFrame:
 
 def delete_fund_nav(fund_id: int, nav_date: str) -> None:
     """Poistaa yhden NAV-kirjauksen."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute("DELETE FROM fund_nav WHERE fund_id=? AND nav_date=?", (fund_id, nav_date))
         conn.commit()
@@ -1190,7 +1937,7 @@ def delete_fund_nav(fund_id: int, nav_date: str) -> None:
 
 def get_stocks(portfolio_id: int = 1) -> pd.DataFrame:
     """Hakee salkun osakkeet tietokannasta."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection(readonly=True)
     try:
         df = pd.read_sql(
             "SELECT * FROM stocks WHERE portfolio_id = ? ORDER BY symbol",
@@ -1200,9 +1947,18 @@ def get_stocks(portfolio_id: int = 1) -> pd.DataFrame:
         conn.close()
     return df
 
+def get_portfolio_symbols() -> list[str]:
+    """Palauttaa kaikkien käyttäjien kaikkien salkkujen tunnukset (ilman toistoja)."""
+    conn = get_connection(readonly=True)
+    try:
+        rows = conn.execute("SELECT DISTINCT symbol FROM stocks ORDER BY symbol").fetchall()
+    finally:
+        conn.close()
+    return [r[0] for r in rows]
+
 def add_stock(symbol: str, portfolio_id: int = 1) -> tuple[bool, str]:
     """Lisää osakkeen tietokantaan. Palauttaa (onnistui, viesti)."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute(
             "INSERT INTO stocks (symbol, portfolio_id, added_at) VALUES (?, ?, ?)",
@@ -1219,7 +1975,7 @@ def add_stock(symbol: str, portfolio_id: int = 1) -> tuple[bool, str]:
 
 def delete_stock(symbol: str, portfolio_id: int = 1) -> None:
     """Poistaa osakkeen tietokannasta."""
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     try:
         conn.execute("DELETE FROM stocks WHERE symbol = ? AND portfolio_id = ?", (symbol, portfolio_id))
         conn.commit()
@@ -1234,7 +1990,7 @@ def add_stocks_bulk(symbols: list[str], portfolio_id: int = 1) -> tuple[int, int
     added = 0
     skipped = 0
     errors = []
-    conn = sqlite3.connect(DB_NAME)
+    conn = get_connection()
     c = conn.cursor()
     for raw in symbols:
         symbol = raw.strip().upper()
@@ -1263,47 +2019,1919 @@ def parse_symbols_from_text(text: str) -> list[str]:
     tokens = re.split(r"[\s,;]+", text)
     return [t.strip().upper() for t in tokens if t.strip()]
 
-# --- Tekninen analyysi ---
-@st.cache_data(ttl=300)
-def fetch_stock_data(symbol: str, period: str = "6mo") -> tuple[pd.DataFrame, dict]:
-    """Hakee osakekurssit ja info Yahoosta (välimuistissa 5 min).
-    Yrittää uudelleen enintään 3 kertaa exponential backoffilla rate limit -virheiden varalta.
+# --- Yahoo-hakujen rajoitus ja rinnakkaisuus ---
+# Kaikki Yahoo-pyynnöt kulkevat yhden prosessinlaajuisen token bucketin kautta,
+# jonka kaikki välilehdet ja istunnot jakavat (st.cache_resource).
+YAHOO_RATE_PER_SEC = 4.0       # keskimääräinen pyyntöbudjetti
+YAHOO_BURST = 20               # hetkellinen purske
+RATE_LIMIT_BACKOFF = 5.0       # 429-vastauksen jälkeinen tauko (s), tuplautuu toistuessa
+RATE_LIMIT_BACKOFF_MAX = 60.0
+FETCH_MAX_WORKERS = 8
+FETCH_THREAD_PREFIX = "yahoo-fetch"
+# Katkaisin: näin monen peräkkäisen katkovirheen jälkeen Yahoota ei kutsuta
+# tauon aikana lainkaan, vaan palvellaan tallennettua dataa
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 60.0        # tauko ennen koekutsua (s), tuplautuu epäonnistuessa
+BREAKER_COOLDOWN_MAX = 900.0
+REVALIDATE_MAX_WORKERS = 2
+REVALIDATE_THREAD_PREFIX = "yahoo-revalidate"
+# Taustapäivitystä yritetään katkovirheillä uudelleen näin monta kertaa
+# (vähintään REVALIDATE_RETRY_DELAY sekunnin välein, muuten katkaisimen tauon mukaan)
+REVALIDATE_MAX_ATTEMPTS = 8
+REVALIDATE_RETRY_DELAY = 5.0
+
+# Yhteys- ja aikakatkaisuvirheiden tunnisteet (yfinance/curl kirjaa ne tekstinä)
+_PROVIDER_ERROR_HINTS = ("timed out", "timeout", "connection", "could not resolve",
+                         "failed to perform", "service unavailable")
+
+def _is_rate_limit_error(exc: Exception) -> bool:
+    """Tunnistaa Yahoo Financen rate limit -virheen (HTTP 429)."""
+    err = str(exc).lower()
+    return "too many requests" in err or "rate limit" in err or "429" in err
+
+class ProviderUnavailable(RuntimeError):
+    """Yahoo-katkaisin on auki: kutsua ei tehty lainkaan."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Yahoo Finance ei vastaa – uusi yritys {retry_after:.0f} s kuluttua")
+        self.retry_after = retry_after
+
+def _is_provider_error(exc: Exception) -> bool:
+    """Tunnistaa palveluntarjoajan katkon: rate limit, yhteys- tai aikakatkaisuvirhe.
+
+    Muut virheet (esim. tuntematon tunnus) tarkoittavat, että Yahoo vastasi.
+    """
+    if isinstance(exc, (ProviderUnavailable, OSError)) or _is_rate_limit_error(exc):
+        return True
+    err = str(exc).lower()
+    return any(hint in err for hint in _PROVIDER_ERROR_HINTS)
+
+class TokenBucket:
+    """Säieturvallinen token bucket -rajoitin globaalilla 429-backoffilla.
+
+    ``acquire`` odottaa kunnes budjetissa on tilaa. ``penalize`` pysäyttää
+    *kaikki* hakijat backoff-ajaksi – yksi rajoitettu kutsu hidastaa koko
+    prosessin, ei vain itseään. ``reward`` nollaa backoffin onnistuneen
+    kutsun jälkeen.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._backoff_level = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Varaa ``tokens`` pyyntöä budjetista. Palauttaa odotetun ajan sekunteina."""
+        tokens = min(float(tokens), float(self.capacity))
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return waited
+                    wait = (tokens - self._tokens) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+    def penalize(self) -> float:
+        """Kirjaa 429-vastauksen: tyhjentää budjetin ja estää kaikki haut backoff-ajaksi."""
+        with self._lock:
+            self._backoff_level += 1
+            delay = min(RATE_LIMIT_BACKOFF * 2 ** (self._backoff_level - 1), RATE_LIMIT_BACKOFF_MAX)
+            now = self._clock()
+            self._blocked_until = max(self._blocked_until, now + delay)
+            self._tokens = 0.0
+            self._updated = now
+            return delay
+
+    def reward(self) -> None:
+        """Nollaa backoff-tason onnistuneen kutsun jälkeen."""
+        with self._lock:
+            self._backoff_level = 0
+
+class CircuitBreaker:
+    """Säieturvallinen katkaisin palveluntarjoajan katkoja varten.
+
+    Suljettuna kutsut kulkevat normaalisti. ``threshold`` peräkkäisen
+    katkovirheen jälkeen katkaisin aukeaa: ``check`` nostaa heti
+    ProviderUnavailable-virheen ilman verkkokutsua tai odotusta, joten
+    katkon aikana vasteaika pysyy tasaisena. Tauon jälkeen yksi koekutsu
+    päästetään läpi (puoliavoin tila); onnistuminen sulkee katkaisimen,
+    epäonnistuminen avaa sen uudelleen tuplatulla tauolla.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold: int, cooldown: float, max_cooldown: float | None = None,
+                 clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown or cooldown
+        self._clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._trips = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def _pause(self) -> float:
+        return min(self.cooldown * 2 ** max(self._trips - 1, 0), self.max_cooldown)
+
+    def _open(self) -> None:
+        self._state = self.OPEN
+        self._trips += 1
+        self._opened_at = self._clock()
+        self._failures = 0
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        """Nykytila; avoin katkaisin raportoidaan puoliavoimena, kun koekutsu on sallittu."""
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self._pause():
+                return self.HALF_OPEN
+            return self._state
+
+    def retry_after(self) -> float:
+        """Sekunnit seuraavaan koekutsuun (0 = kutsuja voi yrittää nyt)."""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self._pause() - self._clock())
+
+    def check(self) -> None:
+        """Sallii kutsun tai nostaa ProviderUnavailable-virheen heti."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN:
+                wait = self._opened_at + self._pause() - self._clock()
+                if wait > 0:
+                    raise ProviderUnavailable(wait)
+                self._state = self.HALF_OPEN
+            if self._trial:
+                # Koekutsu on jo kesken: muut eivät odota sitä
+                raise ProviderUnavailable(0.0)
+            self._trial = True
+
+    def record_success(self) -> None:
+        """Kirjaa vastauksen: sulkee katkaisimen ja nollaa laskurit."""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trips = 0
+            self._trial = False
+
+    def record_failure(self) -> None:
+        """Kirjaa katkovirheen; kynnyksen täyttyessä tai koekutsun epäonnistuessa katkaisin aukeaa."""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open()
+            elif self._state == self.CLOSED:
+                self._failures += 1
+                if self._failures >= self.threshold:
+                    self._open()
+
+@st.cache_resource
+def _get_yahoo_limiter() -> TokenBucket:
+    """Palauttaa prosessinlaajuisen Yahoo-rajoittimen."""
+    return TokenBucket(YAHOO_RATE_PER_SEC, YAHOO_BURST)
+
+@st.cache_resource
+def _get_yahoo_breaker() -> CircuitBreaker:
+    """Palauttaa prosessinlaajuisen Yahoo-katkaisimen."""
+    return CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN, BREAKER_COOLDOWN_MAX)
+
+def yahoo_available() -> bool:
+    """True, kun Yahoo-katkaisin on kiinni (haut kulkevat normaalisti)."""
+    return _get_yahoo_breaker().state == CircuitBreaker.CLOSED
+
+@st.cache_resource
+def _get_fetch_executor() -> ThreadPoolExecutor:
+    """Palauttaa prosessinlaajuisen, rajatun säiepoolin Yahoo-hakuja varten."""
+    return ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS, thread_name_prefix=FETCH_THREAD_PREFIX)
+
+def _yahoo_call(fn, *args, cost: float = 1.0, max_retries: int = 3, **kwargs):
+    """Kutsuu Yahoo-hakufunktiota katkaisimen ja rajoittimen läpi.
+
+    Avoin katkaisin nostaa heti ProviderUnavailable-virheen. Rate limit
+    -virheellä rajoitin asetetaan globaaliin backoffiin ja kutsua yritetään
+    uudelleen enintään ``max_retries`` kertaa, ellei katkaisin ehdi aueta.
+    Katkovirheet kirjataan katkaisimeen; kaikki virheet nousevat lopulta.
     """
-    max_retries = 3
+    breaker = _get_yahoo_breaker()
+    limiter = _get_yahoo_limiter()
     for attempt in range(max_retries):
+        breaker.check()
+        limiter.acquire(cost)
         try:
-            stock = yf.Ticker(symbol)
-            df = stock.history(period=period)
-            info = stock.info
-            return df, info
+            result = fn(*args, **kwargs)
         except Exception as e:
-            err = str(e).lower()
-            if "too many requests" in err or "rate limit" in err or "429" in err:
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt + 1)  # 2s, 3s, 5s
-                    continue
+            if not _is_provider_error(e):
+                breaker.record_success()  # Yahoo vastasi, esim. tuntematon tunnus
+                raise
+            breaker.record_failure()
+            if _is_rate_limit_error(e) and attempt < max_retries - 1:
+                limiter.penalize()
+                continue
             raise
-    stock = yf.Ticker(symbol)
-    return stock.history(period=period), stock.info
+        breaker.record_success()
+        limiter.reward()
+        return result
 
-@st.cache_data(ttl=300)
-def fetch_stock_history(symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
-    """Hakee pitkän historian backtestingiä varten (välimuistissa 5 min).
-    Yrittää uudelleen enintään 3 kertaa rate limit -virheiden varalta.
+class SingleFlight:
+    """Yhdistää samanaikaiset samanavaimiset kutsut yhdeksi suoritukseksi.
+
+    Ensimmäinen kutsuja (johtaja) suorittaa funktion; saman avaimen kutsujat,
+    jotka saapuvat sen ollessa kesken, odottavat ja saavat saman tuloksen tai
+    poikkeuksen. Valmistumisen jälkeen avain vapautuu, joten seuraava kutsu
+    suoritetaan taas normaalisti – tämä ei ole välimuisti.
     """
-    max_retries = 3
-    for attempt in range(max_retries):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Suorittaa ``fn(*args, **kwargs)`` tai odottaa kesken olevaa samanavaimista kutsua."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = {"done": threading.Event(), "result": None, "error": None}
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            flight["done"].wait()
+            if flight["error"] is not None:
+                raise flight["error"]
+            return flight["result"]
         try:
-            stock = yf.Ticker(symbol)
-            return stock.history(start=start_date, end=end_date)
-        except Exception as e:
-            err = str(e).lower()
-            if "too many requests" in err or "rate limit" in err or "429" in err:
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt + 1)
+            flight["result"] = fn(*args, **kwargs)
+            return flight["result"]
+        except BaseException as e:
+            flight["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight["done"].set()
+
+    def in_flight(self) -> int:
+        """Kesken olevien avainten määrä."""
+        with self._lock:
+            return len(self._flights)
+
+@st.cache_resource
+def _get_single_flight() -> SingleFlight:
+    """Palauttaa prosessinlaajuisen SingleFlight-koordinaattorin Yahoo-hakuja varten."""
+    return SingleFlight()
+
+class _DaemonExecutor:
+    """Kiinteä joukko daemon-säikeitä jonon perässä (``submit``-rajapinta).
+
+    ThreadPoolExecutor odottaa työsäikeitään tulkin sammuessa, jolloin
+    katkon aikana uusintaa odottava taustapäivitys pitäisi CLI:n ja
+    synkronointiajon käynnissä minuutteja. Daemon-säikeet eivät estä
+    sammumista; keskeneräinen päivitys ajetaan seuraavalla käynnistyksellä.
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = ""):
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._max_workers = max_workers
+        self._prefix = thread_name_prefix
+        self._threads: list = []
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> None:
+        self._queue.put((fn, args, kwargs))
+        with self._lock:
+            if len(self._threads) < self._max_workers:
+                thread = threading.Thread(target=self._worker, daemon=True,
+                                          name=f"{self._prefix}_{len(self._threads)}")
+                self._threads.append(thread)
+                thread.start()
+
+    def _worker(self) -> None:
+        while True:
+            fn, args, kwargs = self._queue.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception:  # noqa: BLE001
+                pass
+
+class BackgroundRevalidator:
+    """Päivittää vanhentuneena palvellun datan taustalla (stale-while-revalidate).
+
+    ``schedule`` palaa heti; sama avain on jonossa kerrallaan vain kerran.
+    Tehtävä odottaa ensin katkaisimen koekutsun hetkeen (``retry_after``),
+    joten katkon aikana uusintayrityksiä ei kasaannu. Katkovirheellä
+    (myös hävitty koekutsu, ProviderUnavailable(0)) yritetään uudelleen
+    enintään ``max_attempts`` kertaa; vasta sitten päivitys lasketaan
+    ``failed``-laskuriin ja seuraava vanhentuneen datan palvelu ajastaa sen
+    uudelleen (vanhentunutta tulosta ei tallenneta välimuistiin).
+    """
+
+    def __init__(self, executor=None, retry_after=lambda: 0.0, sleep=time.sleep,
+                 max_attempts: int = REVALIDATE_MAX_ATTEMPTS, retry_delay: float = REVALIDATE_RETRY_DELAY):
+        self._executor = executor or _DaemonExecutor(
+            REVALIDATE_MAX_WORKERS, thread_name_prefix=REVALIDATE_THREAD_PREFIX)
+        self._retry_after = retry_after
+        self._sleep = sleep
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._pending: set = set()
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    def schedule(self, key, fn, *args, **kwargs) -> bool:
+        """Ajastaa ``fn(*args, **kwargs)``-päivityksen. False, jos avain on jo jonossa."""
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        self._executor.submit(self._run, key, fn, args, kwargs)
+        return True
+
+    def _run(self, key, fn, args, kwargs) -> None:
+        try:
+            for attempt in range(self.max_attempts):
+                wait = self._retry_after()
+                if attempt:
+                    wait = max(wait, self.retry_delay)
+                if wait > 0:
+                    self._sleep(wait)
+                try:
+                    fn(*args, **kwargs)
+                except Exception as e:
+                    if not _is_provider_error(e) or attempt == self.max_attempts - 1:
+                        raise
+                    with self._lock:
+                        self.retried += 1
                     continue
+                with self._lock:
+                    self.completed += 1
+                return
+        except Exception:  # noqa: BLE001
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def pending(self) -> int:
+        """Jonossa olevien päivitysten määrä."""
+        with self._lock:
+            return len(self._pending)
+
+@st.cache_resource
+def _get_revalidator() -> BackgroundRevalidator:
+    """Palauttaa prosessinlaajuisen taustapäivittäjän vanhentuneelle datalle."""
+    return BackgroundRevalidator(retry_after=lambda: _get_yahoo_breaker().retry_after())
+
+# Vanhentuneen (katkon aikana tallennetusta varastosta palvellun) datan merkintä:
+# DataFramen attrs-avain tai perustietosanakirjan avain
+STALE_KEY = "_stale"
+
+def mark_stale(data):
+    """Merkitsee kurssi-DataFramen (paikan päällä) tai perustiedot (kopio) vanhentuneiksi."""
+    if isinstance(data, pd.DataFrame):
+        data.attrs[STALE_KEY] = True
+        return data
+    return {**data, STALE_KEY: True}
+
+def is_stale(data) -> bool:
+    """True, jos data on merkitty vanhentuneeksi mark_stale-funktiolla."""
+    if isinstance(data, pd.DataFrame):
+        return bool(data.attrs.get(STALE_KEY))
+    return bool(data) and bool(data.get(STALE_KEY))
+
+def fetch_parallel(func, items, *args, **kwargs) -> list:
+    """Ajaa ``func(item, *args, **kwargs)`` jokaiselle alkiolle jaetussa säiepoolissa.
+
+    Palauttaa tulokset syötteen järjestyksessä. Jos kutsu nostaa poikkeuksen,
+    tuloslistassa on sen kohdalla poikkeusolio. Poolin omista säikeistä
+    kutsuttaessa ajetaan suoraan samassa säikeessä (ei sisäkkäistä odotusta).
+
+    Poolin säikeillä ei ole ScriptRunContextia, joten ``func`` ei saa olla
+    st.cache_data-funktio eikä kutsua sellaista: rinnakkain ajetaan vain
+    raakahaut (refresh_price_bars, prefetch_stock_info) ja välimuistitetut
+    kääreet kutsutaan sen jälkeen skriptisäikeessä (call_each).
+    """
+    items = list(items)
+    if threading.current_thread().name.startswith(FETCH_THREAD_PREFIX):
+        results = []
+        for item in items:
+            try:
+                results.append(func(item, *args, **kwargs))
+            except Exception as e:  # noqa: BLE001
+                results.append(e)
+        return results
+
+    executor = _get_fetch_executor()
+    futures = [executor.submit(func, item, *args, **kwargs) for item in items]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:  # noqa: BLE001
+            results.append(e)
+    return results
+
+def call_each(func, items, *args, **kwargs) -> list:
+    """Kuten fetch_parallel, mutta peräkkäin kutsujan säikeessä (st.cache_data-funktioille).
+
+    Palauttaa tulokset syötteen järjestyksessä; poikkeukset tuloslistan alkioina.
+    """
+    results = []
+    for item in items:
+        try:
+            results.append(func(item, *args, **kwargs))
+        except Exception as e:  # noqa: BLE001
+            results.append(e)
+    return results
+
+
+# --- Indikaattorit (NumPy) ---
+# Kaikki indikaattorit lasketaan yhdellä compute_indicators-kutsulla NumPy-
+# taulukoilla. Syöte voi olla yksi hintasarja (1-D) tai hintapaneeli
+# (päivät × tunnukset, 2-D), jolloin koko pörssilista lasketaan kerralla.
+#
+# Tarkkuus: tulokset vastaavat ta-kirjaston RSIIndicator-, MACD- ja
+# BollingerBands-arvoja sekä pandasin rolling().mean()-arvoja absoluuttisella
+# toleranssilla INDICATOR_TOLERANCE. Erot syntyvät vain liukulukujen
+# laskujärjestyksestä (lohkottu EMA, kumulatiiviset summat).
+#
+# Paneelin sarakkeissa saa olla NaN-arvoja vain alussa (lyhyempi historia);
+# sarakkeen sisäisiä aukkoja ei tueta, joten eri pörssien sarjat tasataan
+# loppupäästä (build_close_panel) tai aukot täytetään ennen laskentaa.
+INDICATOR_TOLERANCE = 1e-6
+INDICATOR_COLUMNS = ["RSI", "SMA50", "SMA200", "MACD", "MACD_signal", "BB_upper", "BB_lower", "BB_mid"]
+
+def _as_panel(values) -> tuple[np.ndarray, bool]:
+    """Muuntaa syötteen 2-D float-taulukoksi. Palauttaa (paneeli, oliko syöte 1-D)."""
+    arr = np.asarray(values, dtype=float)
+    if arr.ndim == 1:
+        return arr[:, None], True
+    return arr, False
+
+def _first_valid(x: np.ndarray) -> np.ndarray:
+    """Palauttaa sarakkeittain ensimmäisen ei-NaN-rivin indeksin (rivimäärä jos ei yhtään)."""
+    valid = ~np.isnan(x)
+    return np.where(valid.any(axis=0), valid.argmax(axis=0), x.shape[0])
+
+def _mask_warmup(out: np.ndarray, first: np.ndarray, min_periods: int) -> np.ndarray:
+    """Asettaa NaN:ksi rivit, joilla sarakkeen havaintoja on alle ``min_periods``."""
+    rows = np.arange(out.shape[0])[:, None]
+    out[rows < (first + min_periods - 1)[None, :]] = np.nan
+    return out
+
+def _ema_panel(x: np.ndarray, alpha: float, min_periods: int) -> np.ndarray:
+    """Eksponentiaalinen liukuva keskiarvo sarakkeittain (pandas ewm, adjust=False).
+
+    Rekursio y[t] = (1 - a) * y[t-1] + a * x[t] lasketaan lohkoittain
+    suljetussa muodossa kumulatiivisella summalla, joten silmukka kulkee
+    lohkojen (ei rivien) yli. Jokainen sarake alkaa omasta ensimmäisestä arvostaan.
+    """
+    n, m = x.shape
+    first = _first_valid(x)
+    # Alun NaN:t täytetään ensimmäisellä arvolla: vakiosarjan EMA pysyy samana,
+    # joten rekursio on ensimmäisestä arvosta eteenpäin sama kuin ilman täyttöä.
+    lead = np.arange(n)[:, None] < first[None, :]
+    seed = x[np.minimum(first, n - 1), np.arange(m)]
+    filled = np.where(lead, seed[None, :], x)
+
+    decay = 1.0 - alpha
+    if decay <= 0.0:
+        out = filled.copy()
+    else:
+        # Lohkon pituus rajataan niin, ettei (1 - a)^-k ylivuoda
+        block = int(max(1, min(256, 300 // -np.log(decay))))
+        powers = decay ** np.arange(1, block + 1)[:, None]
+        out = np.empty_like(filled)
+        carry = filled[0].copy() if n else np.zeros(m)
+        for start in range(0, n, block):
+            chunk = filled[start:start + block]
+            p = powers[:len(chunk)]
+            y = p * (carry + alpha * np.cumsum(chunk / p, axis=0))
+            out[start:start + len(chunk)] = y
+            carry = y[-1]
+    return _mask_warmup(out, first, min_periods)
+
+def _rolling_moments(x: np.ndarray, window: int, with_std: bool = False) -> tuple[np.ndarray, np.ndarray | None]:
+    """Liukuva keskiarvo (ja populaatiokeskihajonta, ddof=0) sarakkeittain.
+
+    Ikkuna on validi vain, kun siinä on ``window`` havaintoa (min_periods=window).
+    Summat lasketaan sarakkeen ensimmäiseen arvoon keskitettyinä tarkkuuden vuoksi.
+    """
+    n, m = x.shape
+    mean = np.full((n, m), np.nan)
+    std = np.full((n, m), np.nan) if with_std else None
+    if n < window:
+        return mean, std
+    valid = ~np.isnan(x)
+    first = _first_valid(x)
+    ref = np.where(first < n, x[np.minimum(first, n - 1), np.arange(m)], 0.0)
+    z = np.where(valid, x - ref[None, :], 0.0)
+    zeros = np.zeros((1, m))
+    csum = np.concatenate([zeros, np.cumsum(z, axis=0)])
+    ccount = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    wsum = csum[window:] - csum[:-window]
+    full = (ccount[window:] - ccount[:-window]) == window
+    wmean = wsum / window
+    mean[window - 1:] = np.where(full, wmean + ref[None, :], np.nan)
+    if with_std:
+        csq = np.concatenate([zeros, np.cumsum(z * z, axis=0)])
+        wvar = (csq[window:] - csq[:-window]) / window - wmean ** 2
+        std[window - 1:] = np.where(full, np.sqrt(np.maximum(wvar, 0.0)), np.nan)
+    return mean, std
+
+def _rsi_panel(x: np.ndarray, window: int) -> np.ndarray:
+    """RSI sarakkeittain (Wilder-tasoitus; kuten ta, ensimmäisen päivän muutos on nolla)."""
+    diff = np.diff(x, axis=0, prepend=np.nan)
+    missing = np.isnan(x)
+    up = np.where(missing, np.nan, np.where(diff > 0, diff, 0.0))
+    down = np.where(missing, np.nan, np.where(diff < 0, -diff, 0.0))
+    ema_up = _ema_panel(up, 1.0 / window, window)
+    ema_down = _ema_panel(down, 1.0 / window, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(ema_down == 0, 100.0, 100.0 - 100.0 / (1.0 + ema_up / ema_down))
+
+def compute_indicators(close, rsi_window: int = 14, sma_windows: tuple[int, ...] = (50, 200),
+                       macd_windows: tuple[int, int, int] = (12, 26, 9),
+                       bb_window: int = 20, bb_dev: float = 2.0) -> dict[str, np.ndarray]:
+    """Laskee RSI:n, SMA:t, MACD:n ja Bollinger-kaistat yhdellä kutsulla.
+
+    Args:
+        close: Päätöskurssit, 1-D (päivät) tai 2-D (päivät × tunnukset).
+        rsi_window: RSI-ikkuna (Wilder-tasoitus, alpha = 1 / ikkuna).
+        sma_windows: Liukuvien keskiarvojen ikkunat; avaimet muotoa "SMA50".
+        macd_windows: (nopea, hidas, signaali) EMA-jaksot.
+        bb_window: Bollinger-kaistan ikkuna.
+        bb_dev: Bollinger-kaistan leveys keskihajontoina.
+
+    Returns:
+        Sanakirja {"RSI", "SMA<n>", "MACD", "MACD_signal", "BB_upper",
+        "BB_lower", "BB_mid": taulukko}, taulukot syötteen muotoisia.
+    """
+    x, is_1d = _as_panel(close)
+    out: dict[str, np.ndarray] = {}
+
+    out["RSI"] = _rsi_panel(x, rsi_window)
+
+    for window in sma_windows:
+        out[f"SMA{window}"] = _rolling_moments(x, window)[0]
+
+    fast, slow, sign = macd_windows
+    out["MACD"] = _ema_panel(x, 2.0 / (fast + 1), fast) - _ema_panel(x, 2.0 / (slow + 1), slow)
+    out["MACD_signal"] = _ema_panel(out["MACD"], 2.0 / (sign + 1), sign)
+
+    bb_mid, bb_std = _rolling_moments(x, bb_window, with_std=True)
+    out["BB_mid"] = bb_mid
+    out["BB_upper"] = bb_mid + bb_dev * bb_std
+    out["BB_lower"] = bb_mid - bb_dev * bb_std
+
+    if is_1d:
+        return {key: values[:, 0] for key, values in out.items()}
+    return out
+
+def add_indicators(df: pd.DataFrame, columns=None, symbol: str | None = None) -> pd.DataFrame:
+    """Lisää indikaattorisarakkeet DataFrameen Close-sarakkeen perusteella (muokkaa paikallaan).
+
+    ``columns`` rajaa lisättävät sarakkeet (oletus: kaikki ``INDICATOR_COLUMNS``).
+    Kun ``symbol`` annetaan, arvot haetaan jaetusta indikaattorivälimuistista
+    (indicator_memo), joten sama sarja lasketaan vain kerran kaikille kutsujille.
+    """
+    columns = columns or INDICATOR_COLUMNS
+    if symbol is not None:
+        memo = indicator_memo(symbol, df)
+        for col in columns:
+            df[col] = np.array(_INDICATOR_GETTERS[col](memo))
+        return df
+    values = compute_indicators(df["Close"].to_numpy(dtype=float))
+    for col in columns:
+        df[col] = values[col]
+    return df
+
+def build_close_panel(frames: dict[str, pd.DataFrame], symbols: list[str] | None = None) -> tuple[np.ndarray, list[str]]:
+    """Kokoaa tunnusten päätöskurssit paneeliksi (päivät × tunnukset) loppupäästä tasattuna.
+
+    Jokaisen tunnuksen viimeinen rivi on paneelin viimeisellä rivillä ja lyhyemmät
+    historiat täytetään alusta NaN-arvoilla. Näin eri pörssien pyhäpäivät eivät
+    luo sarjoihin aukkoja ja viimeisen rivin arvot vastaavat tunnuskohtaista laskentaa.
+    """
+    symbols = [s for s in (symbols or list(frames)) if s in frames]
+    length = max((len(frames[s]) for s in symbols), default=0)
+    panel = np.full((length, len(symbols)), np.nan)
+    for j, symbol in enumerate(symbols):
+        close = frames[symbol]["Close"].to_numpy(dtype=float)
+        if len(close):
+            panel[length - len(close):, j] = close
+    return panel, symbols
+
+def latest_indicators(frames: dict[str, pd.DataFrame], **params) -> dict[str, dict[str, float | None]]:
+    """Laskee koko tunnusjoukon indikaattorit yhdellä vektoroidulla kutsulla.
+
+    Palauttaa {tunnus: {indikaattori: viimeisin arvo tai None}}.
+    """
+    panel, symbols = build_close_panel(frames)
+    if not symbols:
+        return {}
+    values = compute_indicators(panel, **params)
+    latest = {key: arr[-1] for key, arr in values.items()}
+    return {
+        symbol: {key: (float(row[j]) if not np.isnan(row[j]) else None) for key, row in latest.items()}
+        for j, symbol in enumerate(symbols)
+    }
+
+class _IndicatorMemo:
+    """Hintasarjan (1-D) tai hintapaneelin (päivät × tunnukset) indikaattorit parametreittain muistettuna.
+
+    Optimoinnissa sama ikkuna toistuu monessa parametriyhdistelmässä; memo
+    laskee kunkin (indikaattori, ikkuna) -parin vain kerran. ``columns``
+    (DataFrame) antaa valmiiksi lasketut oletusparametrien sarakkeet
+    (RSI, SMA50, BB_upper, …), joita käytetään uudelleenlaskennan sijaan.
+    """
+
+    def __init__(self, close, columns: pd.DataFrame | None = None):
+        self.close = np.asarray(close, dtype=float)
+        self._x, self._is_1d = _as_panel(self.close)
+        self._cache: dict[tuple, np.ndarray] = {}
+        if columns is not None:
+            preset = {
+                ("rsi", 14): "RSI", ("sma", 50): "SMA50", ("sma", 200): "SMA200",
+                ("bb_upper", 20, 2.0): "BB_upper", ("bb_lower", 20, 2.0): "BB_lower",
+                ("macd", 12, 26): "MACD", ("macd_signal", 12, 26, 9): "MACD_signal",
+            }
+            for key, col in preset.items():
+                if col in columns.columns:
+                    self._cache[key] = columns[col].to_numpy(dtype=float)
+
+    def _shape(self, panel: np.ndarray) -> np.ndarray:
+        """Palauttaa paneelin syötteen muotoisena (1-D syötteelle yksi sarake)."""
+        return panel[:, 0] if self._is_1d else panel
+
+    def _get(self, key: tuple, compute) -> np.ndarray:
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def rsi(self, window: int) -> np.ndarray:
+        return self._get(("rsi", window), lambda: self._shape(_rsi_panel(self._x, window)))
+
+    def sma(self, window: int) -> np.ndarray:
+        return self._get(("sma", window), lambda: self._moments(window)[0])
+
+    def _moments(self, window: int) -> tuple[np.ndarray, np.ndarray]:
+        key = ("moments", window)
+        if key not in self._cache:
+            mean, std = _rolling_moments(self._x, window, with_std=True)
+            self._cache[key] = (self._shape(mean), self._shape(std))
+            self._cache.setdefault(("sma", window), self._shape(mean))
+        return self._cache[key]
+
+    def bollinger(self, window: int, dev: float) -> tuple[np.ndarray, np.ndarray]:
+        """Palauttaa (yläkaista, alakaista)."""
+        upper = self._get(("bb_upper", window, dev), lambda: self._moments(window)[0] + dev * self._moments(window)[1])
+        lower = self._get(("bb_lower", window, dev), lambda: self._moments(window)[0] - dev * self._moments(window)[1])
+        return upper, lower
+
+    def ema(self, span: int) -> np.ndarray:
+        return self._get(("ema", span), lambda: self._shape(_ema_panel(self._x, 2.0 / (span + 1), span)))
+
+    def macd(self, fast: int, slow: int, signal: int) -> tuple[np.ndarray, np.ndarray]:
+        """Palauttaa (MACD, signaaliviiva)."""
+        line = self._get(("macd", fast, slow), lambda: self.ema(fast) - self.ema(slow))
+        sig = self._get(
+            ("macd_signal", fast, slow, signal),
+            lambda: self._shape(_ema_panel(_as_panel(line)[0], 2.0 / (signal + 1), signal)),
+        )
+        return line, sig
+
+
+# --- Jaettu indikaattorivälimuisti ---
+# Analyysi, backtest, signaalit ja kaaviot käyttävät samaa tunnuskohtaista
+# _IndicatorMemo-oliota, joka muistaa jokaisen (indikaattori, parametrit)
+# -parin. Memo valitaan sarjan sormenjäljellä (tunnus, ensimmäinen ja viimeinen
+# päivä, rivimäärä, ensimmäinen ja viimeinen päätöskurssi): uusi päivä,
+# keskeneräisen päivän kurssimuutos tai osinkokorjaus vaihtaa avaimen.
+# Pörssilista käyttää omaa inkrementaalista tilaansa (streaming_indicators).
+INDICATOR_CACHE_SIZE = 128
+
+# INDICATOR_COLUMNS-sarakkeet _IndicatorMemo-kutsuina (compute_indicators-oletusparametrit)
+_INDICATOR_GETTERS = {
+    "RSI": lambda memo: memo.rsi(14),
+    "SMA50": lambda memo: memo.sma(50),
+    "SMA200": lambda memo: memo.sma(200),
+    "MACD": lambda memo: memo.macd(12, 26, 9)[0],
+    "MACD_signal": lambda memo: memo.macd(12, 26, 9)[1],
+    "BB_upper": lambda memo: memo.bollinger(20, 2.0)[0],
+    "BB_lower": lambda memo: memo.bollinger(20, 2.0)[1],
+    "BB_mid": lambda memo: memo.sma(20),
+}
+
+def _series_key(symbol: str, df: pd.DataFrame, column: str = "Close") -> tuple:
+    """Sarjan sormenjälki: päivät indeksistä tai Date-sarakkeesta (reset_index)."""
+    if len(df) == 0:
+        return (symbol, None, None, 0, None, None)
+    dates = df["Date"].iloc if "Date" in df.columns else df.index
+    close = df[column]
+    return (symbol, str(dates[0])[:10], str(dates[-1])[:10], len(df),
+            float(close.iloc[0]), float(close.iloc[-1]))
+
+class IndicatorCache:
+    """Säieturvallinen LRU-välimuisti tunnusten _IndicatorMemo-olioille.
+
+    Rinnakkaiset ensimmäiset kutsut samalle indikaattorille voivat laskea sen
+    kahdesti, mutta tulos on sama; memo-olio itse on aina yksi per sarja.
+    """
+
+    def __init__(self, max_entries: int = INDICATOR_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._memos: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def memo(self, symbol: str, df: pd.DataFrame) -> "_IndicatorMemo":
+        """Palauttaa sarjan memon; luo uuden ja poistaa vanhimman tarvittaessa."""
+        key = _series_key(symbol, df)
+        with self._lock:
+            memo = self._memos.get(key)
+            if memo is not None:
+                self._memos.move_to_end(key)
+                self.hits += 1
+                return memo
+            self.misses += 1
+            memo = self._memos[key] = _IndicatorMemo(df["Close"].to_numpy(dtype=float, copy=True))
+            while len(self._memos) > self.max_entries:
+                self._memos.popitem(last=False)
+            return memo
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._memos)
+
+@st.cache_resource
+def _get_indicator_cache() -> IndicatorCache:
+    """Palauttaa prosessinlaajuisen indikaattorivälimuistin."""
+    return IndicatorCache()
+
+def indicator_memo(symbol: str, df: pd.DataFrame) -> "_IndicatorMemo":
+    """Tunnuksen sarjan jaettu _IndicatorMemo (df: Close ja päivät indeksinä tai Date-sarakkeena)."""
+    return _get_indicator_cache().memo(symbol, df)
+
+
+# --- Jaettu kehysvarasto ---
+# Analyysin ja backtestin tulokset sisältävät vain skalaariyhteenvedon ja
+# kahvan ("frames") prosessinlaajuiseen FrameStore-varastoon, jossa DataFramet
+# ja kauppahistoriat ovat kaikkien istuntojen yhteisiä. Varasto poistaa
+# vanhimmat kehykset tavubudjetin ylittyessä; kaaviot hakevat kehykset
+# laiskasti (result_frames) ja poistettu kehys lasketaan uudelleen kahvan
+# tiedoista. Istunnon oma muisti mitataan (session_memory_usage) ja pidetään
+# budjetissa pudottamalla suurimmat uudelleenajettavat tulokset.
+FRAME_STORE_BUDGET = 256 * 1024 * 1024
+SESSION_MEMORY_BUDGET = 2 * 1024 * 1024
+FRAMES_KEY = "frames"
+# Istuntotilan avaimet, jotka voi pudottaa budjetin ylittyessä (ajetaan uudelleen napilla)
+SESSION_EVICTABLE_KEYS = ("backtest_results", "portfolio_backtest", "optimizer_results")
+
+def estimate_size(obj) -> int:
+    """Arvioi olion muistinkäytön tavuina (DataFramet deep=True, säiliöt rekursiivisesti)."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True, index=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(estimate_size(v) for v in obj)
+    return sys.getsizeof(obj)
+
+class FrameStore:
+    """Säieturvallinen LRU-varasto {kahva: kehykset} tavubudjetilla.
+
+    Uusin lisäys säilyy aina, vaikka se yksin ylittäisi budjetin; muuten
+    vanhimmat poistetaan, kunnes yhteiskoko mahtuu budjettiin.
+    """
+
+    def __init__(self, budget: int = FRAME_STORE_BUDGET):
+        self.budget = budget
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.evictions = 0
+
+    def put(self, handle: tuple, frames: dict) -> tuple:
+        """Tallentaa kehykset kahvalle (korvaa vanhan) ja palauttaa kahvan."""
+        size = estimate_size(frames)
+        with self._lock:
+            old = self._entries.pop(handle, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[handle] = (frames, size)
+            self.bytes += size
+            while self.bytes > self.budget and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return handle
+
+    def get(self, handle: tuple) -> dict | None:
+        """Palauttaa kahvan kehykset tai None, jos ne on poistettu."""
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                return None
+            self._entries.move_to_end(handle)
+            return entry[0]
+
+    def __contains__(self, handle) -> bool:
+        with self._lock:
+            return handle in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+@st.cache_resource
+def _get_frame_store() -> FrameStore:
+    """Palauttaa prosessinlaajuisen kehysvaraston."""
+    return FrameStore()
+
+# Kahvan laji → funktio(*kahvan argumentit), joka laskee kehykset uudelleen ({} = ei onnistunut)
+_FRAME_LOADERS: dict = {}
+
+def _frame_loader(kind: str):
+    """Rekisteröi funktion kahvan lajin kehysten uudelleenlaskijaksi."""
+    def register(func):
+        _FRAME_LOADERS[kind] = func
+        return func
+    return register
+
+def compact_result(result: dict, handle: tuple, keys) -> dict:
+    """Siirtää tuloksen kentät ``keys`` kehysvarastoon ja palauttaa kevyen kopion.
+
+    Args:
+        result: Täysi tulos (esim. backtest_portfolio).
+        handle: (laji, *argumentit); lajilla on oltava _FRAME_LOADERS-laskija.
+        keys: Siirrettävät DataFrame- ja listakentät.
+    Returns:
+        Tuloksen skalaarikentät ja FRAMES_KEY-kahva.
+    """
+    frames = {k: result[k] for k in keys if k in result}
+    compact = {k: v for k, v in result.items() if k not in frames}
+    compact[FRAMES_KEY] = _get_frame_store().put(handle, frames)
+    return compact
+
+def result_frames(result: dict) -> dict:
+    """Hakee tuloksen kehykset varastosta; poistetut lasketaan uudelleen kahvasta.
+
+    Returns:
+        {kenttä: kehys}; tyhjä, jos kahvaa ei ole tai uudelleenlaskenta epäonnistui.
+    """
+    handle = result.get(FRAMES_KEY)
+    if not handle:
+        return {}
+    store = _get_frame_store()
+    frames = store.get(handle)
+    if frames is None:
+        try:
+            frames = _FRAME_LOADERS[handle[0]](*handle[1:])
+        except Exception:  # noqa: BLE001 – kaavio jää näyttämättä, tulos säilyy
+            frames = {}
+        if frames:
+            store.put(handle, frames)
+    return frames
+
+def session_memory_usage(state=None) -> dict[str, int]:
+    """Mittaa istuntotilan avainten koot tavuina (oletus: st.session_state)."""
+    state = st.session_state if state is None else state
+    return {key: estimate_size(state[key]) for key in list(state.keys())}
+
+def _format_bytes(size: float) -> str:
+    """Muotoilee tavumäärän luettavaksi (esim. "1.5 MB")."""
+    for unit in ("B", "kB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def enforce_session_budget(state=None, budget: int = SESSION_MEMORY_BUDGET) -> list[str]:
+    """Pudottaa suurimmat SESSION_EVICTABLE_KEYS-tulokset, kunnes istunto mahtuu budjettiin.
+
+    Returns:
+        Pudotetut avaimet (tyhjä, jos istunto mahtui budjettiin).
+    """
+    state = st.session_state if state is None else state
+    sizes = session_memory_usage(state)
+    total = sum(sizes.values())
+    dropped = []
+    for key in sorted((k for k in SESSION_EVICTABLE_KEYS if k in sizes), key=sizes.get, reverse=True):
+        if total <= budget:
+            break
+        del state[key]
+        total -= sizes[key]
+        dropped.append(key)
+    return dropped
+
+
+# --- Inkrementaalinen indikaattoritila ---
+# Pörssilistan automaattinen päivitys tuo tunnukselle yleensä vain yhden uuden
+# päivän. IndicatorState pitää indikaattorien liukuvan tilan (Wilder-tasoitetut
+# nousut ja laskut, SMA-ikkunoiden summat, MACD:n EMA:t), joten uusi päivä
+# päivittää kaikki arvot vakioajassa. Tila tallennetaan indicator_state-tauluun
+# kurssivaraston rinnalle, joten myös uusi prosessi jatkaa siitä.
+#
+# Viimeinen päivä voi vielä muuttua (pörssi auki), joten sitä ei vahvisteta
+# tilaan: sen arvot lasketaan peek-kutsulla ja päivä vahvistetaan vasta, kun
+# uudempi päivä on saapunut. Arvot vastaavat compute_indicators-laskentaa
+# samasta sarjasta toleranssilla INDICATOR_TOLERANCE.
+
+class IndicatorState:
+    """Yhden tunnuksen indikaattorien liukuva tila (RSI, SMA:t, MACD, Bollinger).
+
+    ``append`` vahvistaa uuden päätöskurssin vakioajassa, ``latest`` palauttaa
+    viimeisimmät arvot ja ``peek`` arvot ikään kuin kurssi olisi lisätty,
+    muuttamatta tilaa. Parametrit ja tulosavaimet vastaavat compute_indicators-funktiota.
+    """
+
+    def __init__(self, rsi_window: int = 14, sma_windows: tuple[int, ...] = (50, 200),
+                 macd_windows: tuple[int, int, int] = (12, 26, 9),
+                 bb_window: int = 20, bb_dev: float = 2.0):
+        self.params = {
+            "rsi_window": rsi_window, "sma_windows": list(sma_windows),
+            "macd_windows": list(macd_windows), "bb_window": bb_window, "bb_dev": bb_dev,
+        }
+        self.count = 0
+        self.last_close: float | None = None
+        self.ref = 0.0  # ensimmäinen kurssi: summat keskitetään siihen tarkkuuden vuoksi
+        self.avg_up = self.avg_down = 0.0
+        self.ema_fast = self.ema_slow = 0.0
+        self.signal = 0.0
+        self.signal_count = 0
+        # Viimeisimmät keskitetyt kurssit pisimmän ikkunan verran
+        self.window: deque = deque(maxlen=max([*sma_windows, bb_window]))
+        self.sums = {w: 0.0 for w in sma_windows}
+
+    def append(self, close: float) -> None:
+        """Vahvistaa seuraavan päivän päätöskurssin tilaan."""
+        x = float(close)
+        fast, slow, sign = self.params["macd_windows"]
+        if self.count == 0:
+            # Kuten ta: ensimmäisen päivän muutos on nolla, EMA:t alkavat ensimmäisestä kurssista
+            self.ref = x
+            self.ema_fast = self.ema_slow = x
+        else:
+            diff = x - self.last_close
+            a = 1.0 / self.params["rsi_window"]
+            self.avg_up = (1.0 - a) * self.avg_up + a * max(diff, 0.0)
+            self.avg_down = (1.0 - a) * self.avg_down + a * max(-diff, 0.0)
+            af, as_ = 2.0 / (fast + 1), 2.0 / (slow + 1)
+            self.ema_fast = (1.0 - af) * self.ema_fast + af * x
+            self.ema_slow = (1.0 - as_) * self.ema_slow + as_ * x
+        self.count += 1
+        self.last_close = x
+
+        if self.count >= slow:
+            macd = self.ema_fast - self.ema_slow
+            asig = 2.0 / (sign + 1)
+            self.signal = macd if self.signal_count == 0 else (1.0 - asig) * self.signal + asig * macd
+            self.signal_count += 1
+
+        z = x - self.ref
+        for w in self.sums:
+            if len(self.window) >= w:
+                self.sums[w] -= self.window[-w]
+            self.sums[w] += z
+        self.window.append(z)
+
+    def latest(self) -> dict[str, float | None]:
+        """Viimeisimmät arvot {"RSI", "SMA<n>", "MACD", "MACD_signal", "BB_*": arvo tai None}."""
+        p = self.params
+        n = self.count
+        out: dict[str, float | None] = {"RSI": None}
+        if n >= p["rsi_window"]:
+            out["RSI"] = 100.0 if self.avg_down == 0 else 100.0 - 100.0 / (1.0 + self.avg_up / self.avg_down)
+        for w, total in self.sums.items():
+            out[f"SMA{w}"] = total / w + self.ref if n >= w else None
+        out["MACD"] = self.ema_fast - self.ema_slow if n >= p["macd_windows"][1] else None
+        out["MACD_signal"] = self.signal if self.signal_count >= p["macd_windows"][2] else None
+        out["BB_upper"] = out["BB_lower"] = out["BB_mid"] = None
+        if n >= p["bb_window"]:
+            recent = np.fromiter(itertools.islice(reversed(self.window), p["bb_window"]), float)
+            mid, std = recent.mean() + self.ref, recent.std()
+            out["BB_mid"] = mid
+            out["BB_upper"] = mid + p["bb_dev"] * std
+            out["BB_lower"] = mid - p["bb_dev"] * std
+        return out
+
+    def peek(self, close: float) -> dict[str, float | None]:
+        """Arvot ikään kuin ``close`` olisi vahvistettu – tila ei muutu."""
+        probe = copy.copy(self)
+        probe.window = self.window.copy()
+        probe.sums = dict(self.sums)
+        probe.append(close)
+        return probe.latest()
+
+    def to_dict(self) -> dict:
+        """JSON-muotoinen tila tallennusta varten."""
+        return {
+            "params": self.params, "count": self.count, "last_close": self.last_close,
+            "ref": self.ref, "avg_up": self.avg_up, "avg_down": self.avg_down,
+            "ema_fast": self.ema_fast, "ema_slow": self.ema_slow,
+            "signal": self.signal, "signal_count": self.signal_count,
+            "window": list(self.window), "sums": {str(w): v for w, v in self.sums.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "IndicatorState":
+        """Palauttaa to_dict-muodossa tallennetun tilan."""
+        params = data["params"]
+        state = cls(params["rsi_window"], tuple(params["sma_windows"]), tuple(params["macd_windows"]),
+                    params["bb_window"], params["bb_dev"])
+        for key in ("count", "last_close", "ref", "avg_up", "avg_down",
+                    "ema_fast", "ema_slow", "signal", "signal_count"):
+            setattr(state, key, data[key])
+        state.window.extend(data["window"])
+        state.sums = {int(w): v for w, v in data["sums"].items()}
+        return state
+
+def load_indicator_states(symbols) -> dict[str, tuple[str, IndicatorState]]:
+    """Lukee tunnusten tallennetut tilat: {tunnus: (viimeinen vahvistettu päivä, tila)}."""
+    import json
+    symbols = list(symbols)
+    if not symbols:
+        return {}
+    conn = get_connection(readonly=True)
+    try:
+        rows = conn.execute(
+            f"SELECT symbol, last_date, state FROM indicator_state "
+            f"WHERE symbol IN ({', '.join('?' * len(symbols))})",
+            symbols,
+        ).fetchall()
+    finally:
+        conn.close()
+    return {symbol: (last_date, IndicatorState.from_dict(json.loads(state)))
+            for symbol, last_date, state in rows}
+
+def save_indicator_states(states: dict[str, tuple[str, IndicatorState]]) -> None:
+    """Tallentaa tilat yhdellä transaktiolla: {tunnus: (viimeinen vahvistettu päivä, tila)}."""
+    import json
+    if not states:
+        return
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_connection()
+    try:
+        conn.executemany(
+            """
+            INSERT INTO indicator_state (symbol, last_date, state, updated_at)
+            VALUES (?,?,?,?)
+            ON CONFLICT(symbol) DO UPDATE SET
+                last_date=excluded.last_date, state=excluded.state, updated_at=excluded.updated_at
+            """,
+            [(symbol, last_date, json.dumps(state.to_dict()), now)
+             for symbol, (last_date, state) in states.items()],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def streaming_indicators(frames: dict[str, pd.DataFrame], **params) -> dict[str, dict[str, float | None]]:
+    """Kuten latest_indicators, mutta jatkaa tunnusten tallennettua IndicatorState-tilaa.
+
+    Vain edellisen vahvistetun päivän jälkeiset päivät käsitellään, ja
+    viimeinen (mahdollisesti keskeneräinen) päivä lasketaan vahvistamatta.
+    Tila rakennetaan kehyksestä uudelleen, jos sitä ei ole, parametrit ovat
+    muuttuneet, vahvistettu päivä puuttuu kehyksestä tai sen päätöskurssi on
+    muuttunut (esim. osinkokorjaus).
+
+    Returns:
+        {tunnus: {indikaattori: viimeisin arvo tai None}}.
+    """
+    symbols = [s for s, df in frames.items() if not df.empty]
+    stored = load_indicator_states(symbols)
+    template = IndicatorState(**params)
+    changed: dict[str, tuple[str, IndicatorState]] = {}
+    latest: dict[str, dict[str, float | None]] = {}
+    for symbol in symbols:
+        close = frames[symbol]["Close"]
+        dates = np.asarray(pd.DatetimeIndex(close.index).strftime("%Y-%m-%d"))
+        values = close.to_numpy(dtype=float)
+        last_date, state = stored.get(symbol, (None, None))
+        pos = int(np.searchsorted(dates, last_date)) if last_date else len(dates)
+        if (state is None or state.params != template.params or pos >= len(dates)
+                or dates[pos] != last_date or values[pos] != state.last_close):
+            state, pos = IndicatorState(**params), -1
+
+        for value in values[pos + 1:-1]:
+            state.append(value)
+        if len(values) - 1 > pos + 1:
+            changed[symbol] = (dates[-2], state)
+        latest[symbol] = state.latest() if pos == len(values) - 1 else state.peek(values[-1])
+    save_indicator_states(changed)
+    return latest
+
+
+# --- Tekninen analyysi ---
+# Kuinka monta tunnusta haetaan yhdellä yf.download-pyynnöllä
+BULK_CHUNK_SIZE = 20
+
+# Fundamentit (P/E, P/B, ROE, markkina-arvo, kuvaus) muuttuvat korkeintaan
+# päivittäin, joten niillä on oma pitkä TTL hintojen 5 minuutin sijaan
+FUNDAMENTALS_TTL = 86400
+
+class _StaleServe(Exception):
+    """Kuljettaa vanhentuneen tuloksen st.cache_data-funktion ohi.
+
+    Välimuisti ei tallenna poikkeuksia, joten katkon aikana palveltu data ei
+    jää välimuistiin koko TTL:n ajaksi Yahoon palattua.
+    """
+
+    def __init__(self, data):
+        super().__init__("stale")
+        self.data = data
+
+@st.cache_data(ttl=FUNDAMENTALS_TTL, show_spinner=False)
+def _cached_stock_info(symbol: str) -> dict:
+    """fetch_stock_info-funktion välimuistikerros: vanhentunut tulos nousee _StaleServe-poikkeuksena."""
+    info = _load_stock_info_shared(symbol)
+    if is_stale(info):
+        raise _StaleServe(info)
+    return info
+
+def fetch_stock_info(symbol: str) -> dict:
+    """Hakee osakkeen perustiedot (Ticker.info) – tietokannasta jos alle vuorokauden vanhat.
+
+    Vanhentuneet tai puuttuvat tiedot haetaan Yahoosta ja tallennetaan
+    ``fundamentals``-tauluun, joten sama tunnus maksaa noin yhden
+    info-pyynnön vuorokaudessa istunnoista ja uudelleenkäynnistyksistä riippumatta.
+    Katkon aikana palautettu vanhentunut tulos ei mene välimuistiin, joten
+    seuraava kutsu yrittää uudelleen ja ajastaa taustapäivityksen.
+    """
+    try:
+        return _cached_stock_info(symbol)
+    except _StaleServe as stale:
+        return stale.data
+
+def prefetch_stock_info(symbols) -> list:
+    """Lataa perustiedot rinnakkain ilman välimuistikääreitä (tietokanta tai Yahoo).
+
+    Tämän jälkeen fetch_stock_info skriptisäikeessä lukee tuoreet tiedot
+    tietokannasta ilman Yahoo-kutsuja.
+
+    Returns:
+        Perustiedot (vanhentuneet merkittyinä) tai poikkeus syötteen järjestyksessä.
+    """
+    return fetch_parallel(_load_stock_info_shared, list(symbols))
+
+def _load_stock_info_shared(symbol: str) -> dict:
+    """_load_stock_info SingleFlightin läpi: samanaikaiset saman tunnuksen haut yhdistetään."""
+    return _get_single_flight().do(("info", symbol), _load_stock_info, symbol)
+
+def _load_stock_info(symbol: str) -> dict:
+    """fetch_stock_info-funktion runko: tietokanta tai Yahoo.
+
+    Yahoon katkon aikana palautetaan viimeisimmät tallennetut tiedot (tai
+    tyhjä sanakirja) vanhentuneeksi merkittynä ja päivitys ajastetaan taustalle.
+    """
+    cached = load_fundamentals(symbol, max_age=FUNDAMENTALS_TTL)
+    if cached is not None:
+        return cached
+    try:
+        info = _yahoo_call(lambda: yf.Ticker(symbol).info)
+    except Exception as e:
+        if not _is_provider_error(e):
             raise
-    return yf.Ticker(symbol).history(start=start_date, end=end_date)
+        _get_revalidator().schedule(("info", symbol), _revalidate_stock_info, symbol)
+        return mark_stale(load_fundamentals(symbol) or {})
+    save_fundamentals(symbol, info)
+    return info
+
+def _revalidate_stock_info(symbol: str) -> None:
+    """Taustapäivitys: hakee perustiedot Yahoosta ja poistaa vanhentuneen välimuistimerkinnän."""
+    save_fundamentals(symbol, _yahoo_call(lambda: yf.Ticker(symbol).info))
+    _cached_stock_info.clear(symbol)
+
+@st.cache_data(ttl=300)
+def _cached_stock_data(symbol: str, period: str) -> tuple[pd.DataFrame, dict]:
+    """fetch_stock_data-funktion välimuistikerros: vanhentunut tulos nousee _StaleServe-poikkeuksena."""
+    df = _get_single_flight().do(("data", symbol, period), get_price_history, symbol, period_start(period))
+    info = fetch_stock_info(symbol)
+    if is_stale(df) or is_stale(info):
+        raise _StaleServe((df, info))
+    return df, info
+
+def fetch_stock_data(symbol: str, period: str = "6mo") -> tuple[pd.DataFrame, dict]:
+    """Hakee osakekurssit (paikallisesta varastosta) ja info Yahoosta (välimuistissa 5 min).
+    Varasto päivitetään delta-haulla; haku kulkee jaetun rajoittimen läpi.
+    Samanaikaiset saman (tunnus, jakso) -parin haut yhdistetään (SingleFlight),
+    myös välimuistin tyhjennyksen jälkeen. Katkon aikana palveltu vanhentunut
+    tulos ei mene välimuistiin, joten taustapäivityksen jälkeen seuraava
+    kutsu saa tuoreen datan.
+    """
+    try:
+        return _cached_stock_data(symbol, period)
+    except _StaleServe as stale:
+        return stale.data
+
+def _split_bulk_download(raw: pd.DataFrame, symbols: list[str]) -> dict[str, pd.DataFrame]:
+    """Pilkkoo yf.download-tuloksen tunnuskohtaisiksi OHLCV-DataFrameiksi.
+
+    Ryhmähaussa päivämäärät ovat kaikkien tunnusten unioni, joten tunnukselle
+    kuulumattomat rivit (esim. toisen pörssin kauppapäivät) ovat NaN-arvoja
+    ja ne pudotetaan. Tunnukset, joille ei löytynyt dataa, jätetään pois.
+    """
+    frames: dict[str, pd.DataFrame] = {}
+    if raw is None or raw.empty:
+        return frames
+
+    for symbol in symbols:
+        if isinstance(raw.columns, pd.MultiIndex):
+            if symbol not in raw.columns.get_level_values(0):
+                continue
+            df = raw[symbol]
+        elif len(symbols) == 1:
+            # Yhden tunnuksen haku voi palauttaa tasaiset sarakkeet
+            df = raw
+        else:
+            continue
+        if "Close" not in df.columns:
+            continue
+        df = df.dropna(subset=["Close"]).rename_axis(columns=None)
+        if not df.empty:
+            frames[symbol] = df
+    return frames
+
+def _download_chunk(chunk: list[str], **kwargs) -> pd.DataFrame:
+    """Yksi yf.download-ryhmähaku. Nostaa virheen, jos Yahoo rajoitti hakua tai ei vastannut.
+
+    yf.download ei nosta poikkeuksia vaan kirjaa tunnuskohtaiset virheet,
+    joten rate limit ja yhteyskatko tunnistetaan niistä, jotta rajoitin ja
+    katkaisin voivat reagoida. Virhesanakirja on prosessinlaajuinen ja
+    rinnakkaiset ryhmät kirjoittavat siihen, joten vain tämän ryhmän
+    tunnusten virheet otetaan huomioon.
+    """
+    raw = yf.download(chunk, group_by="ticker", auto_adjust=True, threads=False, progress=False, **kwargs)
+    shared_errors = dict(getattr(getattr(yf, "shared", None), "_ERRORS", None) or {})
+    wanted = {s.upper() for s in chunk}
+    errors = {sym: msg for sym, msg in shared_errors.items() if str(sym).upper() in wanted}
+    for msg in errors.values():
+        if _is_rate_limit_error(Exception(str(msg))):
+            raise RuntimeError(f"Too Many Requests: {msg}")
+    if raw is None or raw.empty:
+        for msg in errors.values():
+            if _is_provider_error(Exception(str(msg))):
+                raise ConnectionError(f"Yahoo Finance ei vastaa: {msg}")
+    return raw
+
+# Varaston tuoreusikkuna: tätä nuorempaa dataa ei päivitetä Yahoosta
+PRICE_STORE_TTL = 300
+# Suhteellinen ero ankkuripäivän päätöskurssissa, jonka ylittyessä koko
+# historia haetaan uudelleen (osinko- tai splittikorjaus on muuttanut sarjaa)
+ADJUSTMENT_TOLERANCE = 1e-3
+
+def period_start(period: str, today: datetime | None = None) -> str:
+    """Muuntaa yfinance-jakson ("5d", "6mo", "10y", "ytd", "max") alkupäiväksi YYYY-MM-DD."""
+    import re
+    today = pd.Timestamp(today or datetime.now()).normalize()
+    if period == "max":
+        return "1970-01-01"
+    if period == "ytd":
+        return f"{today.year}-01-01"
+    match = re.fullmatch(r"(\d+)(d|wk|mo|y)", period)
+    if not match:
+        raise ValueError(f"Tuntematon jakso: {period}")
+    n, unit = int(match.group(1)), match.group(2)
+    offset = {
+        "d": pd.DateOffset(days=n),
+        "wk": pd.DateOffset(weeks=n),
+        "mo": pd.DateOffset(months=n),
+        "y": pd.DateOffset(years=n),
+    }[unit]
+    return (today - offset).strftime("%Y-%m-%d")
+
+def _plan_price_refresh(symbol: str, start_date: str, now: datetime) -> tuple[str, str | None, float | None] | None:
+    """Päättää, mistä päivästä alkaen tunnuksen kurssit on haettava.
+
+    Palauttaa None, jos varasto kattaa pyynnön ja on tuore. Muuten palauttaa
+    (hakualku, ankkuripäivä, ankkurin päätöskurssi). Täydessä haussa ankkuri on
+    None; delta-haku alkaa toiseksi viimeisestä tallennetusta päivästä, jolloin
+    mahdollisesti kesken ollut viimeinen päivä päivittyy ja valmista
+    ankkuripäivää vertaamalla havaitaan takautuvat osinko-/splittikorjaukset.
+    """
+    meta = get_price_bar_meta(symbol)
+    if meta is None or meta[0] > start_date:
+        return start_date, None, None
+    covered_from, last_date, refreshed_at = meta
+    if refreshed_at:
+        refreshed = datetime.strptime(refreshed_at, "%Y-%m-%d %H:%M:%S")
+        age = (now - refreshed).total_seconds()
+        if 0 <= age < PRICE_STORE_TTL:
+            return None
+        # Suljetun pörssin sulkeutumisen jälkeen haettu data on tuoretta seuraavaan avautumiseen asti
+        exchange = exchange_for_symbol(symbol)
+        if exchange and age >= 0 and data_final_since([exchange], refreshed, now):
+            return None
+    if last_date is None:
+        return start_date, None, None
+
+    conn = get_connection(readonly=True)
+    try:
+        rows = conn.execute(
+            "SELECT date, close FROM price_bars WHERE symbol=? ORDER BY date DESC LIMIT 2",
+            (symbol,)
+        ).fetchall()
+    finally:
+        conn.close()
+    anchor_date, anchor_close = rows[-1]
+    return anchor_date, anchor_date, anchor_close
+
+def _is_readjusted(df: pd.DataFrame | None, anchor_date: str, anchor_close: float) -> bool:
+    """Tarkistaa, poikkeaako uudelleen haettu ankkuripäivän kurssi tallennetusta."""
+    if df is None or df.empty:
+        return False
+    dates = pd.DatetimeIndex(df.index).strftime("%Y-%m-%d")
+    matches = df["Close"].to_numpy()[dates == anchor_date]
+    if len(matches) == 0 or not anchor_close:
+        return False
+    return abs(float(matches[0]) - anchor_close) / abs(anchor_close) > ADJUSTMENT_TOLERANCE
+
+def refresh_price_bars(symbols, start_date: str) -> dict[str, Exception]:
+    """Päivittää tunnusten päiväkurssit paikalliseen varastoon.
+
+    Tunnukset, joiden varasto ei kata ``start_date``-päivää, haetaan kokonaan;
+    muille haetaan vain viimeisimmän tallennetun päivän jälkeiset rivit.
+    Saman hakualun tunnukset ryhmitellään ``BULK_CHUNK_SIZE`` kappaleen
+    ryhmähauiksi. Palauttaa epäonnistuneet haut {tunnus: poikkeus}.
+    """
+    now = datetime.now()
+    groups: dict[str, list[str]] = {}
+    anchors: dict[str, tuple[str | None, float | None]] = {}
+    for symbol in dict.fromkeys(symbols):
+        plan = _plan_price_refresh(symbol, start_date, now)
+        if plan is None:
+            continue
+        fetch_start, anchor_date, anchor_close = plan
+        groups.setdefault(fetch_start, []).append(symbol)
+        anchors[symbol] = (anchor_date, anchor_close)
+
+    jobs = [
+        (fetch_start, group[i:i + BULK_CHUNK_SIZE])
+        for fetch_start, group in groups.items()
+        for i in range(0, len(group), BULK_CHUNK_SIZE)
+    ]
+
+    def _refresh_chunk(job: tuple[str, list[str]]) -> None:
+        fetch_start, chunk = job
+        raw = _yahoo_call(_download_chunk, chunk, start=fetch_start, cost=len(chunk))
+        frames = _split_bulk_download(raw, chunk)
+        for symbol in chunk:
+            df = frames.get(symbol)
+            anchor_date, anchor_close = anchors[symbol]
+            if anchor_date is None:
+                save_price_bars(symbol, df, covered_from=fetch_start)
+            elif _is_readjusted(df, anchor_date, anchor_close):
+                covered_from = get_price_bar_meta(symbol)[0]
+                full = _yahoo_call(_download_chunk, [symbol], start=covered_from)
+                save_price_bars(symbol, _split_bulk_download(full, [symbol]).get(symbol),
+                                covered_from=covered_from, replace=True)
+            else:
+                save_price_bars(symbol, df)
+
+    failures: dict[str, Exception] = {}
+    for (_, chunk), result in zip(jobs, fetch_parallel(_refresh_chunk, jobs)):
+        if isinstance(result, Exception):
+            failures.update({symbol: result for symbol in chunk})
+    return failures
+
+def get_price_history(symbol: str, start_date: str, end_date: str | None = None) -> pd.DataFrame:
+    """Palauttaa tunnuksen päiväkurssit varastosta delta-päivityksen jälkeen.
+
+    Jos päivitys epäonnistuu eikä varastossa ole dataa, virhe nostetaan.
+    Muuten palautetaan tallennetut kurssit vanhentuneeksi merkittyinä
+    (mark_stale) ja päivitys ajastetaan taustalle.
+    """
+    failures = refresh_price_bars([symbol], start_date)
+    df = load_price_bars(symbol, start_date, end_date)
+    if symbol in failures:
+        if df.empty:
+            raise failures[symbol]
+        _get_revalidator().schedule(("bars", symbol, start_date), refresh_price_bars, [symbol], start_date)
+        mark_stale(df)
+    return df
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_prices_bulk(symbols: tuple[str, ...], period: str) -> dict[str, pd.DataFrame]:
+    """fetch_prices_bulk-funktion välimuistikerros: vanhentunut tulos nousee _StaleServe-poikkeuksena."""
+    frames = _load_prices_bulk(symbols, period)
+    if any(is_stale(df) for df in frames.values()):
+        raise _StaleServe(frames)
+    return frames
+
+def fetch_prices_bulk(symbols: tuple[str, ...], period: str = "6mo") -> dict[str, pd.DataFrame]:
+    """Palauttaa usean tunnuksen OHLCV-datan paikallisesta varastosta (välimuistissa 5 min).
+
+    Jos yksikin tunnus palvellaan vanhentuneena, tulosta ei tallenneta
+    välimuistiin (ks. _load_prices_bulk).
+    """
+    try:
+        return _cached_prices_bulk(tuple(symbols), period)
+    except _StaleServe as stale:
+        return stale.data
+
+def _load_prices_bulk(symbols: tuple[str, ...], period: str) -> dict[str, pd.DataFrame]:
+    """Palauttaa usean tunnuksen OHLCV-datan paikallisesta varastosta (välimuistissa 5 min).
+
+    Varasto päivitetään ensin ``refresh_price_bars``-funktiolla, joka hakee
+    puuttuvat päivät ryhmitetyillä ``yf.download``-pyynnöillä; lämmin päivitys
+    maksaa yhden pienen delta-haun tunnusta kohden. Palauttaa sanakirjan
+    {tunnus: DataFrame} (samat sarakkeet kuin ``Ticker.history``); tunnukset
+    ilman dataa jätetään pois. Tunnukset, joiden päivitys epäonnistui mutta
+    varastossa on dataa, palautetaan vanhentuneiksi merkittyinä (mark_stale)
+    ja niiden päivitys ajastetaan taustalle.
+    """
+    start = period_start(period)
+    failures = refresh_price_bars(symbols, start)
+    frames: dict[str, pd.DataFrame] = {}
+    for symbol in symbols:
+        df = load_price_bars(symbol, start)
+        if not df.empty:
+            frames[symbol] = mark_stale(df) if symbol in failures else df
+    stale = tuple(sorted(s for s in failures if s in frames))
+    if stale:
+        _get_revalidator().schedule(("bars", stale, start), refresh_price_bars, stale, start)
+    return frames
+
+# --- Pörssilistojen seulontamoottori ---
+# Jokainen pörssilista on yksi SCREENER_MARKETS-merkintä. Uusi markkina
+# (esim. Tukholma) vaatii vain merkinnän ja käännökset "<avain>_header",
+# "<avain>_count" ja "tab_<avain>"; puuttuvat muut tekstit haetaan fi_*-avaimilla.
+#
+#   universe        {tunnus: nimi}
+#   name_key        nimisarakkeen käännösavain
+#   price_key       hintasarakkeen käännösavain
+#   price_decimals  hinnan ja SMA50:n pyöristys
+#   currency        oletusvaluutta, jos perustiedoissa ei ole valuuttaa
+#   fundamentals    haetaanko P/E ja markkina-arvo
+#   file_prefix     CSV-latauksen tiedostonimen alku
+SCREENER_MARKETS = {
+    "fi": {
+        "universe": FINNISH_STOCKS,
+        "name_key": "col_company",
+        "price_key": "col_price_eur",
+        "price_decimals": 2,
+        "currency": "EUR",
+        "fundamentals": True,
+        "file_prefix": "suomen_porssi",
+    },
+    "us": {
+        "universe": US_STOCKS,
+        "name_key": "col_company",
+        "price_key": "col_price_usd",
+        "price_decimals": 2,
+        "currency": "USD",
+        "fundamentals": True,
+        "file_prefix": "usa_porssi",
+    },
+    "eu": {
+        "universe": EU_ETFS,
+        "name_key": "col_etf_name",
+        "price_key": "col_price_eur",
+        "price_decimals": 4,
+        "currency": "EUR",
+        "fundamentals": False,
+        "file_prefix": "eu_etf",
+    },
+}
+
+# Seulonnan hakujakso: 6 kuukautta riittää RSI(14) + SMA50 laskentaan
+SCREENER_PERIOD = "6mo"
+
+def register_screener_market(key: str, universe: dict, **options) -> None:
+    """Lisää oman pörssilistan (tai korvaa olemassa olevan) SCREENER_MARKETS-asetuksiin.
+
+    Args:
+        key: Markkinan tunniste (tallennetaan screener_rows.market-sarakkeeseen).
+        universe: {tunnus: nimi}.
+        **options: SCREENER_MARKETS-kentät; puuttuvat otetaan fi-markkinan oletuksista.
+            "label" on näkymän otsikko, jos käännöstä "tab_<key>" ei ole.
+    """
+    config = {**SCREENER_MARKETS["fi"], "file_prefix": key, **options, "universe": dict(universe)}
+    SCREENER_MARKETS[key] = config
+
+def _screener_text(market: str, suffix: str, **kwargs) -> str:
+    """Markkinakohtainen käännös "<markkina>_<suffix>", oletuksena "fi_<suffix>"."""
+    key = f"{market}_{suffix}"
+    return t(key if key in TRANSLATIONS["fi"] else f"fi_{suffix}", **kwargs)
+
+def _screener_signal(rsi: float | None, sma50: float | None, price: float) -> str:
+    """Pörssilistan signaali: RSI < 30 ja hinta SMA50:n yllä = osta, RSI > 70 = myy."""
+    if rsi is not None and sma50 is not None:
+        if rsi < 30 and price > sma50:
+            return SCREENER_SIGNAL_LABELS[SIGNAL_BUY]
+        if rsi > 70:
+            return SCREENER_SIGNAL_LABELS[SIGNAL_SELL]
+    return SCREENER_SIGNAL_LABELS[SIGNAL_HOLD]
+
+def run_screener(universe, period: str = SCREENER_PERIOD, progress=None, **options) -> pd.DataFrame:
+    """Seuloo pörssilistan: kurssit, RSI, SMA50, signaali ja perustiedot.
+
+    Kurssit haetaan yhtenä ryhmähakuna, indikaattorit jatketaan tunnusten
+    tallennetusta tilasta (streaming_indicators) ja perustiedot ladataan rinnakkain jaetussa säiepoolissa
+    (prefetch_stock_info). Kaikki haut käyttävät olemassa olevia välimuisteja.
+
+    Args:
+        universe: SCREENER_MARKETS-avain, {tunnus: nimi} tai lista tunnuksia.
+        period: Kurssihistorian jakso.
+        progress: Valinnainen kutsu progress(osuus, teksti) edistymisen näyttämiseen.
+        **options: Ohittaa markkinan asetukset (price_decimals, currency, fundamentals).
+    Returns:
+        DataFrame SCREENER_FIELDS-sarakkeilla, rivi per tunnus jolle löytyi kursseja.
+        ``attrs["stale"]`` listaa tunnukset, joiden kurssit ovat varastosta
+        epäonnistuneen päivityksen jälkeen, ja ``attrs["skipped"]`` tunnukset,
+        joille ei löytynyt kursseja lainkaan.
+    """
+    if isinstance(universe, str):
+        config = {**SCREENER_MARKETS[universe], **options}
+        names = config["universe"]
+    else:
+        config = {**SCREENER_MARKETS["fi"], **options}
+        names = universe if isinstance(universe, dict) else {s: s for s in universe}
+    decimals = config["price_decimals"]
+    symbols = list(names)
+    report = progress or (lambda fraction, text: None)
+
+    report(0.0, t("fi_fetching_start"))
+    prices = fetch_prices_bulk(tuple(symbols), period=period)
+    latest_by_symbol = streaming_indicators(prices)
+    fetched = [s for s in symbols if s in prices]
+    report(0.5, t("fi_fetching", symbol="…", idx=len(fetched), total=len(symbols)))
+    prefetch_stock_info(fetched)
+    infos = call_each(fetch_stock_info, fetched)
+
+    columns: dict[str, list] = {field: [] for field in SCREENER_FIELDS}
+    for symbol, info in zip(fetched, infos):
+        info = info if isinstance(info, dict) else {}
+        close = prices[symbol]["Close"]
+        latest_price = round(float(close.iloc[-1]), decimals)
+        prev_price = float(close.iloc[-2]) if len(close) > 1 else latest_price
+        latest_ind = latest_by_symbol.get(symbol, {})
+        rsi_val = round(latest_ind["RSI"], 1) if len(close) >= 15 and latest_ind.get("RSI") is not None else None
+        sma50_val = round(latest_ind["SMA50"], decimals) if len(close) >= 50 and latest_ind.get("SMA50") is not None else None
+        pe = info.get("trailingPE") if config["fundamentals"] else None
+
+        columns["symbol"].append(symbol)
+        columns["name"].append(names[symbol])
+        columns["price"].append(latest_price)
+        columns["change_pct"].append(round((latest_price - prev_price) / prev_price * 100, 2))
+        columns["rsi"].append(rsi_val)
+        columns["sma50"].append(sma50_val)
+        columns["signal"].append(_screener_signal(rsi_val, sma50_val, latest_price))
+        columns["currency"].append(info.get("currency", config["currency"]))
+        columns["pe"].append(round(pe, 2) if pe else None)
+        columns["market_cap"].append(info.get("marketCap") if config["fundamentals"] else None)
+    report(1.0, t("fi_fetching", symbol=symbols[-1] if symbols else "", idx=len(symbols), total=len(symbols)))
+    results = pd.DataFrame(columns, columns=SCREENER_FIELDS)
+    results.attrs["stale"] = [s for s in fetched if is_stale(prices[s])]
+    results.attrs["skipped"] = [s for s in symbols if s not in prices]
+    return results
+
+def sync_screener_market(market: str, progress=None) -> tuple[bool, int]:
+    """Seuloo markkinan ja tallentaa tulokset (screener_rows + historia).
+
+    Vanhentuneista kursseista laskettuja rivejä ei tallenneta: tunnuksen
+    edellinen rivi jää voimaan vanhemmalla synkronointiajallaan, ja
+    screener_coverage raportoi sen.
+
+    Returns:
+        (onnistui, tallennettujen rivien määrä).
+    """
+    try:
+        results = run_screener(market, progress=progress)
+    except Exception:  # noqa: BLE001
+        return False, 0
+    results = results[~results["symbol"].isin(results.attrs.get("stale", []))]
+    rows = results.astype(object).where(results.notna(), None).to_dict("records")
+    # Tunnuskohtainen upsert: epäonnistunut haku ei pyyhi aiempaa riviä
+    return True, save_screener_rows(market, rows)
+
+def screener_coverage(market: str) -> tuple[list[str], list[str]]:
+    """Palauttaa markkinan (vanhentuneet, puuttuvat) tunnukset.
+
+    Vanhentunut rivi on jäänyt aiemmasta synkronoinnista, koska tunnuksen
+    haku epäonnistui viimeisimmässä; puuttuvalle tunnukselle ei ole
+    tallennettu riviä lainkaan. Molemmat rajataan markkinan tunnuslistaan.
+    """
+    conn = get_connection(readonly=True)
+    try:
+        rows = dict(conn.execute(
+            "SELECT symbol, synced_at FROM screener_rows WHERE market = ?", (market,)
+        ).fetchall())
+    finally:
+        conn.close()
+    universe = SCREENER_MARKETS[market]["universe"]
+    latest = max(rows.values(), default=None)
+    stale = [s for s in universe if s in rows and rows[s] != latest]
+    missing = [s for s in universe if s not in rows]
+    return stale, missing
+
+# --- Kaupankäyntikalenteri ---
+# Pörssien säännölliset kaupankäyntiajat paikallisessa ajassa ja
+# sääntöpohjaiset pyhäpäivät. Päivitysajastus, kurssivaraston TTL ja
+# taustapäivittäjä kysyvät täältä, onko tunnuksen pörssi auki ja milloin se
+# seuraavan kerran avautuu. Lyhennettyjä kaupankäyntipäiviä (esim. aattoja)
+# ei mallinneta: ne käsitellään normaaleina päivinä, mikä vain aikaistaa päivitystä.
+EXCHANGES = {
+    "XHEL": {"tz": "Europe/Helsinki", "open": (10, 0), "close": (18, 30)},
+    "XNYS": {"tz": "America/New_York", "open": (9, 30), "close": (16, 0)},
+    "XETR": {"tz": "Europe/Berlin", "open": (9, 0), "close": (17, 30)},
+    "XLON": {"tz": "Europe/London", "open": (8, 0), "close": (16, 30)},
+    "XSTO": {"tz": "Europe/Stockholm", "open": (9, 0), "close": (17, 30)},
+    "XPAR": {"tz": "Europe/Paris", "open": (9, 0), "close": (17, 30)},
+}
+
+# Yahoo-tunnuksen pääte -> pörssi; pääte puuttuu = Yhdysvallat
+EXCHANGE_SUFFIXES = {
+    "HE": "XHEL", "DE": "XETR", "F": "XETR", "L": "XLON",
+    "ST": "XSTO", "PA": "XPAR", "AS": "XPAR", "BR": "XPAR",
+}
+
+def _easter(year: int) -> date:
+    """Pääsiäispäivä gregoriaanisessa kalenterissa (anonyymi algoritmi)."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    """Kuukauden n:s viikonpäivä (n=-1 = viimeinen); weekday 0 = maanantai."""
+    if n > 0:
+        first = date(year, month, 1)
+        return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+def _observed(day: date) -> date:
+    """Viikonlopun pyhä siirtyy: lauantai -> perjantai, sunnuntai -> maanantai (NYSE)."""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+def _midsummer_eve(year: int) -> date:
+    """Juhannusaatto: perjantai 19.–25.6."""
+    first = date(year, 6, 19)
+    return first + timedelta(days=(4 - first.weekday()) % 7)
+
+@functools.lru_cache(maxsize=None)
+def exchange_holidays(exchange: str, year: int) -> frozenset:
+    """Palauttaa pörssin pyhäpäivät (suljetut arkipäivät) vuodelle."""
+    easter = _easter(year)
+    good_friday, easter_monday = easter - timedelta(days=2), easter + timedelta(days=1)
+    ascension = easter + timedelta(days=39)
+    new_year, may_day = date(year, 1, 1), date(year, 5, 1)
+    xmas_eve, xmas, boxing, nye = (date(year, 12, d) for d in (24, 25, 26, 31))
+
+    if exchange == "XHEL":
+        days = {new_year, date(year, 1, 6), good_friday, easter_monday, may_day, ascension,
+                _midsummer_eve(year), date(year, 12, 6), xmas_eve, xmas, boxing, nye}
+    elif exchange == "XSTO":
+        days = {new_year, date(year, 1, 6), good_friday, easter_monday, may_day, ascension,
+                date(year, 6, 6), _midsummer_eve(year), xmas_eve, xmas, boxing, nye}
+    elif exchange == "XETR":
+        days = {new_year, good_friday, easter_monday, may_day, xmas_eve, xmas, boxing, nye}
+    elif exchange == "XPAR":
+        days = {new_year, good_friday, easter_monday, may_day, xmas, boxing}
+    elif exchange == "XLON":
+        boxing_observed = boxing + timedelta(days=2) if boxing.weekday() in (5, 6) else boxing
+        xmas_observed = xmas + timedelta(days=2) if xmas.weekday() in (5, 6) else xmas
+        days = {new_year if new_year.weekday() < 5 else _nth_weekday(year, 1, 0, 1),
+                good_friday, easter_monday, _nth_weekday(year, 5, 0, 1),
+                _nth_weekday(year, 5, 0, -1), _nth_weekday(year, 8, 0, -1),
+                xmas_observed, boxing_observed}
+    elif exchange == "XNYS":
+        days = {_nth_weekday(year, 1, 0, 3), _nth_weekday(year, 2, 0, 3), good_friday,
+                _nth_weekday(year, 5, 0, -1), _observed(date(year, 6, 19)),
+                _observed(date(year, 7, 4)), _nth_weekday(year, 9, 0, 1),
+                _nth_weekday(year, 11, 3, 4), _observed(xmas)}
+        # Lauantaina osuvaa uuttavuotta ei siirretä edelliselle perjantaille
+        if new_year.weekday() != 5:
+            days.add(_observed(new_year))
+    else:
+        days = set()
+    return frozenset(d for d in days if d.weekday() < 5)
+
+def exchange_for_symbol(symbol: str) -> str | None:
+    """Päättelee Yahoo-tunnuksen pörssin päätteestä (None = tuntematon pörssi)."""
+    if "." not in symbol:
+        return "XNYS"
+    return EXCHANGE_SUFFIXES.get(symbol.rsplit(".", 1)[1].upper())
+
+def is_trading_day(exchange: str, day: date) -> bool:
+    """True, jos pörssi käy kauppaa päivänä day (arkipäivä eikä pyhä)."""
+    return day.weekday() < 5 and day not in exchange_holidays(exchange, day.year)
+
+def _session(exchange: str, day: date) -> tuple[datetime, datetime]:
+    """Päivän kaupankäyntijakso (avaus, sulkeutuminen) aikavyöhyketietoisina."""
+    cfg = EXCHANGES[exchange]
+    tz = ZoneInfo(cfg["tz"])
+    opens = datetime(day.year, day.month, day.day, *cfg["open"], tzinfo=tz)
+    closes = datetime(day.year, day.month, day.day, *cfg["close"], tzinfo=tz)
+    return opens, closes
+
+def _local_now(exchange: str, now: datetime | None) -> datetime:
+    """Muuntaa hetken pörssin paikalliseen aikaan (naiivi = koneen paikallinen aika)."""
+    tz = ZoneInfo(EXCHANGES[exchange]["tz"])
+    return (now or datetime.now(tz)).astimezone(tz)
+
+def is_exchange_open(exchange: str, now: datetime | None = None) -> bool:
+    """True, jos pörssi on auki hetkellä now. Tuntematon pörssi = aina auki."""
+    if exchange not in EXCHANGES:
+        return True
+    local = _local_now(exchange, now)
+    if not is_trading_day(exchange, local.date()):
+        return False
+    opens, closes = _session(exchange, local.date())
+    return opens <= local < closes
+
+def next_open(exchange: str, now: datetime | None = None) -> datetime:
+    """Seuraava avautumishetki (nyt, jos pörssi on jo auki)."""
+    local = _local_now(exchange, now)
+    if is_exchange_open(exchange, local):
+        return local
+    day = local.date()
+    for _ in range(30):
+        if is_trading_day(exchange, day):
+            opens, _ = _session(exchange, day)
+            if opens > local:
+                return opens
+        day += timedelta(days=1)
+    raise ValueError(f"Ei kaupankäyntipäivää 30 päivän sisällä: {exchange}")
+
+def last_close(exchange: str, now: datetime | None = None) -> datetime:
+    """Viimeisin sulkeutumishetki ennen hetkeä now."""
+    local = _local_now(exchange, now)
+    day = local.date()
+    for _ in range(30):
+        if is_trading_day(exchange, day):
+            _, closes = _session(exchange, day)
+            if closes <= local:
+                return closes
+        day -= timedelta(days=1)
+    raise ValueError(f"Ei kaupankäyntipäivää 30 päivän sisällä: {exchange}")
+
+def market_exchanges(market: str) -> set[str]:
+    """SCREENER_MARKETS-listan tunnusten pörssit (tuntemattomat päätteet pois)."""
+    universe = SCREENER_MARKETS.get(market, {}).get("universe", {})
+    return {ex for ex in map(exchange_for_symbol, universe) if ex}
+
+def is_market_open(market: str, now: datetime | None = None) -> bool:
+    """True, jos jokin listan pörsseistä on auki. Lista ilman tunnettuja pörssejä = auki."""
+    exchanges = market_exchanges(market)
+    return not exchanges or any(is_exchange_open(ex, now) for ex in exchanges)
+
+def market_next_open(market: str, now: datetime | None = None) -> datetime | None:
+    """Listan pörsseistä aikaisin seuraava avautuminen (None, jos pörssejä ei tunneta)."""
+    exchanges = market_exchanges(market)
+    return min((next_open(ex, now) for ex in exchanges), default=None)
+
+def data_final_since(exchanges, refreshed_at: datetime, now: datetime | None = None) -> bool:
+    """True, jos refreshed_at on viimeisimmän sulkeutumisen jälkeen ja kaikki pörssit ovat kiinni.
+
+    Silloin data ei muutu ennen seuraavaa avautumista, joten välimuistin TTL
+    voidaan venyttää seuraavaan avautumiseen asti.
+    """
+    exchanges = [ex for ex in exchanges if ex in EXCHANGES]
+    if not exchanges:
+        return False
+    refreshed_at = refreshed_at.astimezone()
+    return all(
+        not is_exchange_open(ex, now) and refreshed_at >= last_close(ex, now)
+        for ex in exchanges
+    )
+
+def market_refresh_due(market: str, last_sync: float, now: float | None = None) -> bool:
+    """Tarvitseeko pörssilista päivitystä: auki = kyllä, kiinni = vain kerran sulkeutumisen jälkeen."""
+    now = time.time() if now is None else now
+    moment = datetime.fromtimestamp(now).astimezone()
+    if is_market_open(market, moment):
+        return True
+    return not data_final_since(market_exchanges(market), datetime.fromtimestamp(last_sync), moment)
+
+# --- Taustapäivittäjän tila ---
+# sync_worker.py kirjaa sykäyksen jokaisen kierroksen jälkeen. Kun sykäys on
+# tuore, käyttöliittymä lukee esilasketut tulokset eikä hae itse Yahoosta.
+WORKER_NAME = "sync_worker"
+WORKER_STALE_AFTER = 900
+
+def record_worker_heartbeat(summary: dict | None = None, name: str = WORKER_NAME,
+                            now: float | None = None) -> None:
+    """Tallentaa taustapäivittäjän sykäyksen ja kierroksen yhteenvedon."""
+    import json
+    conn = get_connection()
+    try:
+        conn.execute("""
+            INSERT INTO worker_status (name, heartbeat_at, summary) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET heartbeat_at=excluded.heartbeat_at, summary=excluded.summary
+        """, (name, now if now is not None else time.time(), json.dumps(summary or {}, ensure_ascii=False)))
+        conn.commit()
+    finally:
+        conn.close()
+
+def get_worker_heartbeat(name: str = WORKER_NAME) -> tuple[float, dict] | None:
+    """Palauttaa (sykäyksen Unix-aika, yhteenveto) tai None, jos päivittäjää ei ole ajettu."""
+    import json
+    conn = get_connection(readonly=True)
+    try:
+        row = conn.execute(
+            "SELECT heartbeat_at, summary FROM worker_status WHERE name = ?", (name,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    return row[0], json.loads(row[1] or "{}")
+
+def worker_is_alive(name: str = WORKER_NAME, now: float | None = None,
+                    max_age: float = WORKER_STALE_AFTER) -> bool:
+    """True, kun taustapäivittäjä on kirjannut sykäyksen viimeisen max_age sekunnin aikana."""
+    beat = get_worker_heartbeat(name)
+    now = time.time() if now is None else now
+    return beat is not None and now - beat[0] < max_age
+
+# Pörssilistojen auto-refresh: ajastettu fragmentti synkkaa, kun edellisestä
+# synkkauksesta on kulunut vähintään tämä osuus välistä (ajastin ei ole tarkka)
+AUTO_REFRESH_TOLERANCE = 0.9
+# Suljetun pörssin listan fragmentti herää tarkistamaan tilan tämän välein
+CLOSED_REFRESH_INTERVAL = 900
+
+def invalidate_market_cache(symbols, period: str = "6mo", include_info: bool = False) -> None:
+    """Tyhjentää vain yhden pörssilistan välimuistimerkinnät.
+
+    Välimuisti on kaikkien istuntojen yhteinen, joten koko funktion
+    tyhjentäminen (``_cached_prices_bulk.clear()``) pakottaisi muidenkin
+    käyttäjien ja listojen haut uudelleen.
+    """
+    _cached_prices_bulk.clear(tuple(symbols), period)
+    if include_info:
+        for symbol in symbols:
+            _cached_stock_info.clear(symbol)
+
+def _refresh_due(prefix: str, interval: float, now: float | None = None) -> bool:
+    """True, kun listan ``prefix`` edellisestä synkkauksesta on kulunut ``interval`` sekuntia."""
+    last = st.session_state.get(f"{prefix}_synced_at", 0.0)
+    now = time.time() if now is None else now
+    return now - last >= interval * AUTO_REFRESH_TOLERANCE
+
+@st.cache_data(ttl=300)
+def _cached_stock_history(symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """fetch_stock_history-funktion välimuistikerros: vanhentunut tulos nousee _StaleServe-poikkeuksena."""
+    df = _get_single_flight().do(("history", symbol, start_date, end_date),
+                                 get_price_history, symbol, start_date, end_date)
+    if is_stale(df):
+        raise _StaleServe(df)
+    return df
+
+def fetch_stock_history(symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """Hakee pitkän historian backtestingiä varten paikallisesta varastosta (välimuistissa 5 min).
+    Vain varastosta puuttuvat päivät haetaan Yahoosta. Samanaikaiset saman
+    (tunnus, alku, loppu) -haut yhdistetään (SingleFlight). Vanhentunutta
+    tulosta ei tallenneta välimuistiin.
+    """
+    try:
+        return _cached_stock_history(symbol, start_date, end_date)
+    except _StaleServe as stale:
+        return stale.data
 
 @st.cache_data(ttl=86400, show_spinner=False)
 def translate_to_finnish(text: str) -> str:
@@ -1323,6 +3951,34 @@ def translate_to_finnish(text: str) -> str:
     except Exception as e:  # noqa: BLE001
         return text  # palautetaan alkuperäinen jos käännös epäonnistuu
 
+# Analyysituloksen kentät, jotka säilytetään kehysvarastossa
+ANALYSIS_FRAME_KEYS = ("df",)
+
+@_frame_loader("analysis")
+def _analysis_frames(symbol: str, period: str = "6mo") -> dict:
+    """Laskee analyysin indikaattori-DataFramen uudelleen kaavioita varten."""
+    df, _ = fetch_stock_data(symbol, period)
+    if df.empty:
+        return {}
+    df = df.reset_index()
+    add_indicators(df, symbol=symbol)
+    return {"df": df}
+
+def analyze_many(symbols, period: str = "6mo") -> list:
+    """get_stock_analysis usealle tunnukselle.
+
+    Kurssit ja perustiedot ladataan ensin rinnakkain raakahakuina
+    (refresh_price_bars, prefetch_stock_info); analyysit ajetaan sitten
+    kutsujan säikeessä, jolloin välimuistitetut kääreet lukevat tietokantaa.
+
+    Returns:
+        [(success, data/virheviesti)] syötteen järjestyksessä.
+    """
+    symbols = list(symbols)
+    refresh_price_bars(symbols, period_start(period))
+    prefetch_stock_info(symbols)
+    return [get_stock_analysis(symbol, period) for symbol in symbols]
+
 def get_stock_analysis(symbol, period="6mo"):
     """
     Hakee osakkeen datan ja tekee teknisen analyysin
@@ -1335,23 +3991,12 @@ def get_stock_analysis(symbol, period="6mo"):
         if df.empty:
             return False, f"Ei dataa osakkeelle {symbol}"
         
+        # Katkon aikana data tulee varastosta ja päivittyy taustalla
+        stale = is_stale(df) or is_stale(info)
         df = df.reset_index()
         
-        # Laske indikaattorit
-        df["RSI"] = ta.momentum.RSIIndicator(df["Close"], window=14).rsi()
-        df["SMA50"] = df["Close"].rolling(window=50).mean()
-        df["SMA200"] = df["Close"].rolling(window=200).mean()
-
-        # MACD
-        macd_ind = ta.trend.MACD(df["Close"])
-        df["MACD"] = macd_ind.macd()
-        df["MACD_signal"] = macd_ind.macd_signal()
-
-        # Bollinger Bands
-        bb = ta.volatility.BollingerBands(df["Close"], window=20, window_dev=2)
-        df["BB_upper"] = bb.bollinger_hband()
-        df["BB_lower"] = bb.bollinger_lband()
-        df["BB_mid"] = bb.bollinger_mavg()
+        # Laske indikaattorit (RSI, SMA50/200, MACD, Bollinger Bands) jaetusta välimuistista
+        add_indicators(df, symbol=symbol)
         
         # Hae tunnusluvut
         latest = df.iloc[-1]
@@ -1392,103 +4037,150 @@ def get_stock_analysis(symbol, period="6mo"):
             "summary":         info.get("longBusinessSummary", None),
             "signal": signal,
             "signal_color": signal_color,
+            "stale": stale,
             "df": df,
-            "info": info,
         }
         
-        return True, result
+        # DataFrame jaettuun varastoon; tulokseen jää skalaarit ja kahva
+        return True, compact_result(result, ("analysis", symbol, period), ANALYSIS_FRAME_KEYS)
         
     except Exception as e:
         err = str(e)
-        if "too many requests" in err.lower() or "rate limit" in err.lower() or "429" in err:
+        if isinstance(e, ProviderUnavailable):
+            return False, "⏳ Yahoo Finance ei vastaa eikä tallennettua dataa ole – haku yritetään uudelleen automaattisesti"
+        if _is_rate_limit_error(e):
             return False, "⏳ Yahoo Finance rajoittaa hakuja (rate limit) – odota hetki ja päivitä uudelleen"
         return False, f"Virhe: {err}"
 
 # --- Backtesting ---
 
-def _generate_signals(df: pd.DataFrame, strategy: str) -> pd.DataFrame:
+# Signaalien kokonaislukukoodit simulointiytimelle
+SIGNAL_HOLD, SIGNAL_BUY, SIGNAL_SELL = 0, 1, -1
+SIGNAL_CODES = {"HOLD": SIGNAL_HOLD, "BUY": SIGNAL_BUY, "SELL": SIGNAL_SELL}
+
+def _signal_codes(signals) -> np.ndarray:
+    """Muuntaa "BUY"/"SELL"/"HOLD"-merkkijonot kokonaislukukoodeiksi (tuntemattomat = HOLD)."""
+    arr = np.asarray(signals, dtype=object)
+    return np.select([arr == "BUY", arr == "SELL"], [SIGNAL_BUY, SIGNAL_SELL], SIGNAL_HOLD).astype(np.int8)
+
+# Strategioiden oletusparametrit (vastaavat alkuperäisiä kiinteitä arvoja)
+DEFAULT_STRATEGY_PARAMS = {
+    "rsi_window": 14, "rsi_buy": 30, "rsi_sell": 70,
+    "sma_fast": 50, "sma_slow": 200,
+    "bb_window": 20, "bb_dev": 2.0,
+    "macd_fast": 12, "macd_slow": 26, "macd_signal": 9,
+}
+
+def _crossings(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Palauttaa (a ylittää b:n, a alittaa b:n) -maskit edelliseen päivään verrattuna."""
+    prev_a = np.concatenate([np.full((1,) + a.shape[1:], np.nan), a[:-1]])
+    prev_b = np.concatenate([np.full((1,) + b.shape[1:], np.nan), b[:-1]])
+    return (a > b) & (prev_a <= prev_b), (a < b) & (prev_a >= prev_b)
+
+def _strategy_codes(strategy: str, memo: _IndicatorMemo, params: dict | None = None) -> np.ndarray:
+    """Laskee strategian signaalikoodit (SIGNAL_BUY / SIGNAL_SELL / SIGNAL_HOLD) taulukkoina."""
+    p = {**DEFAULT_STRATEGY_PARAMS, **(params or {})}
+    close = memo.close
+    codes = np.full(close.shape, SIGNAL_HOLD, dtype=np.int8)
+
+    with np.errstate(invalid="ignore"):
+        if strategy == "RSI + SMA (perus)":
+            # Alkuperäinen strategia
+            rsi = memo.rsi(p["rsi_window"])
+            buy = (rsi < p["rsi_buy"]) & (close > memo.sma(p["sma_fast"]))
+            sell = (rsi > p["rsi_sell"]) | (close < memo.sma(p["sma_slow"]))
+            codes[sell & ~buy] = SIGNAL_SELL
+            codes[buy] = SIGNAL_BUY
+
+        elif strategy == "Momentum (SMA-risteytys)":
+            # Golden Cross / Death Cross: nopea SMA ylittää/alittaa hitaan
+            buy, sell = _crossings(memo.sma(p["sma_fast"]), memo.sma(p["sma_slow"]))
+            codes[buy] = SIGNAL_BUY
+            codes[sell] = SIGNAL_SELL
+
+        elif strategy == "Mean Reversion (Bollinger Bands)":
+            # Osta kun hinta koskettaa alakaistaa, myy yläkaistaa
+            upper, lower = memo.bollinger(p["bb_window"], p["bb_dev"])
+            buy = close <= lower
+            sell = close >= upper
+            codes[sell & ~buy] = SIGNAL_SELL
+            codes[buy] = SIGNAL_BUY
+
+        elif strategy == "MACD-risteytys":
+            # Osta kun MACD ylittää signaaliviivan, myy kun alittaa
+            macd, macd_sig = memo.macd(p["macd_fast"], p["macd_slow"], p["macd_signal"])
+            buy, sell = _crossings(macd, macd_sig)
+            codes[buy] = SIGNAL_BUY
+            codes[sell] = SIGNAL_SELL
+
+    return codes
+
+def _generate_signals(df: pd.DataFrame, strategy: str, params: dict | None = None,
+                      symbol: str | None = None) -> pd.DataFrame:
     """
     Laskee osto/myynti-signaalit valitun strategian mukaan.
     Palauttaa df:n Signal-sarakkeella ("BUY" / "SELL" / "HOLD").
+
+    ``params`` korvaa oletusparametreja (ks. DEFAULT_STRATEGY_PARAMS); tällöin
+    indikaattorit lasketaan annetuilla ikkunoilla df:n valmiista sarakkeista välittämättä.
+    ``symbol`` käyttää tunnuksen jaettua indikaattorivälimuistia (indicator_memo).
     """
     df = df.copy()
 
-    # Varmistetaan, että indikaattorit lasketaan vain tarvittaessa
-    if "RSI" not in df.columns:
-        df["RSI"] = ta.momentum.RSIIndicator(df["Close"], window=14).rsi()
-    if "SMA50" not in df.columns:
-        df["SMA50"] = df["Close"].rolling(window=50).mean()
-    if "SMA200" not in df.columns:
-        df["SMA200"] = df["Close"].rolling(window=200).mean()
-
-    df["Signal"] = "HOLD"
-
-    if strategy == "RSI + SMA (perus)":
-        # Alkuperäinen strategia
-        buy = (df["RSI"] < 30) & (df["Close"] > df["SMA50"])
-        sell = (df["RSI"] > 70) | (df["Close"] < df["SMA200"])
-        df.loc[buy, "Signal"] = "BUY"
-        df.loc[sell & ~buy, "Signal"] = "SELL"
-
-    elif strategy == "Momentum (SMA-risteytys)":
-        # Golden Cross / Death Cross: SMA50 ylittää/alittaa SMA200
-        prev_sma50 = df["SMA50"].shift(1)
-        prev_sma200 = df["SMA200"].shift(1)
-        buy = (df["SMA50"] > df["SMA200"]) & (prev_sma50 <= prev_sma200)
-        sell = (df["SMA50"] < df["SMA200"]) & (prev_sma50 >= prev_sma200)
-        df.loc[buy, "Signal"] = "BUY"
-        df.loc[sell, "Signal"] = "SELL"
-
-    elif strategy == "Mean Reversion (Bollinger Bands)":
-        # Osta kun hinta koskettaa alakaistaa, myy yläkaistaa
-        bb = ta.volatility.BollingerBands(df["Close"], window=20, window_dev=2)
-        df["BB_upper"] = bb.bollinger_hband()
-        df["BB_lower"] = bb.bollinger_lband()
-        buy = df["Close"] <= df["BB_lower"]
-        sell = df["Close"] >= df["BB_upper"]
-        df.loc[buy, "Signal"] = "BUY"
-        df.loc[sell & ~buy, "Signal"] = "SELL"
-
-    elif strategy == "MACD-risteytys":
-        # Osta kun MACD ylittää signaaliviivan, myy kun alittaa
-        macd_ind = ta.trend.MACD(df["Close"])
-        df["MACD"] = macd_ind.macd()
-        df["MACD_signal"] = macd_ind.macd_signal()
-        prev_macd = df["MACD"].shift(1)
-        prev_sig = df["MACD_signal"].shift(1)
-        buy = (df["MACD"] > df["MACD_signal"]) & (prev_macd <= prev_sig)
-        sell = (df["MACD"] < df["MACD_signal"]) & (prev_macd >= prev_sig)
-        df.loc[buy, "Signal"] = "BUY"
-        df.loc[sell, "Signal"] = "SELL"
+    if symbol is not None:
+        memo = indicator_memo(symbol, df)
+    elif params is None:
+        # Varmistetaan, että indikaattorit lasketaan vain tarvittaessa
+        needed = ["RSI", "SMA50", "SMA200"]
+        if strategy == "Mean Reversion (Bollinger Bands)":
+            needed += ["BB_upper", "BB_lower"]
+        elif strategy == "MACD-risteytys":
+            needed += ["MACD", "MACD_signal"]
+        missing = [col for col in needed if col not in df.columns]
+        if missing:
+            add_indicators(df, missing)
+        memo = _IndicatorMemo(df["Close"], columns=df)
+    else:
+        memo = _IndicatorMemo(df["Close"])
 
+    codes = _strategy_codes(strategy, memo, params)
+    df["Signal"] = np.where(codes == SIGNAL_BUY, "BUY", np.where(codes == SIGNAL_SELL, "SELL", "HOLD"))
     return df
 
 
-def _simulate_trades(df: pd.DataFrame, initial_capital: float, commission: float):
-    """Simuloi kaupankäynti signaalien perusteella. Palauttaa tulokset."""
+def _simulate_core(close: np.ndarray, codes: np.ndarray, initial_capital: float, commission: float) -> dict:
+    """Kaupankäynnin simulointiydin NumPy-taulukoilla.
+
+    Silmukka käy läpi vain signaalipäivät; pääoman ja osakemäärän tila
+    levitetään päiville taulukko-operaatioilla. Laskutoimitukset ovat samat
+    kuin rivikohtaisessa simuloinnissa, joten tulokset ovat identtiset.
+
+    Returns:
+        {"values": salkun arvo per päivä, "trade_idx": [(koodi, rivi)],
+         "trades", "winning_trades", "strategy_final"}
+    """
+    close = np.asarray(close, dtype=float)
+    codes = np.asarray(codes)
+    n = len(close)
     capital = initial_capital
     shares = 0.0
     in_position = False
     trades = 0
     winning_trades = 0
-    trade_history = []
-    equity_curve = []
     buy_price = 0.0
+    trade_idx = []
+    change_rows, cash_states, share_states = [], [], []
 
-    for i in range(len(df)):
-        price = df.loc[i, "Close"]
-        sig = df.loc[i, "Signal"]
-
-        if sig == "BUY" and not in_position:
+    for i in np.flatnonzero(codes != SIGNAL_HOLD):
+        price = close[i]
+        if codes[i] == SIGNAL_BUY and not in_position:
             cost = capital * commission
             shares = (capital - cost) / price
             capital = 0.0
             in_position = True
             buy_price = price
             trades += 1
-            trade_history.append(("BUY", df.loc[i, "Date"], price))
-
-        elif sig == "SELL" and in_position:
+        elif codes[i] == SIGNAL_SELL and in_position:
             gross = shares * price
             cost = gross * commission
             capital = gross - cost
@@ -1496,17 +4188,46 @@ def _simulate_trades(df: pd.DataFrame, initial_capital: float, commission: float
                 winning_trades += 1
             shares = 0.0
             in_position = False
-            trade_history.append(("SELL", df.loc[i, "Date"], price))
+        else:
+            continue
+        trade_idx.append((int(codes[i]), int(i)))
+        change_rows.append(i)
+        cash_states.append(capital)
+        share_states.append(shares)
 
-        equity_curve.append({"Date": df.loc[i, "Date"], "Value": capital + shares * price})
+    # Tila voimassa kullakin rivillä: viimeisin muutos, jonka rivi <= i
+    segment = np.searchsorted(np.asarray(change_rows, dtype=np.int64), np.arange(n), side="right") - 1
+    cash = np.append(np.asarray(cash_states, dtype=float), initial_capital)[segment]
+    held = np.append(np.asarray(share_states, dtype=float), 0.0)[segment]
+    values = cash + held * close
 
     if in_position:
-        gross = shares * df.iloc[-1]["Close"]
+        gross = shares * close[-1]
         strategy_final = gross - gross * commission
     else:
         strategy_final = capital
 
-    equity_df = pd.DataFrame(equity_curve)
+    return {
+        "values": values,
+        "trade_idx": trade_idx,
+        "trades": trades,
+        "winning_trades": winning_trades,
+        "strategy_final": strategy_final,
+    }
+
+def _simulate_trades(df: pd.DataFrame, initial_capital: float, commission: float):
+    """Simuloi kaupankäynti signaalien perusteella. Palauttaa tulokset."""
+    core = _simulate_core(df["Close"].to_numpy(dtype=float), _signal_codes(df["Signal"]),
+                          initial_capital, commission)
+    trades = core["trades"]
+    strategy_final = core["strategy_final"]
+    dates = df["Date"]
+    trade_history = [
+        ("BUY" if code == SIGNAL_BUY else "SELL", dates.iloc[i], df["Close"].iloc[i])
+        for code, i in core["trade_idx"]
+    ]
+
+    equity_df = pd.DataFrame({"Date": dates.to_numpy(), "Value": core["values"]})
     equity_df["Peak"] = equity_df["Value"].cummax()
     equity_df["Drawdown"] = (equity_df["Value"] - equity_df["Peak"]) / equity_df["Peak"]
     max_drawdown = equity_df["Drawdown"].min() * 100
@@ -1516,7 +4237,7 @@ def _simulate_trades(df: pd.DataFrame, initial_capital: float, commission: float
         (daily_returns.mean() / daily_returns.std()) * (252 ** 0.5), 2
     ) if daily_returns.std() > 0 else 0.0
 
-    win_rate = round((winning_trades / trades * 100) if trades > 0 else 0.0, 1)
+    win_rate = round((core["winning_trades"] / trades * 100) if trades > 0 else 0.0, 1)
     strategy_return = ((strategy_final - initial_capital) / initial_capital) * 100
 
     return {
@@ -1537,12 +4258,17 @@ STRATEGIES = [
     "Mean Reversion (Bollinger Bands)",
     "MACD-risteytys",
 ]
+# Backtestingin vähimmäishistoria (päiviä) tunnusta kohden
+BACKTEST_MIN_ROWS = 200
+# Backtest-tuloksen kentät, jotka säilytetään kehysvarastossa (result_frames)
+BACKTEST_FRAME_KEYS = ("df", "trade_history", "equity_df")
 
 
 def backtest_strategy(symbol, years=5, initial_capital=10000, commission=0.001, strategy="RSI + SMA (perus)"):
     """
     Testaa valittua strategiaa historiallisella datalla.
-    Vertaa Buy & Hold -menetelmään.
+    Vertaa Buy & Hold -menetelmään. Kaavioiden kehykset (BACKTEST_FRAME_KEYS)
+    haetaan tuloksen kahvalla result_frames-funktiolla.
     """
     try:
         end_date = datetime.now()
@@ -1550,23 +4276,16 @@ def backtest_strategy(symbol, years=5, initial_capital=10000, commission=0.001,
 
         df = fetch_stock_history(symbol, start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
 
-        if df.empty or len(df) < 200:
+        if df.empty or len(df) < BACKTEST_MIN_ROWS:
             return False, "Ei tarpeeksi dataa backtestingiin (vaaditaan vähintään 200 päivää)"
 
         df = df.reset_index()
 
-        # Laske perus-indikaattorit
-        df["RSI"] = ta.momentum.RSIIndicator(df["Close"], window=14).rsi()
-        df["SMA50"] = df["Close"].rolling(window=50).mean()
-        df["SMA200"] = df["Close"].rolling(window=200).mean()
-
-        # MACD (käytetään myös kaaviossa)
-        macd_ind = ta.trend.MACD(df["Close"])
-        df["MACD"] = macd_ind.macd()
-        df["MACD_signal"] = macd_ind.macd_signal()
+        # Laske perus-indikaattorit ja MACD (käytetään myös kaaviossa) jaetusta välimuistista
+        add_indicators(df, ["RSI", "SMA50", "SMA200", "MACD", "MACD_signal"], symbol=symbol)
 
         # Generoi signaalit valitulla strategialla
-        df = _generate_signals(df, strategy)
+        df = _generate_signals(df, strategy, symbol=symbol)
 
         # Simuloi kaupankäynti
         sim = _simulate_trades(df, initial_capital, commission)
@@ -1577,7 +4296,7 @@ def backtest_strategy(symbol, years=5, initial_capital=10000, commission=0.001,
         buy_hold_final = buy_hold_gross * (1 - commission)
         buy_hold_return = ((buy_hold_final - initial_capital) / initial_capital) * 100
 
-        return True, {
+        return True, compact_result({
             "symbol": symbol,
             "strategy": strategy,
             "initial_capital": initial_capital,
@@ -1592,11 +4311,400 @@ def backtest_strategy(symbol, years=5, initial_capital=10000, commission=0.001,
             "df": df,
             "trade_history": sim["trade_history"],
             "equity_df": sim["equity_df"],
-        }
+        }, ("backtest", symbol, years, initial_capital, commission, strategy), BACKTEST_FRAME_KEYS)
 
     except Exception as e:
         return False, f"Virhe backtestingissä: {str(e)}"
 
+@_frame_loader("backtest")
+def _backtest_frames(symbol, years, initial_capital, commission, strategy) -> dict:
+    """Ajaa backtestin uudelleen, kun sen kehykset on poistettu varastosta."""
+    ok, result = backtest_strategy(symbol, years, initial_capital, commission, strategy)
+    return (_get_frame_store().get(result[FRAMES_KEY]) or {}) if ok else {}
+
+# --- Strategian parametrioptimointi ---
+# Optimoija ajaa saman strategian useilla parametriyhdistelmillä kaikille
+# valituille osakkeille. Hinnat haetaan kerran pääprosessissa ja jaetaan
+# prosessipoolin työläisille initializerin kautta; kukin työläinen muistaa
+# indikaattorit (_IndicatorMemo) tunnuksittain tehtävien yli.
+OPTIMIZER_PARAM_GRID = {
+    "RSI + SMA (perus)": {
+        "rsi_window": [7, 14, 21],
+        "rsi_buy": [20, 25, 30, 35],
+        "rsi_sell": [65, 70, 75, 80],
+        "sma_fast": [20, 50],
+        "sma_slow": [100, 150, 200],
+    },
+    "Momentum (SMA-risteytys)": {
+        "sma_fast": [10, 20, 50, 100],
+        "sma_slow": [100, 150, 200, 250],
+    },
+    "Mean Reversion (Bollinger Bands)": {
+        "bb_window": [10, 15, 20, 30],
+        "bb_dev": [1.5, 2.0, 2.5, 3.0],
+    },
+    "MACD-risteytys": {
+        "macd_fast": [8, 12, 16],
+        "macd_slow": [21, 26, 34],
+        "macd_signal": [5, 9, 12],
+    },
+}
+OPTIMIZER_METHODS = ["grid", "random", "halving"]
+OPTIMIZER_MIN_ROWS = BACKTEST_MIN_ROWS
+# Successive halving: historian osuudet kierroksittain ja säilytettävä osuus (1/eta)
+HALVING_FRACTIONS = (0.25, 0.5, 1.0)
+HALVING_ETA = 3
+
+# Työläisprosessin tila (asetetaan _optimizer_init-funktiossa)
+_OPTIMIZER_CLOSES: dict[str, np.ndarray] = {}
+_OPTIMIZER_MEMOS: dict[tuple, _IndicatorMemo] = {}
+
+def _valid_params(params: dict) -> bool:
+    """Hylkää ristiriitaiset yhdistelmät (nopea ikkuna ≥ hidas, osto-raja ≥ myyntiraja)."""
+    if params.get("sma_fast", 0) >= params.get("sma_slow", float("inf")):
+        return False
+    if params.get("macd_fast", 0) >= params.get("macd_slow", float("inf")):
+        return False
+    return params.get("rsi_buy", 0) < params.get("rsi_sell", float("inf"))
+
+def _param_candidates(grid: dict) -> list[dict]:
+    """Palauttaa ruudukon kaikki kelvolliset parametriyhdistelmät."""
+    keys = list(grid)
+    combos = (dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys)))
+    return [c for c in combos if _valid_params(c)]
+
+def _performance_stats(values: np.ndarray, strategy_final: float, initial_capital: float) -> dict:
+    """Tuotto, Sharpe ja max drawdown arvokäyrästä (samat kaavat kuin _simulate_trades)."""
+    returns = values[1:] / values[:-1] - 1.0
+    std = returns.std(ddof=1) if len(returns) > 1 else 0.0
+    peak = np.maximum.accumulate(values)
+    return {
+        "strategy_return": (strategy_final - initial_capital) / initial_capital * 100,
+        "sharpe_ratio": returns.mean() / std * (252 ** 0.5) if std > 0 else 0.0,
+        "max_drawdown": ((values - peak) / peak).min() * 100 if len(values) else 0.0,
+    }
+
+def _optimizer_init(closes: dict[str, np.ndarray]) -> None:
+    """Työläisprosessin alustus: jaetut päätöskurssit ja tyhjä indikaattorimuisti."""
+    global _OPTIMIZER_CLOSES, _OPTIMIZER_MEMOS
+    _OPTIMIZER_CLOSES = closes
+    _OPTIMIZER_MEMOS = {}
+
+def _evaluate_params(strategy: str, candidates: list[dict], fraction: float,
+                     initial_capital: float, commission: float) -> list[dict]:
+    """Ajaa parametriyhdistelmät kaikille jaetuille tunnuksille ja keskiarvoistaa tulokset.
+
+    ``fraction`` rajaa simuloinnin historian viimeisimpään osuuteen (successive halving).
+    """
+    results = []
+    for params in candidates:
+        stats = []
+        for symbol, close in _OPTIMIZER_CLOSES.items():
+            key = (symbol, fraction)
+            if key not in _OPTIMIZER_MEMOS:
+                rows = min(len(close), max(OPTIMIZER_MIN_ROWS, int(len(close) * fraction)))
+                _OPTIMIZER_MEMOS[key] = _IndicatorMemo(close[-rows:])
+            memo = _OPTIMIZER_MEMOS[key]
+            sim = _simulate_core(memo.close, _strategy_codes(strategy, memo, params), initial_capital, commission)
+            stats.append({**_performance_stats(sim["values"], sim["strategy_final"], initial_capital),
+                          "trades": sim["trades"]})
+        frame = pd.DataFrame(stats)
+        results.append({
+            **params,
+            "sharpe_ratio": round(frame["sharpe_ratio"].mean(), 2),
+            "strategy_return": round(frame["strategy_return"].mean(), 2),
+            "max_drawdown": round(frame["max_drawdown"].mean(), 2),
+            "trades": round(frame["trades"].mean(), 1),
+        })
+    return results
+
+def _optimizer_module():
+    """Palauttaa moduulin, jonka funktiot voidaan lähettää työläisprosesseille.
+
+    Streamlit ajaa app.py:n nimellä ``__main__``, jota työläinen ei voi tuoda;
+    silloin funktiot haetaan samasta tiedostosta tuodusta moduulista.
+    """
+    if __name__ != "__main__":
+        return sys.modules[__name__]
+    return importlib.import_module(os.path.splitext(os.path.basename(__file__))[0])
+
+def _run_candidates(closes, strategy, candidates, fraction, initial_capital, commission, max_workers):
+    """Jakaa yhdistelmät erissä prosessipoolille (tai ajaa samassa prosessissa, jos max_workers=1)."""
+    if max_workers == 1 or len(candidates) <= 1:
+        _optimizer_init(closes)
+        return _evaluate_params(strategy, candidates, fraction, initial_capital, commission)
+    module = _optimizer_module()
+    batch = max(1, -(-len(candidates) // (max_workers * 4)))
+    batches = [candidates[i:i + batch] for i in range(0, len(candidates), batch)]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=module._optimizer_init,
+                             initargs=(closes,)) as pool:
+        futures = [pool.submit(module._evaluate_params, strategy, b, fraction, initial_capital, commission)
+                   for b in batches]
+        return [row for f in futures for row in f.result()]
+
+def _rank_results(rows: list[dict]) -> pd.DataFrame:
+    """Järjestää tulokset Sharpen (ja tuoton) mukaan parhaasta heikoimpaan."""
+    ranked = pd.DataFrame(rows).sort_values(["sharpe_ratio", "strategy_return"], ascending=False)
+    return ranked.reset_index(drop=True)
+
+def optimize_strategy(symbols, strategy="RSI + SMA (perus)", years=5, initial_capital=10000,
+                      commission=0.001, method="grid", n_samples=50, param_grid=None,
+                      max_workers=None, seed=None, closes=None):
+    """
+    Etsii strategialle parhaat parametrit kaikille annetuille osakkeille.
+
+    Args:
+        symbols: Osaketunnukset (esim. salkun osakkeet).
+        strategy: Strategian nimi (ks. STRATEGIES).
+        method: "grid" (koko ruudukko), "random" (``n_samples`` satunnaista
+            yhdistelmää) tai "halving" (successive halving: kaikki yhdistelmät
+            lyhyellä historialla, parhaat 1/HALVING_ETA eteenpäin pidemmälle).
+        param_grid: Korvaava ruudukko {parametri: [arvot]}; oletus OPTIMIZER_PARAM_GRID.
+        max_workers: Prosessien määrä (oletus: CPU-ytimet, 1 = samassa prosessissa).
+        closes: Valmiit päätöskurssit {tunnus: taulukko}; muuten haetaan kerran.
+
+    Returns:
+        (True, DataFrame) parametrit + sharpe_ratio, strategy_return, max_drawdown
+        ja trades (tunnusten keskiarvot) Sharpen mukaan järjestettynä, tai (False, virheviesti).
+    """
+    try:
+        if method not in OPTIMIZER_METHODS:
+            return False, f"Tuntematon optimointitapa: {method}"
+        grid = param_grid or OPTIMIZER_PARAM_GRID.get(strategy)
+        if not grid:
+            return False, f"Strategialle {strategy} ei ole parametriruudukkoa"
+
+        if closes is None:
+            end_date = datetime.now()
+            start_date = end_date - timedelta(days=years * 365)
+            start, end = start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+            refresh_price_bars(list(symbols), start)  # raakahaut rinnakkain, välimuisti skriptisäikeessä
+            histories = call_each(fetch_stock_history, list(symbols), start, end)
+            closes = {
+                symbol: df["Close"].to_numpy(dtype=float)
+                for symbol, df in zip(symbols, histories)
+                if isinstance(df, pd.DataFrame) and len(df) >= OPTIMIZER_MIN_ROWS
+            }
+        if not closes:
+            return False, "Ei tarpeeksi dataa optimointiin (vaaditaan vähintään 200 päivää)"
+
+        candidates = _param_candidates(grid)
+        if method == "random" and n_samples < len(candidates):
+            rng = np.random.default_rng(seed)
+            picked = rng.choice(len(candidates), size=n_samples, replace=False)
+            candidates = [candidates[i] for i in sorted(picked)]
+        workers = max_workers or min(len(candidates), os.cpu_count() or 1)
+
+        if method == "halving":
+            for fraction in HALVING_FRACTIONS[:-1]:
+                rows = _run_candidates(closes, strategy, candidates, fraction,
+                                       initial_capital, commission, workers)
+                rows.sort(key=lambda r: (r["sharpe_ratio"], r["strategy_return"]), reverse=True)
+                keep = max(1, -(-len(rows) // HALVING_ETA))
+                candidates = [{k: row[k] for k in grid} for row in rows[:keep]]
+        rows = _run_candidates(closes, strategy, candidates, 1.0, initial_capital, commission, workers)
+        return True, _rank_results(rows)
+
+    except Exception as e:
+        return False, f"Virhe optimoinnissa: {str(e)}"
+
+# --- Salkkutason backtesting ---
+# Yksi pääoma jaetaan kaikkien salkun osakkeiden kesken. Kurssit tasataan
+# yhteiselle päivämäärärivistölle (päivät × tunnukset): eri pörssien
+# pyhäpäivinä tunnuksen edellinen kurssi jää voimaan. Signaalit lasketaan
+# koko paneelille kerralla; kauppoja tehdään vain tapahtumapäivinä (signaalin
+# vaihtuminen tai tasapainotus), ja niiden välissä osakemäärät pysyvät
+# vakioina, joten salkun arvo lasketaan taulukko-operaatioilla.
+PORTFOLIO_WEIGHTINGS = ["equal", "signal"]
+PORTFOLIO_REBALANCE = {"none": None, "monthly": "M", "quarterly": "Q"}
+
+def align_close_panel(frames: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Kokoaa päätöskurssit yhteiselle päivämääräindeksille (päivät × tunnukset).
+
+    Puuttuvat päivät (toisen pörssin kauppapäivät) täytetään edellisellä
+    kurssilla; ennen tunnuksen ensimmäistä kurssia arvo jää NaN:ksi.
+    """
+    closes = {
+        symbol: (df.set_index("Date") if "Date" in df.columns else df)["Close"]
+        for symbol, df in frames.items() if df is not None and not df.empty
+    }
+    if not closes:
+        return pd.DataFrame()
+    panel = pd.concat(closes, axis=1).sort_index()
+    return panel[~panel.index.duplicated(keep="last")].ffill()
+
+def _rebalance_mask(dates: pd.DatetimeIndex, rebalance: str) -> np.ndarray:
+    """True jokaisen kuukauden/kvartaalin ensimmäisenä kauppapäivänä (ei aloituspäivänä)."""
+    freq = PORTFOLIO_REBALANCE[rebalance]
+    mask = np.zeros(len(dates), dtype=bool)
+    if freq and len(dates) > 1:
+        periods = pd.DatetimeIndex(dates).to_period(freq).asi8
+        mask[1:] = periods[1:] != periods[:-1]
+    return mask
+
+def _simulate_portfolio(prices: np.ndarray, holding: np.ndarray, rebalance_mask: np.ndarray,
+                        initial_capital: float, commission: float, weighting: str = "equal") -> dict:
+    """Salkun simulointiydin päivät × tunnukset -taulukoilla.
+
+    ``holding`` kertoo, halutaanko tunnusta pitää päivän lopussa. Kauppapäivät:
+      - myynti, kun tunnus poistuu (tuotto käteiseksi, kulut vähennetään)
+      - osto, kun tunnus tulee mukaan: "equal" käyttää enintään 1/N salkun
+        arvosta; "signal" muuttaa kaikki avoimet positiot tavoitepainoon
+        1/pidettyjen määrä aina, kun tunnus tulee mukaan tai poistuu
+      - tasapainotus ``rebalance_mask``-päivinä: pidettävät tunnukset
+        tavoitepainoihin (equal 1/N, signal 1/pidettyjen määrä)
+    Nollan suuruisia ostoja ei tehdä eikä lasketa kaupoiksi.
+    """
+    n_days, n_symbols = prices.shape
+    priced = np.nan_to_num(prices)
+    valid = ~np.isnan(prices)
+    holding = holding & valid
+    prev = np.vstack([np.zeros((1, n_symbols), dtype=bool), holding[:-1]])
+    events = np.flatnonzero((holding != prev).any(axis=1) | (rebalance_mask & holding.any(axis=1)))
+
+    cash = initial_capital
+    shares = np.zeros(n_symbols)
+    trades = 0
+    event_rows, cash_states, share_states = [], [], []
+
+    for t in events:
+        price = priced[t]
+        # Myynnit: tunnukset, joita ei enää pidetä
+        exits = (shares > 0) & ~holding[t]
+        if exits.any():
+            gross = shares[exits] * price[exits]
+            cash += (gross - gross * commission).sum()
+            shares[exits] = 0.0
+
+        total = cash + (shares * price).sum()
+        resize = rebalance_mask[t] or weighting == "signal"
+        if resize and holding[t].any():
+            weights = holding[t] / (n_symbols if weighting == "equal" else holding[t].sum())
+            delta = weights * total - shares * price
+            # Pyöristysjäännökset eivät ole kauppoja
+            delta[np.abs(delta) <= total * 1e-12] = 0.0
+            sells = delta < 0
+            if sells.any():
+                gross = -delta[sells]
+                cash += (gross - gross * commission).sum()
+                shares[sells] += delta[sells] / price[sells]
+            buys = delta > 0
+            amount = delta[buys] * min(1.0, cash / delta[buys].sum()) if buys.any() else delta[buys]
+        else:
+            buys = holding[t] & (shares == 0)
+            if weighting == "equal":
+                amount = np.full(buys.sum(), min(total / n_symbols, cash / max(buys.sum(), 1)))
+            else:
+                amount = np.full(buys.sum(), cash / max(buys.sum(), 1))
+        # Ostetaan vain positiivisilla summilla (käteinen voi olla jo käytetty)
+        funded = amount > 0
+        buys[buys] = funded
+        amount = amount[funded]
+        if buys.any():
+            cost = amount * commission
+            shares[buys] += (amount - cost) / price[buys]
+            cash -= amount.sum()
+            trades += int(buys.sum())
+
+        event_rows.append(t)
+        cash_states.append(cash)
+        share_states.append(shares.copy())
+
+    segment = np.searchsorted(np.asarray(event_rows, dtype=np.int64), np.arange(n_days), side="right") - 1
+    cash_by_day = np.append(np.asarray(cash_states, dtype=float), initial_capital)[segment]
+    share_matrix = np.vstack(share_states + [np.zeros(n_symbols)]) if share_states else np.zeros((1, n_symbols))
+    values = cash_by_day + (share_matrix[segment] * priced).sum(axis=1)
+
+    final_gross = shares * priced[-1] if n_days else shares
+    strategy_final = cash + (final_gross - final_gross * commission).sum()
+    return {"values": values, "trades": trades, "strategy_final": strategy_final, "shares": shares}
+
+def backtest_portfolio(symbols, years=5, initial_capital=10000, commission=0.001,
+                       strategy="RSI + SMA (perus)", weighting="equal", rebalance="none",
+                       params=None, frames=None):
+    """
+    Salkkutason backtest: yksi pääoma jaetaan kaikkien tunnusten kesken.
+
+    Args:
+        symbols: Salkun osaketunnukset.
+        weighting: "equal" (jokaiselle tunnukselle 1/N paikka, käyttämätön osuus
+            käteisenä) tai "signal" (pääoma jaetaan tasan signaalin saaneiden kesken).
+        rebalance: "none", "monthly" tai "quarterly".
+        params: Strategian parametrit (ks. DEFAULT_STRATEGY_PARAMS).
+        frames: Valmiit kurssit {tunnus: DataFrame}; muuten haetaan rinnakkain.
+
+    Returns:
+        (True, dict) tulokset (arvokäyrä, tuotto, Sharpe, drawdown, vertailu
+        tasapainotettuun Buy & Holdiin) tai (False, virheviesti).
+    """
+    try:
+        if weighting not in PORTFOLIO_WEIGHTINGS or rebalance not in PORTFOLIO_REBALANCE:
+            return False, f"Tuntematon painotus tai tasapainotus: {weighting}, {rebalance}"
+        if frames is None:
+            end_date = datetime.now()
+            start_date = end_date - timedelta(days=years * 365)
+            start, end = start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+            refresh_price_bars(list(symbols), start)  # raakahaut rinnakkain, välimuisti skriptisäikeessä
+            histories = call_each(fetch_stock_history, list(symbols), start, end)
+            frames = {s: df for s, df in zip(symbols, histories) if isinstance(df, pd.DataFrame)}
+        frames = {s: df for s, df in frames.items() if df is not None and len(df) >= BACKTEST_MIN_ROWS}
+        panel = align_close_panel(frames)
+        if panel.empty:
+            return False, "Ei tarpeeksi dataa backtestingiin (vaaditaan vähintään 200 päivää)"
+
+        prices = panel.to_numpy(dtype=float)
+        codes = _strategy_codes(strategy, _IndicatorMemo(prices), params)
+        # Pidetään tunnusta viimeisimmän BUY-signaalin jälkeen, kunnes tulee SELL
+        state = pd.DataFrame(np.where(codes == SIGNAL_HOLD, np.nan, codes)).ffill().to_numpy()
+        holding = state == SIGNAL_BUY
+        rebalance_mask = _rebalance_mask(panel.index, rebalance)
+
+        sim = _simulate_portfolio(prices, holding, rebalance_mask, initial_capital, commission, weighting)
+        bench = _simulate_portfolio(prices, ~np.isnan(prices), rebalance_mask, initial_capital, commission, "equal")
+
+        equity_df = pd.DataFrame({"Date": panel.index, "Value": sim["values"], "BuyHold": bench["values"]})
+        equity_df["Peak"] = equity_df["Value"].cummax()
+        equity_df["Drawdown"] = (equity_df["Value"] - equity_df["Peak"]) / equity_df["Peak"]
+        stats = _performance_stats(sim["values"], sim["strategy_final"], initial_capital)
+        bench_return = (bench["strategy_final"] - initial_capital) / initial_capital * 100
+
+        last_prices = np.nan_to_num(prices[-1])
+        return True, {
+            "symbols": list(panel.columns),
+            "strategy": strategy,
+            "weighting": weighting,
+            "rebalance": rebalance,
+            "initial_capital": initial_capital,
+            "strategy_final": round(float(sim["strategy_final"]), 2),
+            "strategy_return": round(float(stats["strategy_return"]), 2),
+            "buy_hold_final": round(float(bench["strategy_final"]), 2),
+            "buy_hold_return": round(float(bench_return), 2),
+            "trades": sim["trades"],
+            "max_drawdown": round(float(stats["max_drawdown"]), 2),
+            "sharpe_ratio": round(float(stats["sharpe_ratio"]), 2),
+            "equity_df": equity_df,
+            "final_weights": pd.Series(sim["shares"] * last_prices / max(sim["values"][-1], 1e-12),
+                                       index=panel.columns),
+        }
+
+    except Exception as e:
+        return False, f"Virhe salkun backtestingissä: {str(e)}"
+
+# Salkun backtestin kentät, jotka käyttöliittymä siirtää kehysvarastoon
+PORTFOLIO_FRAME_KEYS = ("equity_df", "final_weights")
+
+def portfolio_handle(symbols, years, initial_capital, commission, strategy,
+                     weighting="equal", rebalance="none") -> tuple:
+    """Salkun backtestin kehysvarastokahva (uudelleenlaskettavissa _portfolio_frames-funktiolla)."""
+    return ("portfolio", tuple(symbols), years, initial_capital, commission, strategy, weighting, rebalance)
+
+@_frame_loader("portfolio")
+def _portfolio_frames(symbols, years, initial_capital, commission, strategy, weighting, rebalance) -> dict:
+    """Ajaa salkun backtestin uudelleen, kun sen kehykset on poistettu varastosta."""
+    ok, result = backtest_portfolio(list(symbols), years, initial_capital, commission,
+                                    strategy, weighting, rebalance)
+    return {k: result[k] for k in PORTFOLIO_FRAME_KEYS} if ok else {}
+
 # --- Automaattinen yhteenveto ---
 def generate_stock_summary(detail):
     """
@@ -1709,12 +4817,123 @@ def generate_stock_summary(detail):
     return points
 
 # --- Kaaviot ---
-def plot_price_chart(df, symbol, trade_history=None):
-    """Luo hintakaavion indikaattoreiden ja signaalien kanssa"""
+# Pitkien historioiden kaaviot voi keventää (opt-in): jokaisesta sarjasta
+# piirretään enintään CHART_MAX_POINTS pistettä joko LTTB-menetelmällä
+# (Largest-Triangle-Three-Buckets) tai ämpärikohtaisilla minimeillä ja
+# maksimeilla. Piirrettyjen sarakkeiden ääriarvot ja kauppojen päivät
+# pakotetaan mukaan, joten huiput ja osto-/myyntimerkit säilyvät.
+CHART_MAX_POINTS = 800
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+# WebGL-tilassa (webgl=True) viivat piirretään Scattergl-jäljillä, kun pisteitä on vähintään näin monta
+WEBGL_MIN_POINTS = 1000
+
+def _finite_mean(values: np.ndarray) -> float:
+    """NaN-arvot ohittava keskiarvo (NaN, jos äärellisiä arvoja ei ole)."""
+    finite = values[~np.isnan(values)]
+    return float(finite.mean()) if finite.size else np.nan
+
+def lttb_indices(y, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: valitsee n_out indeksiä (ensimmäinen ja viimeinen mukana).
+
+    Jokaisesta ämpäristä valitaan piste, joka muodostaa suurimman kolmion
+    edellisen valitun pisteen ja seuraavan ämpärin keskiarvon kanssa.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nxt_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[hi:nxt_hi].mean(), _finite_mean(y[hi:nxt_hi])
+        areas = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(np.nan_to_num(areas, nan=-1.0)))
+        out[i + 1] = a
+    return out
+
+def minmax_indices(y, n_out: int) -> np.ndarray:
+    """Ämpärikohtainen minimi ja maksimi: enintään n_out indeksiä (ensimmäinen ja viimeinen mukana)."""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, (n_out - 2) // 2 + 1).astype(np.int64)
+    picks = [0, n - 1]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        seg = y[lo:hi]
+        if np.isnan(seg).all():
+            picks.append(lo)
+        else:
+            picks += [lo + int(np.nanargmin(seg)), lo + int(np.nanargmax(seg))]
+    return np.unique(picks)
+
+def downsample_indices(y, max_points: int | None, method: str = "lttb", keep=()) -> np.ndarray:
+    """Piirrettävien rivien indeksit järjestyksessä.
+
+    Args:
+        y: Pääsarja, jonka muodon mukaan pisteet valitaan.
+        max_points: Pisteiden enimmäismäärä; None = kaikki rivit.
+        method: "lttb" tai "minmax".
+        keep: Aina mukaan otettavat indeksit (ääriarvot, kaupat); ne vievät osan budjetista.
+    Raises:
+        ValueError: tuntematon menetelmä.
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Tuntematon harvennusmenetelmä: {method}")
+    n = len(y)
+    if max_points is None or n <= max_points:
+        return np.arange(n)
+    keep = np.unique(np.asarray(list(keep), dtype=np.int64))
+    budget = max(max_points - len(keep), 4)
+    picked = (lttb_indices if method == "lttb" else minmax_indices)(y, budget)
+    return np.union1d(picked, keep)
+
+def _chart_positions(df: pd.DataFrame, column: str, max_points: int | None, method: str,
+                     extrema=(), keep=()) -> np.ndarray | None:
+    """Kaavion rivipaikat harvennettuna tai None, kun kaikki rivit piirretään.
+
+    Sarakkeiden ``column`` ja ``extrema`` minimit ja maksimit pakotetaan mukaan.
+    """
+    if max_points is None or len(df) <= max_points:
+        return None
+    forced = list(keep)
+    for col in (column, *extrema):
+        if col in df.columns:
+            values = df[col].to_numpy(dtype=float)
+            if not np.isnan(values).all():
+                forced += [int(np.nanargmin(values)), int(np.nanargmax(values))]
+    return downsample_indices(df[column].to_numpy(dtype=float), max_points, method, forced)
+
+def _line_trace(n_points: int, webgl: bool):
+    """Viivajäljen luokka: Scattergl pitkille sarjoille WebGL-tilassa, muuten SVG-Scatter."""
+    return go.Scattergl if webgl and n_points >= WEBGL_MIN_POINTS else go.Scatter
+
+def chart_options() -> dict:
+    """Kaaviofunktioiden harvennus- ja WebGL-asetukset istunnosta (profiilin kaavioasetukset)."""
+    options = {"max_points": None, "webgl": bool(st.session_state.get("chart_webgl", False))}
+    if st.session_state.get("chart_downsample", False):
+        options.update(max_points=CHART_MAX_POINTS,
+                       method=st.session_state.get("chart_downsample_method", DOWNSAMPLE_METHODS[0]))
+    return options
+
+def plot_price_chart(df, symbol, trade_history=None, max_points=None, method="lttb", webgl=False):
+    """Luo hintakaavion indikaattoreiden ja signaalien kanssa.
+    max_points harventaa viivat (kauppamerkit piirretään aina kaikki)."""
+    trade_rows = np.flatnonzero(df["Date"].isin([t[1] for t in trade_history])) if trade_history else ()
+    pos = _chart_positions(df, "Close", max_points, method,
+                           extrema=("SMA50", "SMA200", "BB_upper", "BB_lower"), keep=trade_rows)
+    if pos is not None:
+        df = df.iloc[pos]
+    line = _line_trace(len(df), webgl)
     fig = go.Figure()
     
     # Hinta
-    fig.add_trace(go.Scatter(
+    fig.add_trace(line(
         x=df["Date"], 
         y=df["Close"],
         name="Hinta",
@@ -1723,7 +4942,7 @@ def plot_price_chart(df, symbol, trade_history=None):
     
     # SMA50
     if "SMA50" in df.columns:
-        fig.add_trace(go.Scatter(
+        fig.add_trace(line(
             x=df["Date"],
             y=df["SMA50"],
             name="SMA50",
@@ -1732,7 +4951,7 @@ def plot_price_chart(df, symbol, trade_history=None):
     
     # SMA200
     if "SMA200" in df.columns:
-        fig.add_trace(go.Scatter(
+        fig.add_trace(line(
             x=df["Date"],
             y=df["SMA200"],
             name="SMA200",
@@ -1741,13 +4960,13 @@ def plot_price_chart(df, symbol, trade_history=None):
 
     # Bollinger Bands
     if "BB_upper" in df.columns:
-        fig.add_trace(go.Scatter(
+        fig.add_trace(line(
             x=df["Date"],
             y=df["BB_upper"],
             name="BB Yläkaista",
             line=dict(color="rgba(128,0,128,0.4)", width=1),
         ))
-        fig.add_trace(go.Scatter(
+        fig.add_trace(line(
             x=df["Date"],
             y=df["BB_lower"],
             name="BB Alakaista",
@@ -1791,17 +5010,21 @@ def plot_price_chart(df, symbol, trade_history=None):
     
     return fig
 
-def plot_macd_chart(df):
+def plot_macd_chart(df, max_points=None, method="lttb", webgl=False):
     """Luo MACD-kaavion"""
+    pos = _chart_positions(df, "MACD", max_points, method, extrema=("MACD_signal",))
+    if pos is not None:
+        df = df.iloc[pos]
+    line = _line_trace(len(df), webgl)
     fig = go.Figure()
 
-    fig.add_trace(go.Scatter(
+    fig.add_trace(line(
         x=df["Date"],
         y=df["MACD"],
         name="MACD",
         line=dict(color="blue", width=1.5)
     ))
-    fig.add_trace(go.Scatter(
+    fig.add_trace(line(
         x=df["Date"],
         y=df["MACD_signal"],
         name="Signaaliviiva",
@@ -1830,11 +5053,14 @@ def plot_macd_chart(df):
     )
     return fig
 
-def plot_equity_curve(equity_df, symbol, initial_capital):
+def plot_equity_curve(equity_df, symbol, initial_capital, max_points=None, method="lttb", webgl=False):
     """Luo equity curve -kaavion (pääoman kehitys)"""
+    pos = _chart_positions(equity_df, "Value", max_points, method)
+    if pos is not None:
+        equity_df = equity_df.iloc[pos]
     fig = go.Figure()
 
-    fig.add_trace(go.Scatter(
+    fig.add_trace(_line_trace(len(equity_df), webgl)(
         x=equity_df["Date"],
         y=equity_df["Value"],
         name="Strategia",
@@ -1859,11 +5085,14 @@ def plot_equity_curve(equity_df, symbol, initial_capital):
     )
     return fig
 
-def plot_rsi_chart(df):
+def plot_rsi_chart(df, max_points=None, method="lttb", webgl=False):
     """Luo RSI-kaavion"""
+    pos = _chart_positions(df, "RSI", max_points, method)
+    if pos is not None:
+        df = df.iloc[pos]
     fig = go.Figure()
     
-    fig.add_trace(go.Scatter(
+    fig.add_trace(_line_trace(len(df), webgl)(
         x=df["Date"],
         y=df["RSI"],
         name="RSI",
@@ -1886,13 +5115,19 @@ def plot_rsi_chart(df):
     return fig
 
 
-def plot_volume_chart(df, symbol):
+def plot_volume_chart(df, symbol, max_points=None, method="lttb", webgl=False):
     """Luo volyymi-kaavion väripalkeilla (vihreä = nousu, punainen = lasku)"""
     colors = [
         "green" if df["Close"].iloc[i] >= df["Close"].iloc[i - 1] else "red"
         for i in range(len(df))
     ]
     colors[0] = "gray"
+    # Värit ja keskiarvo lasketaan koko sarjasta ennen harvennusta
+    vol_ma = df["Volume"].rolling(20).mean()
+    pos = _chart_positions(df, "Volume", max_points, method)
+    if pos is not None:
+        df, vol_ma = df.iloc[pos], vol_ma.iloc[pos]
+        colors = [colors[i] for i in pos]
 
     fig = go.Figure()
     fig.add_trace(go.Bar(
@@ -1904,8 +5139,7 @@ def plot_volume_chart(df, symbol):
     ))
 
     # 20 pv volyymikeskiarvo
-    vol_ma = df["Volume"].rolling(20).mean()
-    fig.add_trace(go.Scatter(
+    fig.add_trace(_line_trace(len(df), webgl)(
         x=df["Date"],
         y=vol_ma,
         name="Vol MA(20)",
@@ -1921,6 +5155,64 @@ def plot_volume_chart(df, symbol):
     )
     return fig
 
+# --- Kaavioiden välimuisti ---
+# Rakennetut kaaviot ovat kaikkien istuntojen yhteisiä: avaimena kaavion laji,
+# kieli, variantti (esim. backtestin kehyskahva), piirtoasetukset ja sarjan
+# sormenjälki (_series_key: tunnus, viimeinen päivä, rivimäärä, päätöskurssit).
+# Streamlit ei muokkaa sille annettua kuvaajaa, joten sama olio voidaan
+# näyttää useassa istunnossa.
+FIGURE_CACHE_SIZE = 64
+
+class FigureCache:
+    """Säieturvallinen LRU-välimuisti rakennetuille Plotly-kaavioille."""
+
+    def __init__(self, max_entries: int = FIGURE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._figures: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key: tuple, build) -> go.Figure:
+        """Palauttaa avaimen kaavion tai rakentaa sen build()-kutsulla (lukon ulkopuolella)."""
+        with self._lock:
+            fig = self._figures.get(key)
+            if fig is not None:
+                self._figures.move_to_end(key)
+                self.hits += 1
+                return fig
+            self.misses += 1
+        fig = build()
+        with self._lock:
+            self._figures[key] = fig
+            while len(self._figures) > self.max_entries:
+                self._figures.popitem(last=False)
+        return fig
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._figures)
+
+@st.cache_resource
+def _get_figure_cache() -> FigureCache:
+    """Palauttaa prosessinlaajuisen kaaviovälimuistin."""
+    return FigureCache()
+
+def cached_figure(kind: str, symbol: str, frame: pd.DataFrame, builder, *args,
+                  variant=(), **options) -> go.Figure:
+    """Palauttaa kaavion builder(*args, **options) välimuistista tai rakentaa sen.
+
+    Args:
+        kind: Kaavion laji (esim. "price", "rsi", "equity").
+        frame: Kaavion sarja; sormenjälki Close-sarakkeesta (tai Value, jos Closea ei ole).
+        variant: Lisäavain, jos sama sarja piirretään eri sisällöllä (esim. backtestin kahva).
+        options: Piirtoasetukset (max_points, method, webgl) – osa avainta.
+    """
+    column = "Close" if "Close" in frame.columns else "Value"
+    key = (kind, st.session_state.get("lang", "fi"), variant, tuple(sorted(options.items())),
+           _series_key(symbol, frame, column))
+    return _get_figure_cache().get_or_build(key, lambda: builder(*args, **options))
+
 # --- Kirjautumissivu ---
 def show_login_page():
     lang = st.session_state.get("lang", "fi")
@@ -2011,6 +5303,16 @@ def show_profile_sidebar():
                 st.session_state["lang"] = new_lang
                 st.rerun()
 
+        # Pitkien kaavioiden keventäminen (istuntokohtainen, oletuksena pois)
+        st.markdown("---")
+        st.toggle(t("profile_chart_downsample"), key="chart_downsample",
+                  help=t("profile_chart_downsample_help", points=CHART_MAX_POINTS))
+        if st.session_state.get("chart_downsample"):
+            st.radio(t("profile_chart_method"), options=list(DOWNSAMPLE_METHODS), key="chart_downsample_method",
+                     format_func=lambda m: "LTTB" if m == "lttb" else "Min/max", horizontal=True)
+        st.toggle(t("profile_chart_webgl"), key="chart_webgl",
+                  help=t("profile_chart_webgl_help", points=WEBGL_MIN_POINTS))
+
         st.markdown("---")
         st.markdown(t("profile_change_pw"))
         with st.form("pw_form"):
@@ -2079,7 +5381,187 @@ def show_profile_sidebar():
 
 
 
+# --- Pörssilistanäkymä ---
+
+def _color_change(val: object) -> str:
+    """Väritää muutos %-arvon vihreäksi tai punaiseksi."""
+    if isinstance(val, (int, float)):
+        return "color: green" if val > 0 else ("color: red" if val < 0 else "")
+    return ""
+
+def _color_signal(val: object) -> str:
+    """Väritää signaalin vihreäksi/punaiseksi."""
+    if isinstance(val, str):
+        if "OSTA" in val:
+            return "color: green; font-weight: bold"
+        if "MYY" in val:
+            return "color: red; font-weight: bold"
+    return ""
+
+def _symbol_list(symbols: list[str], limit: int = 10) -> str:
+    """Lyhentää tunnuslistan ilmoitusta varten: "A, B, C … (+N)"."""
+    shown = ", ".join(symbols[:limit])
+    return f"{shown} … (+{len(symbols) - limit})" if len(symbols) > limit else shown
+
+def render_screener_view(market: str, active_portfolio_id: int, active_portfolio_name: str) -> None:
+    """Piirtää yhden SCREENER_MARKETS-pörssilistan näkymän (synkronointi, suodatus, taulukko)."""
+    config = SCREENER_MARKETS[market]
+    universe = config["universe"]
+
+    st.header(_screener_text(market, "header"))
+    st.markdown(_screener_text(market, "count", n=len(universe)))
+
+    # Auto-refresh asetukset
+    col_r1, col_r2 = st.columns([2, 1])
+    with col_r1:
+        auto_refresh = st.toggle(
+            t("fi_auto_refresh"),
+            value=False,
+            key=f"{market}_auto_refresh",
+            help=_screener_text(market, "auto_refresh_help"),
+        )
+    with col_r2:
+        refresh_interval = st.selectbox(
+            t("fi_interval"),
+            options=[60, 120, 300],
+            format_func=lambda x: f"{x//60} min",
+            index=0,
+            disabled=not auto_refresh,
+            key=f"{market}_refresh_interval",
+        )
+
+    col_btn1, col_btn2, _ = st.columns([1, 1, 4])
+    with col_btn1:
+        sync_all = st.button(t("fi_sync_all"), key=f"{market}_sync")
+    with col_btn2:
+        clear_cache_btn = st.button(t("fi_clear_cache"), key=f"{market}_clear_cache")
+
+    if clear_cache_btn:
+        invalidate_market_cache(list(universe), include_info=True)
+        st.toast(t("fi_cache_cleared"), icon="🗑️")
+
+    # Hae data — VAIN kun nappia painetaan manuaalisesti tai auto-refresh -ajastus erääntyy
+    if sync_all:
+        st.session_state[f"{market}_sync_requested"] = True
+
+    # Taulukko on oma fragmenttinsa: auto-refresh ajaa uudelleen vain tämän
+    # osion (run_every) eikä pysäytä istuntoa time.sleepillä tai aja muita välilehtiä.
+    # Suljetun pörssin lista tarkistetaan harvemmin, ja se päivitetään vain
+    # kerran sulkeutumisen jälkeen (market_refresh_due)
+    market_open = is_market_open(market)
+    run_every = refresh_interval if market_open else max(refresh_interval, CLOSED_REFRESH_INTERVAL)
+
+    @st.fragment(run_every=run_every if auto_refresh else None)
+    def table_fragment():
+        worker_alive = worker_is_alive()
+        last_sync = get_screener_synced_at(market)
+        if (auto_refresh and _refresh_due(market, refresh_interval)
+                and market_refresh_due(market, _to_epoch(last_sync) if last_sync else 0.0)):
+            if worker_alive:
+                # Taustapäivittäjä pitää tulokset tuoreina: fragmentti vain lukee kannan uudelleen
+                st.session_state[f"{market}_synced_at"] = time.time()
+            else:
+                # Kohdennettu invalidointi: vain tämän listan kurssit haetaan uudelleen
+                invalidate_market_cache(list(universe))
+                st.session_state[f"{market}_sync_requested"] = True
+
+        if st.session_state.get(f"{market}_sync_requested"):
+            st.session_state[f"{market}_synced_at"] = time.time()
+            progress_bar = st.progress(0, text=t("fi_fetching_start"))
+            sync_screener_market(market, progress=lambda fraction, text: progress_bar.progress(fraction, text=text))
+            progress_bar.empty()
+            st.session_state[f"{market}_sync_requested"] = False
+            st.session_state.pop(f"{market}_signal_filter", None)
+            st.session_state.pop(f"{market}_search", None)
+
+        saved_ts = format_synced_at(get_screener_synced_at(market))
+        if saved_ts:
+            st.caption(t("fi_last_synced", ts=saved_ts))
+            if worker_alive:
+                st.caption(t("worker_active"))
+            if not market_open:
+                opens = market_next_open(market)
+                if opens is not None:
+                    st.caption(t("market_closed", ts=opens.strftime("%d.%m.%Y %H:%M %Z")))
+            if not yahoo_available():
+                st.warning(t("yahoo_unavailable"))
+            stale, missing = screener_coverage(market)
+            if stale:
+                st.warning(t("screener_stale", n=len(stale), symbols=_symbol_list(stale)))
+            if missing:
+                st.caption(t("screener_missing", n=len(missing), symbols=_symbol_list(missing)))
+
+            # Suodatin
+            col_f1, col_f2 = st.columns([3, 1])
+            with col_f1:
+                search = st.text_input(_screener_text(market, "search"), "", key=f"{market}_search")
+            with col_f2:
+                signal_filter = st.selectbox(
+                    t("fi_signal_filter"),
+                    options=[t("fi_signal_all"), *SCREENER_SIGNAL_LABELS.values()],
+                    key=f"{market}_signal_filter",
+                )
+
+            # Haku ja signaalisuodatus tehdään SQLitessä indeksejä vasten
+            df = screener_display_frame(
+                query_screener(
+                    market, search,
+                    None if signal_filter == t("fi_signal_all") else signal_filter,
+                ),
+                config["name_key"], config["price_key"], fundamentals=config["fundamentals"],
+            )
+            styled = df.style.map(_color_change, subset=[t("col_change")]).map(
+                _color_signal, subset=[t("col_signal")]
+            )
+            st.dataframe(styled, width='stretch', hide_index=True)
+
+            # Lisää yksittäisiä tunnuksia salkkuun taulukosta
+            st.markdown("---")
+            col_sel1, col_sel2 = st.columns([2, 1])
+            with col_sel1:
+                selected = st.multiselect(
+                    _screener_text(market, "add_multiselect"),
+                    options=list(universe),
+                    format_func=lambda s: f"{s} – {universe[s]}",
+                    key=f"{market}_multiselect",
+                )
+            with col_sel2:
+                st.write("")
+                st.write("")
+                if st.button(_screener_text(market, "add_btn"), key=f"{market}_add_selected") and selected:
+                    added, skipped, errs = add_stocks_bulk(selected, active_portfolio_id)
+                    st.success(t("fi_added", portfolio=active_portfolio_name, added=added, skipped=skipped))
+                    st.rerun()
+
+            # CSV-lataus
+            st.download_button(
+                label=_screener_text(market, "download"),
+                data=df.to_csv(index=False).encode("utf-8"),
+                file_name=f"{config['file_prefix']}_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                mime="text/csv",
+            )
+        else:
+            st.info(t("fi_press_sync"))
+
+    table_fragment()
+
+
 # --- Streamlit UI ---
+def views() -> list[str]:
+    """Päänäkymät navigointijärjestyksessä, mukana myös myöhemmin rekisteröidyt pörssilistat.
+
+    Otsikot käännöksistä avaimella "tab_<näkymä>"; omalle pörssilistalle
+    ilman käännöstä käytetään sen "label"-asetusta tai tunnistetta.
+    """
+    return ["analysis", *SCREENER_MARKETS, "funds", "backtest", "info"]
+
+def view_label(view: str) -> str:
+    """Näkymän otsikko navigointiin."""
+    key = f"tab_{view}"
+    if key in TRANSLATIONS["fi"]:
+        return t(key)
+    return SCREENER_MARKETS.get(view, {}).get("label", view)
+
 def main():
     st.set_page_config(
         page_title="Osakeanalyysi-työkalu",
@@ -2087,14 +5569,18 @@ def main():
         layout="wide"
     )
 
-    # Alusta tietokanta
-    init_db()
+    # Alusta tietokanta (migraatiot ajetaan vain kerran prosessia kohden)
+    _ensure_schema(DB_NAME)
 
     # Tarkista kirjautuminen
     if not st.session_state.get("logged_in", False):
         show_login_page()
         st.stop()
 
+    # Istunnon muistibudjetti: suurimmat uudelleenajettavat tulokset pudotetaan
+    if enforce_session_budget():
+        st.toast(t("session_trimmed"))
+
     st.markdown("""
 <style>
 /* Pienennä ylätila */
@@ -2211,19 +5697,26 @@ def main():
     # Päänäkymä
     stocks_df = get_stocks(active_portfolio_id)
 
-    # Välilehdet — salkku-välilehti ei vaadi osakkeita etukäteen
-    tab1, tab3, tab5, tab6, tab7, tab2, tab4 = st.tabs([
-        t("tab_analysis"),
-        t("tab_fi"),
-        t("tab_us"),
-        t("tab_eu"),
-        t("tab_funds"),
-        t("tab_backtest"),
-        t("tab_info"),
-    ])
+    # Näkymävalinta — toisin kuin st.tabs, vain aktiivisen näkymän koodi suoritetaan,
+    # joten esim. rahastojen painikkeet eivät käynnistä Analyysi-näkymän hakuja.
+    # Valinta säilyy URL:ssa (?view=…), jolloin sivun päivitys palaa samaan näkymään.
+    view_options = views()
+    if st.session_state.get("active_view") not in view_options:
+        requested_view = st.query_params.get("view")
+        st.session_state["active_view"] = requested_view if requested_view in view_options else view_options[0]
+    active_view = st.radio(
+        t("nav_label"),
+        options=view_options,
+        format_func=view_label,
+        horizontal=True,
+        label_visibility="collapsed",
+        key="active_view",
+    )
+    if st.query_params.get("view") != active_view:
+        st.query_params["view"] = active_view
 
     # --- ANALYYSI-välilehti ---
-    with tab1:
+    if active_view == "analysis":
         st.subheader(f"{t('analysis_header')} – {active_portfolio_name}")
 
         if stocks_df.empty:
@@ -2236,21 +5729,25 @@ def main():
                 st.caption(f"{t('analysis_last_updated')}: {datetime.now().strftime('%H:%M:%S')}")
 
             if manual_refresh:
-                fetch_stock_data.clear()
+                _cached_stock_data.clear()
                 st.rerun()
 
-            # Analysoi kaikki osakkeet
+            # Analysoi kaikki osakkeet rinnakkain (jaettu rajoitin hoitaa rate limitin)
             results = []
             with st.spinner(t("analysis_spinner")):
-                for i, symbol in enumerate(stocks_df["symbol"]):
-                    if i > 0:
-                        time.sleep(0.5)  # Vältetään Yahoo Finance rate limit
-                    success, data = get_stock_analysis(symbol)
+                symbols = list(stocks_df["symbol"])
+                for symbol, (success, data) in zip(symbols, analyze_many(symbols)):
                     if success:
                         results.append(data)
                     else:
                         st.warning(f"{symbol}: {data}")
 
+            stale = [r["symbol"] for r in results if r.get("stale")]
+            if stale:
+                st.warning(t("analysis_stale", symbols=_symbol_list(stale)))
+            elif not yahoo_available():
+                st.warning(t("yahoo_unavailable"))
+
             if results:
                 display_data = []
                 for r in results:
@@ -2339,20 +5836,29 @@ def main():
                             fi_summary = translate_to_finnish(detail["summary"])
                         st.write(fi_summary)
 
-                # Kaaviot: hinta + volume
-                fig_d_price = plot_price_chart(detail["df"], detail["symbol"])
-                st.plotly_chart(fig_d_price, width='stretch')
+                # Kaaviot: hinta + volume (kehys haetaan jaetusta varastosta)
+                detail_df = result_frames(detail).get("df")
+                if detail_df is None:
+                    st.info(t("frames_unavailable"))
+                else:
+                    chart_opts = chart_options()
+                    fig_d_price = cached_figure("price", detail["symbol"], detail_df, plot_price_chart,
+                                                detail_df, detail["symbol"], **chart_opts)
+                    st.plotly_chart(fig_d_price, width='stretch')
 
-                if "Volume" in detail["df"].columns:
-                    fig_d_vol = plot_volume_chart(detail["df"], detail["symbol"])
-                    st.plotly_chart(fig_d_vol, width='stretch')
+                    if "Volume" in detail_df.columns:
+                        fig_d_vol = cached_figure("volume", detail["symbol"], detail_df, plot_volume_chart,
+                                                  detail_df, detail["symbol"], **chart_opts)
+                        st.plotly_chart(fig_d_vol, width='stretch')
 
-                if "MACD" in detail["df"].columns:
-                    fig_d_macd = plot_macd_chart(detail["df"])
-                    st.plotly_chart(fig_d_macd, width='stretch')
+                    if "MACD" in detail_df.columns:
+                        fig_d_macd = cached_figure("macd", detail["symbol"], detail_df, plot_macd_chart,
+                                                   detail_df, **chart_opts)
+                        st.plotly_chart(fig_d_macd, width='stretch')
 
-                fig_d_rsi = plot_rsi_chart(detail["df"])
-                st.plotly_chart(fig_d_rsi, width='stretch')
+                    fig_d_rsi = cached_figure("rsi", detail["symbol"], detail_df, plot_rsi_chart,
+                                              detail_df, **chart_opts)
+                    st.plotly_chart(fig_d_rsi, width='stretch')
 
                 # Uutiset yfinancesta
                 with st.expander("📰 Viimeisimmät uutiset"):
@@ -2390,394 +5896,12 @@ def main():
 
 
     
-    # --- USA:n PÖRSSI -välilehti ---
-    with tab5:
-        # Lataa tallennettu data DB:stä session_stateen jos sivu on refreshattu
-        if "us_data" not in st.session_state:
-            cached_us_data, cached_us_ts = load_us_cache()
-            if cached_us_data:
-                st.session_state["us_data"] = cached_us_data
-                st.session_state["us_last_sync"] = cached_us_ts
-
-        st.header(t("us_header"))
-        st.markdown(t("us_count", n=len(US_STOCKS)))
-
-        # Auto-refresh asetukset
-        col_ur1, col_ur2 = st.columns([2, 1])
-        with col_ur1:
-            us_auto_refresh = st.toggle(
-                t("fi_auto_refresh"),
-                value=False,
-                key="us_auto_refresh",
-                help=t("us_auto_refresh_help"),
-            )
-        with col_ur2:
-            us_refresh_interval = st.selectbox(
-                t("fi_interval"),
-                options=[60, 120, 300],
-                format_func=lambda x: f"{x//60} min",
-                index=0,
-                disabled=not us_auto_refresh,
-                key="us_refresh_interval",
-            )
-
-        col_ubtn1, col_ubtn2, col_uts = st.columns([1, 1, 4])
-        with col_ubtn1:
-            us_sync_all = st.button(t("fi_sync_all"), key="us_sync")
-        with col_ubtn2:
-            us_clear_cache_btn = st.button(t("fi_clear_cache"), key="us_clear_cache")
-        with col_uts:
-            us_ts_placeholder = st.empty()
-            us_saved_ts = st.session_state.get("us_last_sync")
-            if us_saved_ts:
-                us_ts_placeholder.caption(t("fi_last_synced", ts=us_saved_ts))
-
-        if us_clear_cache_btn:
-            fetch_stock_data.clear()
-            st.toast(t("fi_cache_cleared"), icon="🗑️")
-
-        # Hae data — VAIN kun nappia painetaan manuaalisesti tai auto-refresh on päällä
-        if us_sync_all or us_auto_refresh:
-            st.session_state["us_sync_requested"] = True
-
-        if st.session_state.get("us_sync_requested"):
-            us_results = []
-            us_progress_bar = st.progress(0, text=t("fi_fetching_start"))
-            us_symbols_list = list(US_STOCKS.keys())
-            us_total = len(us_symbols_list)
-
-            for idx, symbol in enumerate(us_symbols_list):
-                try:
-                    df_tmp, info_tmp = fetch_stock_data(symbol, period="6mo")
-                    if not df_tmp.empty:
-                        df_tmp = df_tmp.reset_index()
-                        latest_price = round(df_tmp["Close"].iloc[-1], 2)
-                        prev_price = df_tmp["Close"].iloc[-2] if len(df_tmp) > 1 else latest_price
-                        change_pct = round((latest_price - prev_price) / prev_price * 100, 2)
-                        market_cap = info_tmp.get("marketCap", None)
-                        pe = info_tmp.get("trailingPE", None)
-                        currency = info_tmp.get("currency", "USD")
-
-                        rsi_val = None
-                        sma50_val = None
-                        signal = "🟡 PIDÄ"
-                        if len(df_tmp) >= 15:
-                            rsi_series = ta.momentum.RSIIndicator(df_tmp["Close"], window=14).rsi()
-                            rsi_val = rsi_series.iloc[-1]
-                            rsi_val = round(rsi_val, 1) if pd.notna(rsi_val) else None
-                        if len(df_tmp) >= 50:
-                            sma50_val = round(df_tmp["Close"].rolling(50).mean().iloc[-1], 2)
-
-                        if rsi_val is not None and sma50_val is not None:
-                            if rsi_val < 30 and latest_price > sma50_val:
-                                signal = "🟢 OSTA"
-                            elif rsi_val > 70:
-                                signal = "🔴 MYY"
-
-                        us_results.append({
-                            t("col_symbol"): symbol,
-                            t("col_company"): US_STOCKS[symbol],
-                            t("col_price_usd"): latest_price,
-                            t("col_change"): change_pct,
-                            "RSI": rsi_val,
-                            t("col_sma50"): sma50_val,
-                            t("col_signal"): signal,
-                            t("col_currency"): currency,
-                            t("col_pe"): round(pe, 2) if pe else None,
-                            t("col_market_cap"): f"{market_cap/1e9:.1f} Mrd" if market_cap else None,
-                        })
-                except Exception:  # noqa: BLE001
-                    pass
-                us_progress_bar.progress((idx + 1) / us_total, text=t("fi_fetching", symbol=symbol, idx=idx+1, total=us_total))
-
-            us_progress_bar.empty()
-            st.session_state["us_data"] = us_results
-            st.session_state["us_last_sync"] = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-            save_us_cache(us_results, st.session_state["us_last_sync"])
-            st.session_state["us_sync_requested"] = False
-            st.session_state.pop("us_signal_filter", None)
-            st.session_state.pop("us_search", None)
-            st.rerun()
-
-        if "us_data" in st.session_state and st.session_state["us_data"]:
-            us_df = pd.DataFrame(st.session_state["us_data"])
-            us_df = _remap_df_columns(us_df, [
-                "col_symbol", "col_company", "col_price_usd", "col_change",
-                "col_sma50", "col_signal", "col_currency", "col_pe", "col_market_cap",
-            ])
-
-            col_uf1, col_uf2 = st.columns([3, 1])
-            with col_uf1:
-                search_us = st.text_input(t("fi_search"), "", key="us_search")
-            with col_uf2:
-                us_signal_filter = st.selectbox(
-                    t("fi_signal_filter"),
-                    options=[t("fi_signal_all"), "🟢 OSTA", "🔴 MYY", "🟡 PIDÄ"],
-                    key="us_signal_filter",
-                )
-
-            us_sym_col = t("col_symbol")
-            us_co_col  = t("col_company")
-            us_sig_col = t("col_signal")
-            us_chg_col = t("col_change")
-            if search_us:
-                mask_us = (
-                    us_df[us_sym_col].str.contains(search_us.upper(), na=False)
-                    | us_df[us_co_col].str.contains(search_us, case=False, na=False)
-                )
-                us_df = us_df[mask_us]
-            if us_signal_filter != t("fi_signal_all") and us_sig_col in us_df.columns:
-                us_df = us_df[us_df[us_sig_col] == us_signal_filter]
-
-            def color_change_us(val: object) -> str:
-                """Väritää muutos %-arvo vihreäksi tai punaiseksi."""
-                if isinstance(val, (int, float)):
-                    return "color: green" if val > 0 else ("color: red" if val < 0 else "")
-                return ""
-
-            def color_signal_us(val: object) -> str:
-                """Väritää signaalin vihreäksi/punaiseksi."""
-                if isinstance(val, str):
-                    if "OSTA" in val:
-                        return "color: green; font-weight: bold"
-                    if "MYY" in val:
-                        return "color: red; font-weight: bold"
-                return ""
-
-            if us_sig_col in us_df.columns:
-                styled_us = us_df.style.map(color_change_us, subset=[us_chg_col]).map(
-                    color_signal_us, subset=[us_sig_col]
-                )
-            else:
-                styled_us = us_df.style.map(color_change_us, subset=[us_chg_col])
-            st.dataframe(styled_us, width='stretch', hide_index=True)
-
-            # Lisää yksittäisiä US-osakkeita salkkuun
-            st.markdown("---")
-            col_usel1, col_usel2 = st.columns([2, 1])
-            with col_usel1:
-                selected_us = st.multiselect(
-                    t("us_add_multiselect"),
-                    options=list(US_STOCKS.keys()),
-                    format_func=lambda s: f"{s} – {US_STOCKS[s]}",
-                    key="us_multiselect",
-                )
-            with col_usel2:
-                st.write("")
-                st.write("")
-                if st.button(t("us_add_btn"), key="us_add_selected") and selected_us:
-                    added, skipped, errs = add_stocks_bulk(selected_us, active_portfolio_id)
-                    st.success(t("fi_added", portfolio=active_portfolio_name, added=added, skipped=skipped))
-                    st.rerun()
-
-            csv_us = us_df.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label=t("us_download"),
-                data=csv_us,
-                file_name=f"usa_porssi_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                mime="text/csv",
-            )
-        else:
-            st.info(t("fi_press_sync"))
-
-        # Auto-refresh loppusilmukka
-        if us_auto_refresh:
-            time.sleep(us_refresh_interval)
-            fetch_stock_data.clear()
-            st.session_state["us_sync_requested"] = True
-            st.rerun()
-
-    # --- EU / POHJOISMAAT ETF:t -välilehti ---
-    with tab6:
-        if "eu_data" not in st.session_state:
-            cached_eu_data, cached_eu_ts = load_eu_cache()
-            if cached_eu_data:
-                st.session_state["eu_data"] = cached_eu_data
-                st.session_state["eu_last_sync"] = cached_eu_ts
-
-        st.header(t("eu_header"))
-        st.markdown(t("eu_count", n=len(EU_ETFS)))
-
-        col_er1, col_er2 = st.columns([2, 1])
-        with col_er1:
-            eu_auto_refresh = st.toggle(
-                t("fi_auto_refresh"),
-                value=False,
-                key="eu_auto_refresh",
-                help=t("eu_auto_refresh_help"),
-            )
-        with col_er2:
-            eu_refresh_interval = st.selectbox(
-                t("fi_interval"),
-                options=[60, 120, 300],
-                format_func=lambda x: f"{x//60} min",
-                index=0,
-                disabled=not eu_auto_refresh,
-                key="eu_refresh_interval",
-            )
-
-        col_ebtn1, col_ebtn2, col_ets = st.columns([1, 1, 4])
-        with col_ebtn1:
-            eu_sync_all = st.button(t("fi_sync_all"), key="eu_sync")
-        with col_ebtn2:
-            eu_clear_cache_btn = st.button(t("fi_clear_cache"), key="eu_clear_cache")
-        with col_ets:
-            eu_ts_placeholder = st.empty()
-            eu_saved_ts = st.session_state.get("eu_last_sync")
-            if eu_saved_ts:
-                eu_ts_placeholder.caption(t("fi_last_synced", ts=eu_saved_ts))
-
-        if eu_clear_cache_btn:
-            fetch_stock_data.clear()
-            st.toast(t("fi_cache_cleared"), icon="🗑️")
-
-        if eu_sync_all or eu_auto_refresh:
-            st.session_state["eu_sync_requested"] = True
-
-        if st.session_state.get("eu_sync_requested"):
-            eu_results = []
-            eu_progress_bar = st.progress(0, text=t("fi_fetching_start"))
-            eu_symbols_list = list(EU_ETFS.keys())
-            eu_total = len(eu_symbols_list)
-
-            for idx, symbol in enumerate(eu_symbols_list):
-                try:
-                    df_tmp, info_tmp = fetch_stock_data(symbol, period="6mo")
-                    if not df_tmp.empty:
-                        df_tmp = df_tmp.reset_index()
-                        latest_price = round(df_tmp["Close"].iloc[-1], 4)
-                        prev_price = df_tmp["Close"].iloc[-2] if len(df_tmp) > 1 else latest_price
-                        change_pct = round((latest_price - prev_price) / prev_price * 100, 2)
-                        currency = info_tmp.get("currency", "EUR")
-
-                        rsi_val = None
-                        sma50_val = None
-                        signal = "🟡 PIDÄ"
-                        if len(df_tmp) >= 15:
-                            rsi_series = ta.momentum.RSIIndicator(df_tmp["Close"], window=14).rsi()
-                            rsi_val = rsi_series.iloc[-1]
-                            rsi_val = round(rsi_val, 1) if pd.notna(rsi_val) else None
-                        if len(df_tmp) >= 50:
-                            sma50_val = round(df_tmp["Close"].rolling(50).mean().iloc[-1], 4)
-
-                        if rsi_val is not None and sma50_val is not None:
-                            if rsi_val < 30 and latest_price > sma50_val:
-                                signal = "🟢 OSTA"
-                            elif rsi_val > 70:
-                                signal = "🔴 MYY"
-
-                        eu_results.append({
-                            t("col_symbol"): symbol,
-                            t("col_etf_name"): EU_ETFS[symbol],
-                            t("col_price_eur"): latest_price,
-                            t("col_change"): change_pct,
-                            "RSI": rsi_val,
-                            t("col_sma50"): sma50_val,
-                            t("col_signal"): signal,
-                            t("col_currency"): currency,
-                        })
-                except Exception:  # noqa: BLE001
-                    pass
-                eu_progress_bar.progress((idx + 1) / eu_total, text=t("fi_fetching", symbol=symbol, idx=idx+1, total=eu_total))
-
-            eu_progress_bar.empty()
-            st.session_state["eu_data"] = eu_results
-            st.session_state["eu_last_sync"] = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-            save_eu_cache(eu_results, st.session_state["eu_last_sync"])
-            st.session_state["eu_sync_requested"] = False
-            st.session_state.pop("eu_signal_filter", None)
-            st.session_state.pop("eu_search", None)
-            st.rerun()
-
-        if "eu_data" in st.session_state and st.session_state["eu_data"]:
-            eu_df = pd.DataFrame(st.session_state["eu_data"])
-            eu_df = _remap_df_columns(eu_df, [
-                "col_symbol", "col_etf_name", "col_price_eur", "col_change",
-                "col_sma50", "col_signal", "col_currency",
-            ])
-
-            col_ef1, col_ef2 = st.columns([3, 1])
-            with col_ef1:
-                search_eu = st.text_input(t("eu_search"), "", key="eu_search")
-            with col_ef2:
-                eu_signal_filter = st.selectbox(
-                    t("fi_signal_filter"),
-                    options=[t("fi_signal_all"), "🟢 OSTA", "🔴 MYY", "🟡 PIDÄ"],
-                    key="eu_signal_filter",
-                )
-
-            eu_sym_col = t("col_symbol")
-            eu_nm_col  = t("col_etf_name")
-            eu_sig_col = t("col_signal")
-            eu_chg_col = t("col_change")
-            if search_eu:
-                mask_eu = (
-                    eu_df[eu_sym_col].str.contains(search_eu.upper(), na=False)
-                    | eu_df[eu_nm_col].str.contains(search_eu, case=False, na=False)
-                )
-                eu_df = eu_df[mask_eu]
-            if eu_signal_filter != t("fi_signal_all") and eu_sig_col in eu_df.columns:
-                eu_df = eu_df[eu_df[eu_sig_col] == eu_signal_filter]
-
-            def color_change_eu(val: object) -> str:
-                """Väritää muutos %-arvo vihreäksi tai punaiseksi."""
-                if isinstance(val, (int, float)):
-                    return "color: green" if val > 0 else ("color: red" if val < 0 else "")
-                return ""
-
-            def color_signal_eu(val: object) -> str:
-                """Väritää signaalin vihreäksi/punaiseksi."""
-                if isinstance(val, str):
-                    if "OSTA" in val:
-                        return "color: green; font-weight: bold"
-                    if "MYY" in val:
-                        return "color: red; font-weight: bold"
-                return ""
-
-            if eu_sig_col in eu_df.columns:
-                styled_eu = eu_df.style.map(color_change_eu, subset=[eu_chg_col]).map(
-                    color_signal_eu, subset=[eu_sig_col]
-                )
-            else:
-                styled_eu = eu_df.style.map(color_change_eu, subset=[eu_chg_col])
-            st.dataframe(styled_eu, width='stretch', hide_index=True)
-
-            # Lisää ETF:iä salkkuun
-            st.markdown("---")
-            col_esel1, col_esel2 = st.columns([2, 1])
-            with col_esel1:
-                selected_eu = st.multiselect(
-                    t("eu_add_multiselect"),
-                    options=list(EU_ETFS.keys()),
-                    format_func=lambda s: f"{s} – {EU_ETFS[s]}",
-                    key="eu_multiselect",
-                )
-            with col_esel2:
-                st.write("")
-                st.write("")
-                if st.button(t("eu_add_btn"), key="eu_add_selected") and selected_eu:
-                    added, skipped, errs = add_stocks_bulk(selected_eu, active_portfolio_id)
-                    st.success(t("fi_added", portfolio=active_portfolio_name, added=added, skipped=skipped))
-                    st.rerun()
-
-            csv_eu = eu_df.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label=t("eu_download"),
-                data=csv_eu,
-                file_name=f"eu_etf_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                mime="text/csv",
-            )
-        else:
-            st.info(t("fi_press_sync"))
-
-        if eu_auto_refresh:
-            time.sleep(eu_refresh_interval)
-            fetch_stock_data.clear()
-            st.session_state["eu_sync_requested"] = True
-            st.rerun()
+    # --- PÖRSSILISTAT (Suomi, USA, EU ja muut SCREENER_MARKETS-merkinnät) ---
+    if active_view in SCREENER_MARKETS:
+        render_screener_view(active_view, active_portfolio_id, active_portfolio_name)
 
     # --- OMAT RAHASTOT -välilehti ---
-    with tab7:
+    if active_view == "funds":
         active_user_id = st.session_state.get("user_id", 1)
         st.header(t("funds_header"))
         st.markdown(t("funds_desc"))
@@ -2955,7 +6079,7 @@ def main():
         st.markdown(t("funds_nav_where_header"))
         st.markdown(t("funds_nav_where_body"))
     # --- BACKTESTING-välilehti ---
-    with tab2:
+    if active_view == "backtest":
         st.header(t("bt_header"))
         st.markdown(t("bt_desc"))
 
@@ -3074,6 +6198,119 @@ def main():
                     with col5:
                         st.metric("Keskim. Sharpe Ratio", f"{avg_sharpe:.2f}")
 
+        # --- SALKKUTASON BACKTEST ---
+        with st.expander(t("pf_header")):
+            st.caption(t("pf_desc"))
+            pf_col1, pf_col2 = st.columns(2)
+            with pf_col1:
+                pf_weighting = st.selectbox(
+                    t("pf_weighting"),
+                    options=PORTFOLIO_WEIGHTINGS,
+                    format_func=lambda w: t(f"pf_weighting_{w}"),
+                    key="pf_weighting",
+                )
+            with pf_col2:
+                pf_rebalance = st.selectbox(
+                    t("pf_rebalance"),
+                    options=list(PORTFOLIO_REBALANCE),
+                    format_func=lambda r: t(f"pf_rebalance_{r}"),
+                    key="pf_rebalance",
+                )
+
+            if st.button(t("pf_run_btn"), key="pf_run"):
+                if not bt_symbols_to_run:
+                    st.warning(t("bt_no_stocks"))
+                else:
+                    with st.spinner(t("pf_spinner")):
+                        ok, pf_result = backtest_portfolio(
+                            bt_symbols_to_run, years, initial_capital, commission, selected_strategy,
+                            weighting=pf_weighting, rebalance=pf_rebalance,
+                        )
+                    if ok:
+                        # Istuntoon vain skalaarit; arvokäyrä jaettuun kehysvarastoon
+                        st.session_state["portfolio_backtest"] = compact_result(pf_result, portfolio_handle(
+                            bt_symbols_to_run, years, initial_capital, commission, selected_strategy,
+                            pf_weighting, pf_rebalance,
+                        ), PORTFOLIO_FRAME_KEYS)
+                    else:
+                        st.error(pf_result)
+
+            pf_res = st.session_state.get("portfolio_backtest")
+            if pf_res:
+                pf_m1, pf_m2, pf_m3, pf_m4 = st.columns(4)
+                with pf_m1:
+                    st.metric(t("pf_strategy"), f"{pf_res['strategy_return']:.1f}%",
+                              delta=f"{pf_res['strategy_return'] - pf_res['buy_hold_return']:.1f}%")
+                with pf_m2:
+                    st.metric("Buy&Hold (1/N)", f"{pf_res['buy_hold_return']:.1f}%")
+                with pf_m3:
+                    st.metric("Max Drawdown", f"{pf_res['max_drawdown']:.1f}%")
+                with pf_m4:
+                    st.metric("Sharpe Ratio", f"{pf_res['sharpe_ratio']:.2f}")
+                st.caption(t("pf_summary", strategy=pf_res["strategy"], n=len(pf_res["symbols"]),
+                             trades=pf_res["trades"]))
+                pf_equity = result_frames(pf_res).get("equity_df")
+                if pf_equity is None:
+                    st.info(t("frames_unavailable"))
+                else:
+                    st.plotly_chart(
+                        cached_figure("equity", "Salkku", pf_equity, plot_equity_curve,
+                                      pf_equity, t("pf_equity_name"), pf_res["initial_capital"],
+                                      variant=pf_res[FRAMES_KEY], **chart_options()),
+                        width='stretch',
+                    )
+
+        # --- PARAMETRIOPTIMOINTI ---
+        with st.expander(t("opt_header")):
+            st.caption(t("opt_desc"))
+            opt_col1, opt_col2 = st.columns(2)
+            with opt_col1:
+                opt_method = st.selectbox(
+                    t("opt_method"),
+                    options=OPTIMIZER_METHODS,
+                    format_func=lambda m: t(f"opt_method_{m}"),
+                    key="opt_method",
+                )
+            with opt_col2:
+                opt_samples = st.number_input(
+                    t("opt_samples"), 5, 500, 50, 5,
+                    disabled=opt_method != "random", key="opt_samples",
+                )
+            st.caption(t("opt_params", grid=OPTIMIZER_PARAM_GRID.get(selected_strategy, {})))
+
+            if st.button(t("opt_run_btn"), key="opt_run"):
+                if not bt_symbols_to_run:
+                    st.warning(t("bt_no_stocks"))
+                else:
+                    with st.spinner(t("opt_spinner")):
+                        ok, opt_result = optimize_strategy(
+                            bt_symbols_to_run, selected_strategy, years, initial_capital, commission,
+                            method=opt_method, n_samples=int(opt_samples),
+                        )
+                    if ok:
+                        st.session_state["optimizer_results"] = (selected_strategy, opt_result)
+                    else:
+                        st.error(opt_result)
+
+            if "optimizer_results" in st.session_state:
+                opt_strategy, opt_df = st.session_state["optimizer_results"]
+                st.subheader(t("opt_best", strategy=opt_strategy))
+                st.dataframe(
+                    opt_df.rename(columns={
+                        "sharpe_ratio": "Sharpe Ratio",
+                        "strategy_return": t("opt_col_return"),
+                        "max_drawdown": t("opt_col_drawdown"),
+                        "trades": t("opt_col_trades"),
+                    }),
+                    width='stretch', hide_index=True,
+                )
+                st.download_button(
+                    label=t("opt_download"),
+                    data=opt_df.to_csv(index=False).encode("utf-8"),
+                    file_name=f"optimointi_{datetime.now().strftime('%Y%m%d')}.csv",
+                    mime="text/csv",
+                )
+
         # --- KAAVIOT ---
         if "backtest_results" in st.session_state and st.session_state["backtest_results"]:
             st.markdown("---")
@@ -3085,249 +6322,66 @@ def main():
             selected_symbol = st.selectbox(t("bt_select_stock"), symbols, key="bt_symbol_select")
             selected_data = next((r for r in bt_res if r["symbol"] == selected_symbol), None)
 
-            if selected_data:
+            # Kehykset haetaan laiskasti vain valitulle osakkeelle
+            selected_frames = result_frames(selected_data) if selected_data else {}
+            if selected_data and not selected_frames:
+                st.info(t("frames_unavailable"))
+            elif selected_data:
+                # Kaaviot välimuistista: avaimena myös backtestin kahva (strategia, pääoma, kulut)
+                chart_opts = dict(chart_options(), variant=selected_data[FRAMES_KEY])
+                bt_df = selected_frames["df"]
                 # Equity Curve
-                fig_equity = plot_equity_curve(
-                    selected_data["equity_df"],
+                fig_equity = cached_figure(
+                    "equity", selected_symbol, selected_frames["equity_df"], plot_equity_curve,
+                    selected_frames["equity_df"],
                     selected_symbol,
-                    selected_data["initial_capital"]
+                    selected_data["initial_capital"],
+                    **chart_opts,
                 )
                 st.plotly_chart(fig_equity, width='stretch')
 
                 # Hintakaavio + indikaattorit + signaalit
-                fig_price = plot_price_chart(
-                    selected_data["df"], 
+                fig_price = cached_figure(
+                    "price", selected_symbol, bt_df, plot_price_chart,
+                    bt_df,
                     selected_symbol,
-                    selected_data["trade_history"]
+                    selected_frames["trade_history"],
+                    **chart_opts,
                 )
                 st.plotly_chart(fig_price, width='stretch')
 
                 # MACD-kaavio
-                if "MACD" in selected_data["df"].columns:
-                    fig_macd = plot_macd_chart(selected_data["df"])
+                if "MACD" in bt_df.columns:
+                    fig_macd = cached_figure("macd", selected_symbol, bt_df, plot_macd_chart, bt_df, **chart_opts)
                     st.plotly_chart(fig_macd, width='stretch')
                 
                 # RSI-kaavio
-                fig_rsi = plot_rsi_chart(selected_data["df"])
+                fig_rsi = cached_figure("rsi", selected_symbol, bt_df, plot_rsi_chart, bt_df, **chart_opts)
                 st.plotly_chart(fig_rsi, width='stretch')
 
                 # Volume-kaavio
-                if "Volume" in selected_data["df"].columns:
-                    fig_vol = plot_volume_chart(selected_data["df"], selected_symbol)
+                if "Volume" in bt_df.columns:
+                    fig_vol = cached_figure("volume", selected_symbol, bt_df, plot_volume_chart,
+                                            bt_df, selected_symbol, **chart_opts)
                     st.plotly_chart(fig_vol, width='stretch')
 
                 # Kauppahistoria
-                if selected_data["trade_history"]:
+                if selected_frames["trade_history"]:
                     with st.expander("📋 Kauppahistoria"):
-                        trade_df = pd.DataFrame(selected_data["trade_history"], columns=["Toiminto", "Päivämäärä", "Hinta"])
+                        trade_df = pd.DataFrame(selected_frames["trade_history"], columns=["Toiminto", "Päivämäärä", "Hinta"])
                         trade_df["Päivämäärä"] = pd.to_datetime(trade_df["Päivämäärä"]).dt.strftime("%Y-%m-%d")
                         trade_df["Hinta"] = trade_df["Hinta"].round(2)
                         st.dataframe(trade_df, width='stretch', hide_index=True)
 
-    # --- SUOMEN PÖRSSI -välilehti ---
-    with tab3:
-        # Lataa tallennettu data DB:stä session_stateen jos sivu on refreshattu
-        if "fi_data" not in st.session_state:
-            cached_data, cached_ts = load_fi_cache()
-            if cached_data:
-                st.session_state["fi_data"] = cached_data
-                st.session_state["fi_last_sync"] = cached_ts
-
-        st.header(t("fi_header"))
-        st.markdown(t("fi_count", n=len(FINNISH_STOCKS)))
-
-        # Auto-refresh asetukset
-        col_r1, col_r2 = st.columns([2, 1])
-        with col_r1:
-            fi_auto_refresh = st.toggle(
-                t("fi_auto_refresh"),
-                value=False,
-                key="fi_auto_refresh",
-                help=t("fi_auto_refresh_help"),
-            )
-        with col_r2:
-            fi_refresh_interval = st.selectbox(
-                t("fi_interval"),
-                options=[60, 120, 300],
-                format_func=lambda x: f"{x//60} min",
-                index=0,
-                disabled=not fi_auto_refresh,
-                key="fi_refresh_interval",
-            )
-
-        col_btn1, col_btn2, col_ts = st.columns([1, 1, 4])
-        with col_btn1:
-            sync_all = st.button(t("fi_sync_all"), key="fi_sync")
-        with col_btn2:
-            clear_cache_btn = st.button(t("fi_clear_cache"), key="fi_clear_cache")
-        with col_ts:
-            ts_placeholder = st.empty()
-            saved_ts = st.session_state.get("fi_last_sync")
-            if saved_ts:
-                ts_placeholder.caption(t("fi_last_synced", ts=saved_ts))
-
-        if clear_cache_btn:
-            fetch_stock_data.clear()
-            st.toast(t("fi_cache_cleared"), icon="🗑️")
-
-        # Hae data — VAIN kun nappia painetaan manuaalisesti tai auto-refresh on päällä
-        if sync_all or fi_auto_refresh:
-            st.session_state["fi_sync_requested"] = True
-
-        if st.session_state.get("fi_sync_requested"):
-            fi_results = []
-            progress_bar = st.progress(0, text=t("fi_fetching_start"))
-            symbols_list = list(FINNISH_STOCKS.keys())
-            total = len(symbols_list)
-
-            for idx, symbol in enumerate(symbols_list):
-                try:
-                    # 6 kuukautta: riittää RSI(14) + SMA50 laskentaan
-                    df_tmp, info_tmp = fetch_stock_data(symbol, period="6mo")
-                    if not df_tmp.empty:
-                        df_tmp = df_tmp.reset_index()
-                        latest_price = round(df_tmp["Close"].iloc[-1], 2)
-                        prev_price = df_tmp["Close"].iloc[-2] if len(df_tmp) > 1 else latest_price
-                        change_pct = round((latest_price - prev_price) / prev_price * 100, 2)
-                        market_cap = info_tmp.get("marketCap", None)
-                        pe = info_tmp.get("trailingPE", None)
-                        currency = info_tmp.get("currency", "EUR")
-
-                        # Laske RSI ja SMA50 signaaleja varten
-                        rsi_val = None
-                        sma50_val = None
-                        signal = "🟡 PIDÄ"
-                        if len(df_tmp) >= 15:
-                            rsi_series = ta.momentum.RSIIndicator(df_tmp["Close"], window=14).rsi()
-                            rsi_val = rsi_series.iloc[-1]
-                            rsi_val = round(rsi_val, 1) if pd.notna(rsi_val) else None
-                        if len(df_tmp) >= 50:
-                            sma50_val = round(df_tmp["Close"].rolling(50).mean().iloc[-1], 2)
-
-                        if rsi_val is not None and sma50_val is not None:
-                            if rsi_val < 30 and latest_price > sma50_val:
-                                signal = "🟢 OSTA"
-                            elif rsi_val > 70:
-                                signal = "🔴 MYY"
-
-                        fi_results.append({
-                            t("col_symbol"): symbol,
-                            t("col_company"): FINNISH_STOCKS[symbol],
-                            t("col_price_eur"): latest_price,
-                            t("col_change"): change_pct,
-                            "RSI": rsi_val,
-                            t("col_sma50"): sma50_val,
-                            t("col_signal"): signal,
-                            t("col_currency"): currency,
-                            t("col_pe"): round(pe, 2) if pe else None,
-                            t("col_market_cap"): f"{market_cap/1e9:.1f} Mrd" if market_cap else None,
-                        })
-                except Exception as e:  # noqa: BLE001
-                    pass  # virheelliset ohitetaan hiljaisesti
-                progress_bar.progress((idx + 1) / total, text=t("fi_fetching", symbol=symbol, idx=idx+1, total=total))
-
-            progress_bar.empty()
-            st.session_state["fi_data"] = fi_results
-            st.session_state["fi_last_sync"] = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-            save_fi_cache(fi_results, st.session_state["fi_last_sync"])
-            st.session_state["fi_sync_requested"] = False
-            st.session_state.pop("fi_signal_filter", None)
-            st.session_state.pop("fi_search", None)
-            st.rerun()
-
-        if "fi_data" in st.session_state and st.session_state["fi_data"]:
-            fi_df = pd.DataFrame(st.session_state["fi_data"])
-            fi_df = _remap_df_columns(fi_df, [
-                "col_symbol", "col_company", "col_price_eur", "col_change",
-                "col_sma50", "col_signal", "col_currency", "col_pe", "col_market_cap",
-            ])
-
-            # Suodatin — lisätty signaali-suodatin
-            col_f1, col_f2 = st.columns([3, 1])
-            with col_f1:
-                search_fi = st.text_input(t("fi_search"), "", key="fi_search")
-            with col_f2:
-                signal_filter = st.selectbox(
-                    t("fi_signal_filter"),
-                    options=[t("fi_signal_all"), "🟢 OSTA", "🔴 MYY", "🟡 PIDÄ"],
-                    key="fi_signal_filter",
-                )
-
-            sym_col = t("col_symbol")
-            co_col  = t("col_company")
-            sig_col = t("col_signal")
-            chg_col = t("col_change")
-            if search_fi:
-                mask = (
-                    fi_df[sym_col].str.contains(search_fi.upper(), na=False)
-                    | fi_df[co_col].str.contains(search_fi, case=False, na=False)
-                )
-                fi_df = fi_df[mask]
-            if signal_filter != t("fi_signal_all") and sig_col in fi_df.columns:
-                fi_df = fi_df[fi_df[sig_col] == signal_filter]
-
-            # Väritä muutos % ja signaali
-            def color_change(val):
-                if isinstance(val, (int, float)):
-                    return "color: green" if val > 0 else ("color: red" if val < 0 else "")
-                return ""
-
-            def color_signal(val):
-                if isinstance(val, str):
-                    if "OSTA" in val:
-                        return "color: green; font-weight: bold"
-                    if "MYY" in val:
-                        return "color: red; font-weight: bold"
-                return ""
-
-            if sig_col in fi_df.columns:
-                styled = fi_df.style.map(color_change, subset=[chg_col]).map(
-                    color_signal, subset=[sig_col]
-                )
-            else:
-                styled = fi_df.style.map(color_change, subset=[chg_col])
-            st.dataframe(styled, width='stretch', hide_index=True)
-
-            # Lisää yksittäisiä osakkeita salkkuun taulukosta
-            st.markdown("---")
-            col_sel1, col_sel2 = st.columns([2, 1])
-            with col_sel1:
-                selected_fi = st.multiselect(
-                    t("fi_add_multiselect"),
-                    options=list(FINNISH_STOCKS.keys()),
-                    format_func=lambda s: f"{s} – {FINNISH_STOCKS[s]}",
-                    key="fi_multiselect",
-                )
-            with col_sel2:
-                st.write("")
-                st.write("")
-                if st.button(t("fi_add_btn"), key="fi_add_selected") and selected_fi:
-                    added, skipped, errs = add_stocks_bulk(selected_fi, active_portfolio_id)
-                    st.success(t("fi_added", portfolio=active_portfolio_name, added=added, skipped=skipped))
-                    st.rerun()
-
-            # CSV-lataus
-            csv_fi = fi_df.to_csv(index=False).encode("utf-8")
-            st.download_button(
-                label=t("fi_download"),
-                data=csv_fi,
-                file_name=f"suomen_porssi_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                mime="text/csv",
-            )
-        else:
-            st.info(t("fi_press_sync"))
-
-        # Auto-refresh loppusilmukka
-        if fi_auto_refresh:
-            time.sleep(fi_refresh_interval)
-            fetch_stock_data.clear()
-            st.session_state["fi_sync_requested"] = True
-            st.rerun()
-
     # --- TIETOA-välilehti ---
-    with tab4:
+    if active_view == "info":
         st.header(t("info_header"))
         st.caption(f"{t('info_version')} {VERSION} | {t('info_updated')} {datetime.now().strftime('%d.%m.%Y')}")
+        frame_store = _get_frame_store()
+        st.caption(t("info_session_memory",
+                     used=_format_bytes(sum(session_memory_usage().values())),
+                     budget=_format_bytes(SESSION_MEMORY_BUDGET),
+                     store=_format_bytes(frame_store.bytes), frames=len(frame_store)))
 
         if st.session_state.get("lang", "fi") == "en":
             st.markdown("""
@@ -3407,7 +6461,7 @@ def main():
         - **Streamlit**: Web interface
         - **yfinance**: Stock price data (Yahoo Finance)
         - **pandas**: Data processing
-        - **ta**: Technical indicators
+        - **numpy**: Technical indicators (vectorized)
         - **plotly**: Interactive charts
         - **SQLite**: Data storage
 
@@ -3506,7 +6560,7 @@ def main():
         - **Streamlit**: Web-käyttöliittymä
         - **yfinance**: Osakekurssien haku (Yahoo Finance)
         - **pandas**: Datan käsittely
-        - **ta**: Tekniset indikaattorit
+        - **numpy**: Tekniset indikaattorit (vektoroitu laskenta)
         - **plotly**: Interaktiiviset kaaviot
         - **SQLite**: Osakkeiden tallennus
 
@@ -0,0 +1,243 @@
+"""
+Komentorivikäyttöliittymä – Osakeanalyysi-työkalu
+=================================================
+Ajaa salkun analyysin, pörssilistan synkronoinnin ja backtestit ilman
+Streamlit-käyttöliittymää, esim. ajastettuna yöajona (cron). Käyttää samoja
+funktioita kuin app.py (get_stock_analysis, sync_screener_market,
+backtest_strategy, backtest_portfolio) ja samaa tietokantaa.
+
+app.py sisältää myös näkymät, joten import lataa Streamlitin ja määrittelee
+näkymäfunktiot; käyttöliittymää (main) ei kuitenkaan ajeta.
+
+Esimerkkejä:
+    python cli.py analyze --user admin -o analyysi.csv
+    python cli.py analyze NOKIA.HE AAPL --format json
+    python cli.py screen --market fi -o fi.parquet
+    python cli.py backtest NOKIA.HE NESTE.HE --years 5 -o backtest.json
+    python cli.py backtest --user admin --portfolio-mode --rebalance monthly
+
+Tulos kirjoitetaan tiedostoon (-o) tai stdoutiin; muoto päätellään
+tiedostopäätteestä (.csv, .parquet, .json) tai annetaan --format-valitsimella.
+Paluuarvo: 0 = onnistui, 1 = osa tunnuksista epäonnistui tai ei tuloksia,
+2 = virheellinen syöte.
+"""
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+from streamlit import logger as _st_logger
+
+# Komentorivillä ei ole Streamlit-ajoympäristöä: vaimennetaan "bare mode" -varoitukset
+# ennen app-moduulin importia (välimuistidekoraattorit varoittavat jo määrittelyssä)
+_st_logger.set_log_level("error")
+
+import app  # noqa: E402
+
+OUTPUT_FORMATS = ["csv", "parquet", "json"]
+
+# get_stock_analysis- ja backtest-tulosten kentät, jotka eivät ole taulukkomuotoisia
+# (kehysvarastoon siirretyt kentät ja niiden kahva)
+_NON_TABULAR_KEYS = {"df", "info", "summary", "trade_history", "equity_df", "final_weights", app.FRAMES_KEY}
+
+
+def _tabular(result: dict) -> dict:
+    """Poistaa tuloksesta DataFrame- ja listakentät, jolloin rivin voi kirjoittaa tiedostoon."""
+    return {k: v for k, v in result.items() if k not in _NON_TABULAR_KEYS}
+
+
+def resolve_symbols(symbols: list[str], user: str | None = None,
+                    portfolio: str | None = None) -> tuple[bool, list[str] | str]:
+    """Palauttaa käsiteltävät tunnukset: annetut tai käyttäjän salkusta.
+
+    Args:
+        symbols: Komentoriviltä annetut tunnukset (ohittavat käyttäjän salkun).
+        user: Käyttäjätunnus, jonka salkusta tunnukset luetaan.
+        portfolio: Salkun nimi tai id (oletus: käyttäjän ensimmäinen salkku).
+    Returns:
+        (True, tunnukset) tai (False, virheviesti).
+    """
+    if symbols:
+        return True, [s.strip().upper() for s in symbols]
+    if not user:
+        return False, "Anna tunnukset tai --user"
+    row = app.get_user_by_username(user)
+    if not row:
+        return False, f"Käyttäjää '{user}' ei löydy"
+    portfolios = app.get_portfolios(row[0])
+    if portfolio is not None:
+        portfolios = [p for p in portfolios if portfolio in (str(p[0]), p[1])]
+    if not portfolios:
+        return False, f"Salkkua ei löydy käyttäjältä '{user}'"
+    found = list(app.get_stocks(portfolios[0][0])["symbol"])
+    if not found:
+        return False, f"Salkku '{portfolios[0][1]}' on tyhjä"
+    return True, found
+
+
+def analyze_symbols(symbols: list[str], period: str = "6mo") -> tuple[pd.DataFrame, dict]:
+    """Analysoi tunnukset get_stock_analysis-funktiolla (haut rinnakkain, app.analyze_many).
+
+    Returns:
+        (tulostaulukko, {tunnus: virheviesti}).
+    """
+    rows, errors = [], {}
+    for symbol, (success, data) in zip(symbols, app.analyze_many(symbols, period)):
+        if success:
+            rows.append(_tabular(data))
+        else:
+            errors[symbol] = data
+    return pd.DataFrame(rows), errors
+
+
+def screen_market(market: str, save: bool = True) -> tuple[pd.DataFrame, dict]:
+    """Seuloo pörssilistan; save=True tallentaa tulokset kuten käyttöliittymän synkronointi.
+
+    Returns:
+        (tulostaulukko, {markkina tai tunnus: virheviesti}). Tunnukset, joiden
+        rivi on vanhentunut tai puuttuu, raportoidaan virheinä.
+    """
+    if not save:
+        df = app.run_screener(market)
+        stale, missing = df.attrs.get("stale", []), df.attrs.get("skipped", [])
+    else:
+        ok, _ = app.sync_screener_market(market)
+        if not ok:
+            return pd.DataFrame(columns=app.SCREENER_FIELDS), {market: "Synkronointi epäonnistui"}
+        df = app.query_screener(market)
+        stale, missing = app.screener_coverage(market)
+    errors = {s: "vanhentunut data (haku epäonnistui)" for s in stale}
+    errors.update({s: "ei dataa" for s in missing})
+    return df, errors
+
+
+def backtest_symbols(symbols: list[str], years: int = 5, initial_capital: float = 10000,
+                     commission: float = 0.001, strategy: str = app.STRATEGIES[0],
+                     portfolio_mode: bool = False, weighting: str = "equal",
+                     rebalance: str = "none") -> tuple[pd.DataFrame, dict]:
+    """Ajaa backtestin tunnuksittain tai salkkutasolla (portfolio_mode).
+
+    Returns:
+        (tulostaulukko, {tunnus: virheviesti}).
+    """
+    if portfolio_mode:
+        ok, result = app.backtest_portfolio(symbols, years, initial_capital, commission,
+                                            strategy, weighting, rebalance)
+        if not ok:
+            return pd.DataFrame(), {"portfolio": result}
+        row = _tabular(result)
+        row["symbols"] = " ".join(row["symbols"])
+        return pd.DataFrame([row]), {}
+
+    rows, errors = [], {}
+    for symbol in symbols:
+        ok, result = app.backtest_strategy(symbol, years, initial_capital, commission, strategy)
+        if ok:
+            rows.append(_tabular(result))
+        else:
+            errors[symbol] = result
+    return pd.DataFrame(rows), errors
+
+
+def write_output(df: pd.DataFrame, path: str | None = None, fmt: str | None = None) -> str:
+    """Kirjoittaa tuloksen tiedostoon tai stdoutiin. Palauttaa käytetyn muodon.
+
+    Raises:
+        ValueError: tuntematon muoto tai Parquet ilman tiedostopolkua.
+    """
+    if fmt is None:
+        ext = os.path.splitext(path or "")[1].lstrip(".").lower()
+        fmt = ext if ext in OUTPUT_FORMATS else "csv"
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Tuntematon tulostusmuoto: {fmt}")
+    to_stdout = path in (None, "-")
+
+    if fmt == "parquet":
+        if to_stdout:
+            raise ValueError("Parquet vaatii tiedostopolun (-o)")
+        df.to_parquet(path, index=False)  # vaatii pyarrow- tai fastparquet-paketin
+    elif fmt == "json":
+        text = df.to_json(orient="records", force_ascii=False, indent=2, date_format="iso")
+        if to_stdout:
+            sys.stdout.write(text + "\n")
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+    else:
+        df.to_csv(sys.stdout if to_stdout else path, index=False)
+    return fmt
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Muodostaa argparse-jäsentimen alikomentoineen."""
+    parser = argparse.ArgumentParser(
+        prog="cli.py", description="Osakeanalyysi-työkalu komentoriviltä (ilman Streamlitiä).",
+    )
+    parser.add_argument("--db", help="SQLite-tietokanta (oletus: app.DB_NAME)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(p: argparse.ArgumentParser, symbols: bool = True) -> None:
+        if symbols:
+            p.add_argument("symbols", nargs="*", help="Osaketunnukset (esim. NOKIA.HE AAPL)")
+            p.add_argument("--user", help="Lue tunnukset tämän käyttäjän salkusta")
+            p.add_argument("--portfolio", help="Salkun nimi tai id (oletus: ensimmäinen)")
+        p.add_argument("-o", "--output", help="Tulostiedosto (oletus: stdout)")
+        p.add_argument("--format", choices=OUTPUT_FORMATS, help="Tulostusmuoto (oletus: päätteestä)")
+
+    p_an = sub.add_parser("analyze", help="Salkun tai tunnusten tekninen analyysi")
+    add_common(p_an)
+    p_an.add_argument("--period", default="6mo", help="Historiajakso (oletus: 6mo)")
+
+    p_sc = sub.add_parser("screen", help="Pörssilistan synkronointi (SCREENER_MARKETS)")
+    add_common(p_sc, symbols=False)
+    p_sc.add_argument("--market", choices=list(app.SCREENER_MARKETS), default="fi")
+    p_sc.add_argument("--no-save", action="store_true", help="Älä tallenna tuloksia tietokantaan")
+
+    p_bt = sub.add_parser("backtest", help="Strategian backtest tunnuksittain tai salkkuna")
+    add_common(p_bt)
+    p_bt.add_argument("--years", type=int, default=5)
+    p_bt.add_argument("--capital", type=float, default=10000)
+    p_bt.add_argument("--commission", type=float, default=0.001)
+    p_bt.add_argument("--strategy", choices=app.STRATEGIES, default=app.STRATEGIES[0])
+    p_bt.add_argument("--portfolio-mode", action="store_true",
+                      help="Salkkutason backtest yhteisellä pääomalla")
+    p_bt.add_argument("--weighting", choices=app.PORTFOLIO_WEIGHTINGS, default="equal")
+    p_bt.add_argument("--rebalance", choices=list(app.PORTFOLIO_REBALANCE), default="none")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Komentorivin sisäänkäynti. Palauttaa prosessin paluuarvon."""
+    args = build_parser().parse_args(argv)
+    if args.db:
+        app.DB_NAME = args.db
+    app.init_db()
+
+    if args.command == "screen":
+        df, errors = screen_market(args.market, save=not args.no_save)
+    else:
+        ok, symbols = resolve_symbols(args.symbols, args.user, args.portfolio)
+        if not ok:
+            print(symbols, file=sys.stderr)
+            return 2
+        if args.command == "analyze":
+            df, errors = analyze_symbols(symbols, args.period)
+        else:
+            df, errors = backtest_symbols(
+                symbols, args.years, args.capital, args.commission, args.strategy,
+                args.portfolio_mode, args.weighting, args.rebalance,
+            )
+
+    for key, message in errors.items():
+        print(f"{key}: {message}", file=sys.stderr)
+    try:
+        write_output(df, args.output, args.format)
+    except (ValueError, ImportError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    return 1 if errors or df.empty else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Taustapäivittäjä – Osakeanalyysi-työkalu
+========================================
+Erillinen prosessi, joka pitää jaetun pysyvän välimuistin (price_bars,
+fundamentals, screener_rows ja historia) lämpimänä kaikille käyttäjille:
+
+  - synkronoi jokaisen SCREENER_MARKETS-listan (Suomi, USA, EU)
+  - päivittää kaikkien salkkujen (stocks-taulu) kurssit ja perustiedot
+
+Ajastus kysyy kaupankäyntikalenterilta (app.is_market_open,
+app.market_refresh_due): auki olevan pörssin lista päivitetään OPEN_INTERVAL
+välein, suljetun vain kerran sulkeutumisen jälkeen – yö- ja viikonloppuajoja
+ei tehdä. Salkkujen kurssit päivitetään OPEN_INTERVAL välein, kun jokin
+pörssi on auki, muuten CLOSED_INTERVAL välein (jo lopulliset kurssit ohitetaan
+varaston TTL:n perusteella). Jokaisen kierroksen jälkeen kirjataan sykäys
+worker_status-tauluun, jolloin käyttöliittymä lukee vain valmiit tulokset.
+Kun Yahoo-katkaisin on auki (app.yahoo_available), jäljellä olevat työt
+siirretään seuraavalle kierrokselle eikä niitä kirjata ajetuiksi.
+
+Käyttö:
+    python sync_worker.py            # jatkuva ajo
+    python sync_worker.py --once     # yksi kierros (esim. cronista)
+"""
+
+import argparse
+import sys
+import time
+
+from streamlit import logger as _st_logger
+
+# Ajetaan ilman Streamlit-ajoympäristöä: vaimennetaan "bare mode" -varoitukset
+_st_logger.set_log_level("error")
+
+import app  # noqa: E402
+
+# Aukiolevan pörssin päivitysväli: alle PRICE_STORE_TTL:n, jotta käyttöliittymä
+# löytää varastosta aina tuoreet kurssit eikä hae niitä itse
+OPEN_INTERVAL = 240
+CLOSED_INTERVAL = 6 * 3600
+PORTFOLIO_KEY = "portfolio"
+
+
+def _synced_epoch(market: str) -> float:
+    """Markkinan viimeisin tallennettu synkronointi Unix-aikana (0, jos ei koskaan)."""
+    ts = app.get_screener_synced_at(market)
+    return app._to_epoch(ts) if ts else 0.0
+
+
+def due_jobs(last_run: dict[str, float], now: float | None = None,
+             open_interval: float = OPEN_INTERVAL,
+             closed_interval: float = CLOSED_INTERVAL) -> list[str]:
+    """Palauttaa erääntyneet työt: markkina-avaimet ja tarvittaessa PORTFOLIO_KEY.
+
+    Args:
+        last_run: {työ: edellisen ajon Unix-aika}; puuttuva = ei ajettu.
+        now: Nykyhetki Unix-aikana (oletus: nyt).
+    """
+    now = time.time() if now is None else now
+    moment = app.datetime.fromtimestamp(now).astimezone()
+    open_markets = {m for m in app.SCREENER_MARKETS if app.is_market_open(m, moment)}
+
+    jobs = []
+    for market in app.SCREENER_MARKETS:
+        last = last_run.get(market, 0.0)
+        if market in open_markets:
+            if now - last >= open_interval:
+                jobs.append(market)
+        elif app.market_refresh_due(market, last, now):
+            # Suljettu pörssi: yksi päivitys sulkeutumisen jälkeen, sitten tauko avautumiseen asti
+            jobs.append(market)
+    interval = open_interval if open_markets else closed_interval
+    if now - last_run.get(PORTFOLIO_KEY, 0.0) >= interval:
+        jobs.append(PORTFOLIO_KEY)
+    return jobs
+
+
+def warm_portfolio_symbols(period: str = app.SCREENER_PERIOD) -> tuple[int, dict[str, str]]:
+    """Päivittää kaikkien salkkujen kurssit ja perustiedot varastoon.
+
+    Returns:
+        (päivitettyjen tunnusten määrä, {tunnus: virheviesti}).
+    """
+    symbols = app.get_portfolio_symbols()
+    if not symbols:
+        return 0, {}
+    errors = {s: str(e) for s, e in app.refresh_price_bars(symbols, app.period_start(period)).items()}
+    for symbol, info in zip(symbols, app.prefetch_stock_info(symbols)):
+        if isinstance(info, Exception):
+            errors.setdefault(symbol, str(info))
+        elif app.is_stale(info):
+            errors.setdefault(symbol, "perustiedot vanhentuneet")
+    return len(symbols) - len(errors), errors
+
+
+def run_once(last_run: dict[str, float] | None = None, now: float | None = None,
+             force: bool = False) -> dict:
+    """Ajaa yhden päivityskierroksen ja kirjaa sykäyksen.
+
+    Args:
+        last_run: Edellisten ajojen ajat; päivitetään paikan päällä. None = luetaan kannasta.
+        force: Aja kaikki työt aukioloajoista riippumatta.
+    Returns:
+        Yhteenveto {työ: tallennettujen rivien/tunnusten määrä tai virheteksti};
+        katkon vuoksi siirretyt työt avaimella "deferred".
+    """
+    now = time.time() if now is None else now
+    if last_run is None:
+        last_run = {m: _synced_epoch(m) for m in app.SCREENER_MARKETS}
+    jobs = list(app.SCREENER_MARKETS) + [PORTFOLIO_KEY] if force else due_jobs(last_run, now)
+
+    summary: dict = {}
+    for i, job in enumerate(jobs):
+        if not app.yahoo_available():
+            # Katkaisin auki: työt jäävät erääntyneiksi ja ajetaan, kun Yahoo vastaa taas
+            summary["deferred"] = jobs[i:]
+            break
+        if job == PORTFOLIO_KEY:
+            warmed, errors = warm_portfolio_symbols()
+            summary[job] = warmed
+            if errors:
+                summary[f"{job}_errors"] = len(errors)
+        else:
+            ok, saved = app.sync_screener_market(job)
+            summary[job] = saved if ok else "virhe"
+        if app.yahoo_available():
+            last_run[job] = now
+    app.record_worker_heartbeat(summary, now=now)
+    return summary
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Taustapäivittäjän sisäänkäynti."""
+    parser = argparse.ArgumentParser(prog="sync_worker.py", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", help="SQLite-tietokanta (oletus: app.DB_NAME)")
+    parser.add_argument("--once", action="store_true", help="Aja yksi kierros ja lopeta")
+    parser.add_argument("--force", action="store_true", help="Aja kaikki työt aukioloajoista riippumatta")
+    parser.add_argument("--poll", type=float, default=60, help="Erääntymisen tarkistusväli sekunteina")
+    args = parser.parse_args(argv)
+    if args.db:
+        app.DB_NAME = args.db
+    app.init_db()
+
+    last_run: dict[str, float] | None = None
+    while True:
+        if last_run is None:
+            last_run = {m: _synced_epoch(m) for m in app.SCREENER_MARKETS}
+        summary = run_once(last_run, force=args.force)
+        if summary:
+            print(f"{app.datetime.now():%Y-%m-%d %H:%M:%S} {summary}", flush=True)
+        if args.once:
+            return 0
+        args.force = False
+        time.sleep(args.poll)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 """
 Pytest-konfiguraatio: mockaa streamlit ennen app-moduulin importia.
 """
+import functools
 import sys
 from unittest.mock import MagicMock
 
@@ -14,9 +15,16 @@ def _cache_data_passthrough(*args, **kwargs):
     # Käytetty argumenteilla: @st.cache_data(ttl=300)
     return lambda f: f
 
+def _cache_resource_passthrough(func):
+    """@st.cache_resource: jaettu resurssi luodaan kerran per argumenttiyhdistelmä."""
+    cached = functools.cache(func)
+    cached.clear = cached.cache_clear
+    return cached
+
 _st = MagicMock()
 _st.session_state = {"lang": "fi"}
 _st.cache_data = _cache_data_passthrough
 _st.cache_data.clear = MagicMock()
+_st.cache_resource = _cache_resource_passthrough
 
 sys.modules.setdefault("streamlit", _st)
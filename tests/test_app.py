@@ -4,7 +4,6 @@ Yksikkötestit – Osakeanalyysi-työkalu
 Kattaa:
   - _hash_pw               : salasanahashaus
   - t()                    : käännösfunktio
-  - _remap_df_columns      : sarakkeiden uudelleennimeäminen
   - parse_symbols_from_text: osaketunnusten parsinta
   - create_user            : käyttäjän luonti
   - verify_password        : kirjautumistarkistus
@@ -17,6 +16,28 @@ Kattaa:
   - get_fund_nav_history   : NAV-historian haku
   - _generate_signals      : teknisten signaalien generointi
   - _simulate_trades       : kaupankäynnin simulointi
+  - fetch_prices_bulk      : ryhmitetty kurssihaku ja pilkkominen
+  - TokenBucket            : jaettu Yahoo-rajoitin ja rinnakkaishaku
+  - refresh_price_bars     : paikallinen kurssivarasto ja delta-päivitys
+  - fetch_stock_info       : fundamenttitietojen pysyvä välimuisti
+  - compute_indicators     : vektoroitu indikaattorimoottori (vs. ta-kirjasto)
+  - optimize_strategy      : strategian parametrioptimointi prosessipoolissa
+  - backtest_portfolio     : salkkutason backtest yhteisellä pääomalla
+  - _refresh_due           : pörssilistojen auto-refresh-ajastus
+  - get_connection         : prosessinlaajuinen yhteyspooli (WAL, vain luku)
+  - init_db                : versioidut skeemamigraatiot
+  - save_screener_rows     : pörssilistojen tyypitetyt rivit ja SQL-suodatus
+  - get_screener_as_of     : synkronointiarkisto, harvennus ja aikamatkakyselyt
+  - run_screener           : yhteinen seulontamoottori ja markkina-asetukset
+  - is_market_open         : pörssien aukioloajat ja taustapäivittäjän sykäys
+  - exchange_holidays      : kaupankäyntikalenteri, seuraava avautuminen ja TTL
+  - SingleFlight           : samanaikaisten identtisten hakujen yhdistäminen
+  - CircuitBreaker         : Yahoo-katkaisin ja vanhentuneen datan palvelu taustapäivityksellä
+  - IndicatorState         : inkrementaalinen indikaattoritila ja sen tallennus
+  - IndicatorCache         : analyysin, backtestin ja signaalien jaettu indikaattorivälimuisti
+  - FrameStore             : tulosten kehysvarasto, laiska haku ja istunnon muistibudjetti
+  - downsample_indices     : kaavioiden LTTB- ja min/max-harvennus
+  - FigureCache            : kaavioiden WebGL-tila ja rakennettujen kaavioiden välimuisti
 """
 
 import os
@@ -24,6 +45,9 @@ import sys
 import tempfile
 import hashlib
 import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
 
 import pandas as pd
 import numpy as np
@@ -54,6 +78,40 @@ def tmp_db(tmp_path, monkeypatch):
     return db_file
 
 
+class _InlineExecutor:
+    """Ajaa taustatehtävät heti kutsujan säikeessä (deterministiset testit)."""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted += 1
+        fn(*args, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def yahoo_breaker(monkeypatch):
+    """Jokainen testi alkaa suljetulla katkaisimella ja täydellä rajoittimella;
+    taustapäivitykset ajetaan heti."""
+    limiter = app.TokenBucket(rate=1000.0, capacity=1000)
+    breaker = app.CircuitBreaker(app.BREAKER_FAILURE_THRESHOLD, app.BREAKER_COOLDOWN,
+                                 app.BREAKER_COOLDOWN_MAX)
+    revalidator = app.BackgroundRevalidator(executor=_InlineExecutor(),
+                                            retry_after=breaker.retry_after, sleep=lambda s: None)
+    monkeypatch.setattr(app, "_get_yahoo_limiter", lambda: limiter)
+    monkeypatch.setattr(app, "_get_yahoo_breaker", lambda: breaker)
+    monkeypatch.setattr(app, "_get_revalidator", lambda: revalidator)
+    return breaker
+
+
+@pytest.fixture(autouse=True)
+def frame_store(monkeypatch):
+    """Jokainen testi saa oman tyhjän kehysvaraston."""
+    store = app.FrameStore()
+    monkeypatch.setattr(app, "_get_frame_store", lambda: store)
+    return store
+
+
 @pytest.fixture()
 def fi_lang(monkeypatch):
     """Asettaa kielen suomeksi session_stateen."""
@@ -142,6 +200,34 @@ class TestTranslation:
         else:
             pytest.skip("fi_fetching-avain ei sisällä {symbol}-muuttujaa")
 
+    @pytest.mark.parametrize("lang", ["fi", "en"])
+    def test_every_view_has_label(self, lang):
+        for view in app.views():
+            assert f"tab_{view}" in app.TRANSLATIONS[lang]
+
+    @pytest.mark.parametrize("prefix", ["opt_", "pf_"])
+    def test_backtest_expander_keys_in_both_languages(self, prefix):
+        fi_keys = {k for k in app.TRANSLATIONS["fi"] if k.startswith(prefix)}
+        en_keys = {k for k in app.TRANSLATIONS["en"] if k.startswith(prefix)}
+        assert fi_keys and fi_keys == en_keys
+
+    def test_every_optimizer_method_has_label(self):
+        for method in app.OPTIMIZER_METHODS:
+            assert f"opt_method_{method}" in app.TRANSLATIONS["en"]
+
+    def test_every_portfolio_option_has_label(self):
+        for weighting in app.PORTFOLIO_WEIGHTINGS:
+            assert f"pf_weighting_{weighting}" in app.TRANSLATIONS["en"]
+        for rebalance in app.PORTFOLIO_REBALANCE:
+            assert f"pf_rebalance_{rebalance}" in app.TRANSLATIONS["en"]
+
+    def test_registered_market_gets_a_view(self, monkeypatch):
+        monkeypatch.setattr(app, "SCREENER_MARKETS", dict(app.SCREENER_MARKETS))
+        app.register_screener_market("nordic", {"VOLV-B.ST": "Volvo"}, label="Pohjoismaat")
+        assert "nordic" in app.views() and app.views()[-3:] == ["funds", "backtest", "info"]
+        assert app.view_label("nordic") == "Pohjoismaat"
+        assert app.view_label("fi") == app.t("tab_fi")
+
     def test_fi_col_symbol(self, fi_lang):
         result = app.t("col_symbol")
         assert isinstance(result, str)
@@ -153,41 +239,7 @@ class TestTranslation:
 
 
 # ===========================================================================
-# 3. _remap_df_columns
-# ===========================================================================
-
-class TestRemapDfColumns:
-    def test_no_rename_needed(self, fi_lang):
-        col_name = app.t("col_symbol")
-        df = pd.DataFrame({col_name: ["NOKIA.HE"]})
-        result = app._remap_df_columns(df, ["col_symbol"])
-        assert col_name in result.columns
-
-    def test_renames_foreign_language_column(self, monkeypatch):
-        """Sarake tallennettu englanniksi, näytetään suomeksi."""
-        monkeypatch.setitem(st.session_state, "lang", "fi")
-        fi_name = app.t("col_symbol")
-        monkeypatch.setitem(st.session_state, "lang", "en")
-        en_name = app.t("col_symbol")
-        monkeypatch.setitem(st.session_state, "lang", "fi")
-
-        if fi_name == en_name:
-            pytest.skip("Sarakkeen nimi sama molemmilla kielillä")
-
-        # DataFrame-sarakkeessa englanninkielinen nimi
-        df = pd.DataFrame({en_name: ["NOKIA.HE"]})
-        result = app._remap_df_columns(df, ["col_symbol"])
-        assert fi_name in result.columns
-        assert en_name not in result.columns
-
-    def test_returns_original_if_nothing_to_remap(self, fi_lang):
-        df = pd.DataFrame({"Tuntematon": [1, 2, 3]})
-        result = app._remap_df_columns(df, ["col_symbol"])
-        assert "Tuntematon" in result.columns
-
-
-# ===========================================================================
-# 4. parse_symbols_from_text
+# 3. parse_symbols_from_text
 # ===========================================================================
 
 class TestParseSymbolsFromText:
@@ -223,7 +275,7 @@ class TestParseSymbolsFromText:
 
 
 # ===========================================================================
-# 5. Käyttäjähallinta: create_user / verify_password / change_password
+# 4. Käyttäjähallinta: create_user / verify_password / change_password
 # ===========================================================================
 
 class TestUserManagement:
@@ -283,7 +335,7 @@ class TestUserManagement:
 
 
 # ===========================================================================
-# 6. Salkku ja osakkeet
+# 5. Salkku ja osakkeet
 # ===========================================================================
 
 class TestStockPortfolio:
@@ -335,7 +387,7 @@ class TestStockPortfolio:
 
 
 # ===========================================================================
-# 7. Rahastot (Funds & NAV)
+# 6. Rahastot (Funds & NAV)
 # ===========================================================================
 
 class TestFunds:
@@ -414,7 +466,7 @@ class TestFunds:
 
 
 # ===========================================================================
-# 8. _generate_signals – tekniset signaalit
+# 7. _generate_signals – tekniset signaalit
 # ===========================================================================
 
 def _make_price_df(n: int = 300, seed: int = 42) -> pd.DataFrame:
@@ -481,7 +533,7 @@ class TestGenerateSignals:
 
 
 # ===========================================================================
-# 9. _simulate_trades – kaupankäyntimoottori
+# 8. _simulate_trades – kaupankäyntimoottori
 # ===========================================================================
 
 def _make_signal_df(buy_idx: int, sell_idx: int, n: int = 100) -> pd.DataFrame:
@@ -545,3 +597,1869 @@ class TestSimulateTrades:
         df = _make_signal_df(10, 60)
         result = app._simulate_trades(df, 10_000, 0.001)
         assert isinstance(result["strategy_return"], float)
+
+    @staticmethod
+    def _reference_simulation(df, initial_capital, commission):
+        """Alkuperäinen rivikohtainen simulointi vertailua varten."""
+        capital, shares, in_position = initial_capital, 0.0, False
+        trades = winning = 0
+        buy_price = 0.0
+        history, values = [], []
+        for i in range(len(df)):
+            price = df.loc[i, "Close"]
+            sig = df.loc[i, "Signal"]
+            if sig == "BUY" and not in_position:
+                shares = (capital - capital * commission) / price
+                capital, in_position, buy_price = 0.0, True, price
+                trades += 1
+                history.append(("BUY", df.loc[i, "Date"], price))
+            elif sig == "SELL" and in_position:
+                gross = shares * price
+                capital = gross - gross * commission
+                winning += price > buy_price
+                shares, in_position = 0.0, False
+                history.append(("SELL", df.loc[i, "Date"], price))
+            values.append(capital + shares * price)
+        if in_position:
+            gross = shares * df.iloc[-1]["Close"]
+            final = gross - gross * commission
+        else:
+            final = capital
+        return final, trades, winning, history, values
+
+    @pytest.mark.parametrize("seed", [0, 1, 2])
+    def test_matches_row_by_row_reference(self, seed):
+        rng = np.random.default_rng(seed)
+        df = _make_price_df(n=500, seed=seed)
+        df["Signal"] = rng.choice(["BUY", "SELL", "HOLD"], size=len(df), p=[0.05, 0.05, 0.9])
+        result = app._simulate_trades(df, 10_000, 0.001)
+        final, trades, winning, history, values = self._reference_simulation(df, 10_000, 0.001)
+        assert result["strategy_final"] == round(final, 2)
+        assert result["trades"] == trades
+        assert result["win_rate"] == round(winning / trades * 100 if trades else 0.0, 1)
+        assert result["trade_history"] == history
+        np.testing.assert_array_equal(result["equity_df"]["Value"].to_numpy(), np.array(values))
+
+
+# ===========================================================================
+# 9. fetch_prices_bulk – ryhmitetty kurssihaku
+# ===========================================================================
+
+def _make_bulk_raw(symbols: list[str], n: int = 5) -> pd.DataFrame:
+    """Synteettinen yf.download(group_by="ticker") -tulos MultiIndex-sarakkeilla."""
+    dates = pd.date_range("2024-01-01", periods=n, freq="D", name="Date")
+    frames = {}
+    for i, symbol in enumerate(symbols):
+        close = np.linspace(10.0, 20.0, n) + i
+        frames[symbol] = pd.DataFrame({
+            "Open": close, "High": close + 1, "Low": close - 1,
+            "Close": close, "Volume": 1000,
+        }, index=dates)
+    return pd.concat(frames, axis=1)
+
+
+class TestFetchPricesBulk:
+    def test_split_multiindex(self):
+        raw = _make_bulk_raw(["NOKIA.HE", "NESTE.HE"])
+        frames = app._split_bulk_download(raw, ["NOKIA.HE", "NESTE.HE"])
+        assert set(frames) == {"NOKIA.HE", "NESTE.HE"}
+        assert list(frames["NESTE.HE"].columns) == ["Open", "High", "Low", "Close", "Volume"]
+        assert frames["NESTE.HE"]["Close"].iloc[0] == pytest.approx(11.0)
+
+    def test_split_drops_missing_rows_and_symbols(self):
+        raw = _make_bulk_raw(["AAA", "BBB", "CCC"])
+        raw.loc[raw.index[:2], ("BBB", "Close")] = np.nan   # eri pörssin pyhäpäivät
+        raw.loc[:, ("CCC", "Close")] = np.nan               # ei dataa lainkaan
+        frames = app._split_bulk_download(raw, ["AAA", "BBB", "CCC", "DDD"])
+        assert set(frames) == {"AAA", "BBB"}
+        assert len(frames["BBB"]) == len(raw) - 2
+
+    def test_split_empty(self):
+        assert app._split_bulk_download(pd.DataFrame(), ["AAA"]) == {}
+
+    def test_bulk_fetch_is_chunked(self, tmp_db, monkeypatch):
+        calls = []
+
+        def fake_download(tickers, **kwargs):
+            calls.append(list(tickers))
+            return _make_bulk_raw(list(tickers))
+
+        monkeypatch.setattr(app, "BULK_CHUNK_SIZE", 2)
+        monkeypatch.setattr(app.yf, "download", fake_download)
+        symbols = ("A", "B", "C", "D", "E")
+        frames = app.fetch_prices_bulk(symbols, period="max")
+        assert sorted(calls) == [["A", "B"], ["C", "D"], ["E"]]
+        assert set(frames) == set(symbols)
+
+
+# ===========================================================================
+# 10. TokenBucket / _yahoo_call / fetch_parallel
+# ===========================================================================
+
+class _FakeClock:
+    """Deterministinen kello: sleep siirtää aikaa eteenpäin."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket:
+    def test_burst_does_not_wait(self):
+        clock = _FakeClock()
+        bucket = app.TokenBucket(rate=2.0, capacity=3, clock=clock, sleep=clock.sleep)
+        assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert clock.sleeps == []
+
+    def test_waits_for_refill(self):
+        clock = _FakeClock()
+        bucket = app.TokenBucket(rate=2.0, capacity=1, clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+        waited = bucket.acquire()
+        assert waited == pytest.approx(0.5)
+
+    def test_penalize_blocks_all_callers(self):
+        clock = _FakeClock()
+        bucket = app.TokenBucket(rate=100.0, capacity=10, clock=clock, sleep=clock.sleep)
+        delay = bucket.penalize()
+        assert delay == pytest.approx(app.RATE_LIMIT_BACKOFF)
+        assert bucket.acquire() >= delay
+
+    def test_penalize_escalates_and_reward_resets(self):
+        clock = _FakeClock()
+        bucket = app.TokenBucket(rate=100.0, capacity=10, clock=clock, sleep=clock.sleep)
+        first = bucket.penalize()
+        second = bucket.penalize()
+        assert second == pytest.approx(2 * first)
+        bucket.reward()
+        assert bucket.penalize() == pytest.approx(first)
+
+    def test_oversized_request_is_clamped(self):
+        clock = _FakeClock()
+        bucket = app.TokenBucket(rate=1.0, capacity=2, clock=clock, sleep=clock.sleep)
+        assert bucket.acquire(50) == 0.0
+
+
+class TestYahooCall:
+    @pytest.fixture()
+    def fake_limiter(self, monkeypatch):
+        clock = _FakeClock()
+        bucket = app.TokenBucket(rate=100.0, capacity=10, clock=clock, sleep=clock.sleep)
+        monkeypatch.setattr(app, "_get_yahoo_limiter", lambda: bucket)
+        return bucket, clock
+
+    def test_retries_after_rate_limit(self, fake_limiter):
+        _, clock = fake_limiter
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 2:
+                raise RuntimeError("429 Too Many Requests")
+            return "ok"
+
+        assert app._yahoo_call(flaky) == "ok"
+        assert len(attempts) == 2
+        assert sum(clock.sleeps) >= app.RATE_LIMIT_BACKOFF
+
+    def test_other_errors_raise_immediately(self, fake_limiter):
+        def broken():
+            raise ValueError("huono tunnus")
+
+        with pytest.raises(ValueError):
+            app._yahoo_call(broken)
+
+    def test_gives_up_after_max_retries(self, fake_limiter):
+        def always_limited():
+            raise RuntimeError("rate limit")
+
+        with pytest.raises(RuntimeError):
+            app._yahoo_call(always_limited, max_retries=2)
+
+
+class TestFetchParallel:
+    def test_preserves_order_and_captures_errors(self):
+        def work(x):
+            if x == 3:
+                raise ValueError("kolme")
+            return x * 10
+
+        results = app.fetch_parallel(work, [1, 2, 3, 4])
+        assert results[:2] == [10, 20]
+        assert isinstance(results[2], ValueError)
+        assert results[3] == 40
+
+    def test_call_each_runs_in_caller_thread(self):
+        threads = []
+        results = app.call_each(lambda x: threads.append(threading.current_thread()) or 1 / x, [1, 0])
+        assert results[0] == 1.0 and isinstance(results[1], ZeroDivisionError)
+        assert threads == [threading.current_thread()] * 2
+
+    def test_analyze_many_keeps_cached_wrappers_in_script_thread(self, monkeypatch):
+        """Raakahaut poolissa, välimuistitetut kääreet (get_stock_analysis → fetch_stock_data) kutsujan säikeessä."""
+        seen = {}
+        monkeypatch.setattr(app, "refresh_price_bars",
+                            lambda symbols, start: seen.setdefault("bars", list(symbols)) and {})
+        monkeypatch.setattr(app, "_load_stock_info",
+                            lambda s: seen.setdefault(s, threading.current_thread().name) and {})
+        monkeypatch.setattr(app, "get_stock_analysis",
+                            lambda s, period: (True, {"symbol": s, "thread": threading.current_thread()}))
+        results = app.analyze_many(["AAA", "BBB"], "1y")
+        assert seen["bars"] == ["AAA", "BBB"]
+        assert all(seen[s].startswith(app.FETCH_THREAD_PREFIX) for s in ("AAA", "BBB"))
+        assert [r[1]["thread"] for r in results] == [threading.current_thread()] * 2
+
+
+# ===========================================================================
+# 11. Kurssivarasto: save/load_price_bars, refresh_price_bars
+# ===========================================================================
+
+class _FakeYahoo:
+    """Simuloi yf.download-rajapintaa kiinteällä päiväkurssisarjalla."""
+
+    def __init__(self, n: int = 300, end: str = "2026-10-16"):
+        dates = pd.bdate_range(end=end, periods=n, name="Date")
+        close = np.linspace(50.0, 80.0, n)
+        self.bars = pd.DataFrame({
+            "Open": close, "High": close + 1, "Low": close - 1,
+            "Close": close, "Volume": 1000.0,
+        }, index=dates)
+        self.calls = []
+
+    def download(self, tickers, start=None, **kwargs):
+        self.calls.append((list(tickers), start))
+        part = self.bars[self.bars.index >= pd.Timestamp(start)] if start else self.bars
+        return pd.concat({symbol: part for symbol in tickers}, axis=1)
+
+
+class TestPriceStore:
+    @pytest.fixture()
+    def fake_yahoo(self, tmp_db, monkeypatch):
+        fake = _FakeYahoo()
+        monkeypatch.setattr(app.yf, "download", fake.download)
+        # Kellonajasta riippumattomat testit: pörssi tulkitaan aina auki olevaksi
+        monkeypatch.setattr(app, "data_final_since", lambda *args, **kwargs: False)
+        return fake
+
+    def test_period_start(self):
+        assert app.period_start("6mo", datetime(2026, 10, 17)) == "2026-04-17"
+        assert app.period_start("10y", datetime(2026, 10, 17)) == "2016-10-17"
+        assert app.period_start("ytd", datetime(2026, 10, 17)) == "2026-01-01"
+        with pytest.raises(ValueError):
+            app.period_start("joskus")
+
+    def test_save_and_load_roundtrip(self, fake_yahoo):
+        app.save_price_bars("NOKIA.HE", fake_yahoo.bars, covered_from="2000-01-01")
+        df = app.load_price_bars("NOKIA.HE")
+        assert list(df.columns) == app.PRICE_BAR_COLUMNS
+        assert df.index.name == "Date"
+        assert len(df) == len(fake_yahoo.bars)
+        assert df["Close"].iloc[-1] == pytest.approx(80.0)
+        meta = app.get_price_bar_meta("NOKIA.HE")
+        assert meta[0] == "2000-01-01"
+        assert meta[1] == fake_yahoo.bars.index[-1].strftime("%Y-%m-%d")
+
+    def test_cold_refresh_fetches_full_range(self, fake_yahoo):
+        start = fake_yahoo.bars.index[0].strftime("%Y-%m-%d")
+        failures = app.refresh_price_bars(["AAA", "BBB"], start)
+        assert failures == {}
+        assert fake_yahoo.calls == [(["AAA", "BBB"], start)]
+        assert len(app.load_price_bars("BBB")) == len(fake_yahoo.bars)
+
+    def test_fresh_store_skips_network(self, fake_yahoo):
+        start = fake_yahoo.bars.index[0].strftime("%Y-%m-%d")
+        app.refresh_price_bars(["AAA"], start)
+        app.refresh_price_bars(["AAA"], start)
+        assert len(fake_yahoo.calls) == 1
+
+    def test_warm_refresh_requests_only_delta(self, fake_yahoo, monkeypatch):
+        start = fake_yahoo.bars.index[0].strftime("%Y-%m-%d")
+        app.refresh_price_bars(["AAA"], start)
+        monkeypatch.setattr(app, "PRICE_STORE_TTL", 0)
+        app.refresh_price_bars(["AAA"], start)
+        _, delta_start = fake_yahoo.calls[-1]
+        assert delta_start == fake_yahoo.bars.index[-2].strftime("%Y-%m-%d")
+
+    def test_closed_exchange_extends_ttl_to_next_open(self, fake_yahoo, monkeypatch):
+        start = fake_yahoo.bars.index[0].strftime("%Y-%m-%d")
+        app.refresh_price_bars(["AAA"], start)
+        monkeypatch.setattr(app, "PRICE_STORE_TTL", 0)
+        monkeypatch.setattr(app, "data_final_since", lambda exchanges, refreshed, now=None: True)
+        app.refresh_price_bars(["AAA"], start)
+        assert len(fake_yahoo.calls) == 1
+
+    def test_longer_range_extends_coverage(self, fake_yahoo):
+        short_start = fake_yahoo.bars.index[-50].strftime("%Y-%m-%d")
+        long_start = fake_yahoo.bars.index[0].strftime("%Y-%m-%d")
+        app.refresh_price_bars(["AAA"], short_start)
+        assert len(app.load_price_bars("AAA")) == 50
+        app.refresh_price_bars(["AAA"], long_start)
+        assert fake_yahoo.calls[-1][1] == long_start
+        assert len(app.load_price_bars("AAA")) == len(fake_yahoo.bars)
+
+    def test_readjusted_history_is_refetched(self, fake_yahoo, monkeypatch):
+        start = fake_yahoo.bars.index[0].strftime("%Y-%m-%d")
+        app.refresh_price_bars(["AAA"], start)
+        # Osinkokorjaus: koko historia skaalautuu
+        fake_yahoo.bars[["Open", "High", "Low", "Close"]] *= 0.9
+        monkeypatch.setattr(app, "PRICE_STORE_TTL", 0)
+        app.refresh_price_bars(["AAA"], start)
+        assert fake_yahoo.calls[-1][1] == start
+        df = app.load_price_bars("AAA")
+        assert df["Close"].iloc[0] == pytest.approx(45.0)
+
+    def test_get_price_history_end_is_exclusive(self, fake_yahoo):
+        start = fake_yahoo.bars.index[0].strftime("%Y-%m-%d")
+        end = fake_yahoo.bars.index[-1].strftime("%Y-%m-%d")
+        df = app.get_price_history("AAA", start, end)
+        assert len(df) == len(fake_yahoo.bars) - 1
+
+    def test_get_price_history_raises_without_data(self, tmp_db, monkeypatch):
+        def broken(*args, **kwargs):
+            raise ValueError("yhteysvirhe")
+
+        monkeypatch.setattr(app.yf, "download", broken)
+        with pytest.raises(ValueError):
+            app.get_price_history("AAA", "2024-01-01")
+
+
+# ===========================================================================
+# 12. Fundamenttitiedot: save/load_fundamentals, fetch_stock_info
+# ===========================================================================
+
+class TestFundamentals:
+    @pytest.fixture()
+    def fake_ticker(self, monkeypatch):
+        calls = []
+
+        class FakeTicker:
+            def __init__(self, symbol):
+                self.symbol = symbol
+
+            @property
+            def info(self):
+                calls.append(self.symbol)
+                return {"longName": f"{self.symbol} Oyj", "trailingPE": 12.5}
+
+        monkeypatch.setattr(app.yf, "Ticker", FakeTicker)
+        return calls
+
+    def test_save_and_load(self, tmp_db):
+        app.save_fundamentals("NOKIA.HE", {"trailingPE": 9.1, "longName": "Nokia"})
+        assert app.load_fundamentals("NOKIA.HE") == {"trailingPE": 9.1, "longName": "Nokia"}
+
+    def test_load_missing_returns_none(self, tmp_db):
+        assert app.load_fundamentals("EI.HE") is None
+
+    def test_load_respects_max_age(self, tmp_db):
+        app.save_fundamentals("NOKIA.HE", {"trailingPE": 9.1})
+        conn = sqlite3.connect(tmp_db)
+        conn.execute("UPDATE fundamentals SET fetched_at='2000-01-01 00:00:00'")
+        conn.commit()
+        conn.close()
+        assert app.load_fundamentals("NOKIA.HE", max_age=app.FUNDAMENTALS_TTL) is None
+        assert app.load_fundamentals("NOKIA.HE") == {"trailingPE": 9.1}
+
+    def test_fetch_stock_info_uses_db_cache(self, tmp_db, fake_ticker):
+        first = app.fetch_stock_info("SAMPO.HE")
+        second = app.fetch_stock_info("SAMPO.HE")
+        assert first == second == {"longName": "SAMPO.HE Oyj", "trailingPE": 12.5}
+        assert fake_ticker == ["SAMPO.HE"]
+
+    def test_fetch_stock_info_refreshes_stale(self, tmp_db, fake_ticker):
+        app.save_fundamentals("SAMPO.HE", {"trailingPE": 1.0})
+        conn = sqlite3.connect(tmp_db)
+        conn.execute("UPDATE fundamentals SET fetched_at='2000-01-01 00:00:00'")
+        conn.commit()
+        conn.close()
+        assert app.fetch_stock_info("SAMPO.HE")["trailingPE"] == 12.5
+        assert fake_ticker == ["SAMPO.HE"]
+
+
+# ===========================================================================
+# 13. compute_indicators – vektoroitu indikaattorimoottori
+# ===========================================================================
+
+class TestIndicators:
+    """Verrataan NumPy-toteutusta ta-kirjaston (vertailutoteutus) arvoihin."""
+
+    @staticmethod
+    def _reference(close: pd.Series) -> dict:
+        ta = pytest.importorskip("ta")
+        macd = ta.trend.MACD(close)
+        bb = ta.volatility.BollingerBands(close, window=20, window_dev=2)
+        return {
+            "RSI": ta.momentum.RSIIndicator(close, window=14).rsi(),
+            "SMA50": close.rolling(window=50).mean(),
+            "SMA200": close.rolling(window=200).mean(),
+            "MACD": macd.macd(),
+            "MACD_signal": macd.macd_signal(),
+            "BB_upper": bb.bollinger_hband(),
+            "BB_lower": bb.bollinger_lband(),
+            "BB_mid": bb.bollinger_mavg(),
+        }
+
+    @pytest.mark.parametrize("seed", [1, 42, 7])
+    def test_matches_ta(self, seed):
+        close = _make_price_df(n=600, seed=seed)["Close"]
+        result = app.compute_indicators(close.to_numpy())
+        for key, expected in self._reference(close).items():
+            np.testing.assert_allclose(
+                result[key], expected.to_numpy(), atol=app.INDICATOR_TOLERANCE, rtol=0,
+                equal_nan=True, err_msg=key,
+            )
+
+    def test_panel_matches_single_series(self):
+        frames = {
+            "AAA": _make_price_df(n=300, seed=1),
+            "BBB": _make_price_df(n=120, seed=2),
+            "CCC": _make_price_df(n=10, seed=3),
+        }
+        latest = app.latest_indicators(frames)
+        for symbol, df in frames.items():
+            single = app.compute_indicators(df["Close"].to_numpy())
+            for key, values in single.items():
+                if np.isnan(values[-1]):
+                    assert latest[symbol][key] is None
+                else:
+                    assert latest[symbol][key] == pytest.approx(values[-1], abs=app.INDICATOR_TOLERANCE)
+
+    def test_short_series_is_nan(self):
+        result = app.compute_indicators(np.array([100.0, 101.0, 99.0]))
+        assert np.isnan(result["RSI"]).all()
+        assert np.isnan(result["SMA50"]).all()
+
+    def test_add_indicators_selected_columns(self):
+        df = _make_price_df(n=100)
+        app.add_indicators(df, ["RSI", "MACD"])
+        assert "RSI" in df.columns and "MACD" in df.columns
+        assert "SMA50" not in df.columns
+
+
+# ===========================================================================
+# 14. optimize_strategy – parametrioptimointi
+# ===========================================================================
+
+class TestOptimizeStrategy:
+    @pytest.fixture()
+    def closes(self):
+        return {
+            "AAA": _make_price_df(n=600, seed=1)["Close"].to_numpy(),
+            "BBB": _make_price_df(n=400, seed=2)["Close"].to_numpy(),
+        }
+
+    def test_grid_covers_valid_combinations(self, closes):
+        grid = {"sma_fast": [20, 50, 200], "sma_slow": [100, 200]}
+        ok, result = app.optimize_strategy(list(closes), "Momentum (SMA-risteytys)", closes=closes,
+                                           param_grid=grid, max_workers=1)
+        assert ok
+        # fast >= slow -yhdistelmät hylätään
+        assert len(result) == 4
+        assert list(result["sharpe_ratio"]) == sorted(result["sharpe_ratio"], reverse=True)
+
+    def test_default_params_match_backtest(self, closes):
+        df = _make_price_df(n=600, seed=1)
+        grid = {"macd_fast": [12], "macd_slow": [26], "macd_signal": [9]}
+        ok, result = app.optimize_strategy(["AAA"], "MACD-risteytys", closes={"AAA": closes["AAA"]},
+                                           param_grid=grid, max_workers=1)
+        sim = app._simulate_trades(app._generate_signals(df, "MACD-risteytys"), 10000, 0.001)
+        assert ok
+        assert result.loc[0, "sharpe_ratio"] == sim["sharpe_ratio"]
+        assert result.loc[0, "strategy_return"] == sim["strategy_return"]
+        assert result.loc[0, "max_drawdown"] == sim["max_drawdown"]
+
+    def test_process_pool_matches_inline(self, closes):
+        kwargs = dict(closes=closes, method="random", n_samples=6, seed=3)
+        ok1, inline = app.optimize_strategy(list(closes), "Mean Reversion (Bollinger Bands)", max_workers=1, **kwargs)
+        ok2, pooled = app.optimize_strategy(list(closes), "Mean Reversion (Bollinger Bands)", max_workers=2, **kwargs)
+        assert ok1 and ok2
+        assert len(inline) == 6
+        pd.testing.assert_frame_equal(inline, pooled)
+
+    def test_halving_narrows_candidates(self, closes):
+        ok, result = app.optimize_strategy(list(closes), "Mean Reversion (Bollinger Bands)", closes=closes,
+                                           method="halving", max_workers=1)
+        assert ok
+        n = len(app._param_candidates(app.OPTIMIZER_PARAM_GRID["Mean Reversion (Bollinger Bands)"]))
+        expected = n
+        for _ in app.HALVING_FRACTIONS[:-1]:
+            expected = -(-expected // app.HALVING_ETA)  # parhaat 1/eta pyöristettynä ylös
+        assert len(result) == expected
+
+    def test_custom_params_change_signals(self):
+        df = _make_price_df(n=300)
+        default = app._generate_signals(df, "Mean Reversion (Bollinger Bands)")
+        wide = app._generate_signals(df, "Mean Reversion (Bollinger Bands)", params={"bb_dev": 3.0})
+        assert (wide["Signal"] != "HOLD").sum() < (default["Signal"] != "HOLD").sum()
+
+    def test_unknown_method(self, closes):
+        ok, msg = app.optimize_strategy(list(closes), closes=closes, method="bayes")
+        assert not ok
+
+
+# ===========================================================================
+# 15. backtest_portfolio – salkkutason backtest
+# ===========================================================================
+
+def _make_history(n: int, seed: int, start: str = "2020-01-01", freq: str = "B") -> pd.DataFrame:
+    df = _make_price_df(n=n, seed=seed)
+    df["Date"] = pd.date_range(start, periods=n, freq=freq)
+    return df.set_index("Date")
+
+
+class TestBacktestPortfolio:
+    def test_single_symbol_matches_backtest(self):
+        """Yksi tunnus + signaalipainotus = sama tulos kuin tunnuskohtainen simulointi."""
+        hist = _make_history(400, seed=4)
+        ok, res = app.backtest_portfolio(["AAA"], strategy="MACD-risteytys", weighting="signal",
+                                         frames={"AAA": hist})
+        sim = app._simulate_trades(app._generate_signals(hist.reset_index(), "MACD-risteytys"), 10000, 0.001)
+        assert ok
+        assert res["strategy_final"] == sim["strategy_final"]
+        np.testing.assert_allclose(res["equity_df"]["Value"], sim["equity_df"]["Value"])
+
+    def test_dates_aligned_across_calendars(self):
+        frames = {
+            "FI": _make_history(300, seed=1, start="2020-01-01"),
+            "US": _make_history(300, seed=2, start="2020-01-03"),
+        }
+        panel = app.align_close_panel(frames)
+        assert panel.index.is_monotonic_increasing
+        assert len(panel) == len(frames["FI"].index.union(frames["US"].index))
+        # FI:n viimeisen päivän jälkeen kurssi pysyy voimassa
+        assert panel["FI"].iloc[-1] == frames["FI"]["Close"].iloc[-1]
+
+    @pytest.mark.parametrize("weighting", ["equal", "signal"])
+    @pytest.mark.parametrize("rebalance", ["none", "monthly", "quarterly"])
+    def test_capital_is_conserved_without_costs(self, weighting, rebalance):
+        frames = {f"S{i}": _make_history(300, seed=i) for i in range(5)}
+        ok, res = app.backtest_portfolio(list(frames), commission=0.0, strategy="Mean Reversion (Bollinger Bands)",
+                                         weighting=weighting, rebalance=rebalance, frames=frames)
+        assert ok
+        assert res["equity_df"]["Value"].iloc[0] == pytest.approx(10000)
+        assert res["final_weights"].sum() <= 1.0 + 1e-9
+        assert (res["final_weights"] >= -1e-12).all()
+
+    def test_buy_hold_benchmark_equal_weight(self):
+        frames = {f"S{i}": _make_history(250, seed=i) for i in range(3)}
+        ok, res = app.backtest_portfolio(list(frames), commission=0.0, frames=frames)
+        growth = np.mean([f["Close"].iloc[-1] / f["Close"].iloc[0] for f in frames.values()])
+        assert ok
+        assert res["buy_hold_final"] == pytest.approx(10000 * growth, rel=1e-6)
+
+    def test_not_enough_data(self):
+        ok, msg = app.backtest_portfolio(["AAA"], frames={"AAA": _make_history(50, seed=1)})
+        assert not ok
+
+    @staticmethod
+    def _holding(*days: str) -> np.ndarray:
+        return np.array([[name in day for name in "AB"] for day in days])
+
+    def test_signal_weighting_resizes_to_equal_weights(self):
+        """A → AB → AB → B → AB vakiokursseilla: jokainen muutos jakaa arvon 1/k-painoihin."""
+        holding = self._holding("A", "AB", "AB", "B", "AB")
+        prices = np.ones(holding.shape)
+        sim = app._simulate_portfolio(prices, holding, np.zeros(len(holding), dtype=bool), 100.0, 0.0, "signal")
+        np.testing.assert_allclose(sim["shares"], [50.0, 50.0])
+        # A osto, B osto, B:n täydennys A:n poistuessa, A:n paluu
+        assert sim["trades"] == 4
+        np.testing.assert_allclose(sim["values"], 100.0)
+
+    def test_signal_weighting_second_entry_gets_half(self):
+        holding = self._holding("A", "AB")
+        sim = app._simulate_portfolio(np.ones(holding.shape), holding, np.zeros(2, dtype=bool), 100.0, 0.0, "signal")
+        np.testing.assert_allclose(sim["shares"], [50.0, 50.0])
+
+    def test_zero_amount_buys_are_not_trades(self):
+        """Tasapainotus valmiiksi tavoitepainoissa ei osta mitään eikä kasvata kauppamäärää."""
+        holding = self._holding("AB", "AB", "AB")
+        rebalance = np.array([False, True, True])
+        for weighting in app.PORTFOLIO_WEIGHTINGS:
+            sim = app._simulate_portfolio(np.ones(holding.shape), holding, rebalance, 100.0, 0.0, weighting)
+            np.testing.assert_allclose(sim["shares"], [50.0, 50.0])
+            assert sim["trades"] == 2
+
+
+# ===========================================================================
+# 16. _refresh_due – auto-refresh-fragmenttien ajastus
+# ===========================================================================
+
+class TestRefreshDue:
+    def test_first_run_is_due(self, monkeypatch):
+        monkeypatch.delitem(app.st.session_state, "fi_synced_at", raising=False)
+        assert app._refresh_due("fi", 60, now=1000.0)
+
+    def test_not_due_within_interval(self, monkeypatch):
+        monkeypatch.setitem(app.st.session_state, "fi_synced_at", 1000.0)
+        assert not app._refresh_due("fi", 60, now=1030.0)
+        # Ajastin voi laueta hieman ennen täyttä väliä
+        assert app._refresh_due("fi", 60, now=1000.0 + 60 * app.AUTO_REFRESH_TOLERANCE)
+
+    def test_markets_are_independent(self, monkeypatch):
+        monkeypatch.setitem(app.st.session_state, "fi_synced_at", 1000.0)
+        monkeypatch.delitem(app.st.session_state, "us_synced_at", raising=False)
+        assert app._refresh_due("us", 60, now=1001.0)
+
+
+# ===========================================================================
+# 17. get_connection – prosessinlaajuinen yhteyspooli
+# ===========================================================================
+
+class TestConnectionPool:
+    def test_connection_is_reused_within_thread(self, tmp_db):
+        assert app.get_connection() is app.get_connection()
+        assert app.get_connection(readonly=True) is app.get_connection(readonly=True)
+        assert app.get_connection(readonly=True) is not app.get_connection()
+
+    def test_concurrent_threads_get_own_connections(self, tmp_db):
+        held = app.get_connection()
+        other = []
+        thread = threading.Thread(target=lambda: other.append(app.get_connection()))
+        thread.start()
+        thread.join()
+        assert other[0] is not held
+
+    def test_sequential_threads_reuse_connection(self, tmp_db):
+        """Streamlit ajaa uudelleenajot eri säikeissä; yhteys palaa pooliin close()-kutsulla."""
+        seen = []
+
+        def rerun():
+            conn = app.get_connection(readonly=True)
+            try:
+                seen.append(conn)
+                conn.execute("SELECT COUNT(*) FROM users").fetchone()
+            finally:
+                conn.close()
+
+        for _ in range(2):
+            thread = threading.Thread(target=rerun)
+            thread.start()
+            thread.join()
+        assert seen[0] is seen[1]
+
+    def test_nested_calls_share_until_last_close(self, tmp_db):
+        pool = app._connection_pool(app.DB_NAME)
+        outer = app.get_connection()
+        inner = app.get_connection()
+        assert inner is outer
+        inner.close()
+        idle = pool.idle()
+        outer.close()
+        assert pool.idle() == idle + 1
+        outer.close()  # toinen sulkeminen ei palauta yhteyttä kahdesti
+        assert pool.idle() == idle + 1
+
+    def test_idle_connections_are_bounded(self, tmp_db, monkeypatch):
+        pool = app._connection_pool(app.DB_NAME)
+        monkeypatch.setattr(pool, "max_idle", 2)
+        conns, all_held = [], threading.Barrier(4)
+
+        def hold():
+            conn = app.get_connection(readonly=True)
+            conns.append(conn)
+            all_held.wait()
+            conn.close()
+
+        threads = [threading.Thread(target=hold) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len({id(conn) for conn in conns}) == 4
+        assert pool.idle(readonly=True) == 2
+
+    def test_wal_and_pragmas(self, tmp_db):
+        conn = app.get_connection()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -app.DB_CACHE_SIZE_KIB
+
+    def test_readonly_rejects_writes(self, tmp_db):
+        with pytest.raises(sqlite3.OperationalError):
+            app.get_connection(readonly=True).execute("DELETE FROM users")
+
+    def test_close_rolls_back_uncommitted(self, tmp_db):
+        conn = app.get_connection()
+        conn.execute("DELETE FROM users")
+        conn.close()
+        assert app.get_all_users()
+        # Yhteys on yhä käytettävissä
+        assert conn.execute("SELECT 1").fetchone() == (1,)
+
+
+# ===========================================================================
+# 18. init_db – versioidut skeemamigraatiot
+# ===========================================================================
+
+class TestSchemaMigrations:
+    def test_fresh_db_reaches_latest_version(self, tmp_db):
+        assert app.get_schema_version() == app.SCHEMA_MIGRATIONS[-1][0]
+
+    def test_second_run_applies_nothing(self, tmp_db):
+        assert app.init_db() == []
+
+    def test_versions_are_ordered_and_unique(self):
+        versions = [v for v, _, _ in app.SCHEMA_MIGRATIONS]
+        assert versions == sorted(set(versions))
+
+    def test_legacy_db_is_migrated(self, tmp_path, monkeypatch):
+        """Vanha kanta ilman versiotaulua ja portfolio_id-saraketta päivittyy."""
+        db_file = str(tmp_path / "legacy.db")
+        conn = sqlite3.connect(db_file)
+        conn.execute("CREATE TABLE stocks (id INTEGER PRIMARY KEY, symbol TEXT, added_at TEXT)")
+        conn.execute("INSERT INTO stocks (symbol, added_at) VALUES ('NOKIA.HE', '2020-01-01')")
+        conn.commit()
+        conn.close()
+        monkeypatch.setattr(app, "DB_NAME", db_file)
+
+        applied = app.init_db()
+
+        assert applied == [v for v, _, _ in app.SCHEMA_MIGRATIONS]
+        assert list(app.get_stocks(1)["symbol"]) == ["NOKIA.HE"]
+
+    def test_ensure_schema_runs_once(self, tmp_db, monkeypatch):
+        calls = []
+        monkeypatch.setattr(app, "init_db", lambda: calls.append(1))
+        app._ensure_schema.clear()
+        app._ensure_schema(tmp_db)
+        app._ensure_schema(tmp_db)
+        assert calls == [1]
+
+
+# ===========================================================================
+# 19. screener_rows – pörssilistojen tyypitetyt rivit
+# ===========================================================================
+
+def _screener_row(symbol, name, signal="🟡 PIDÄ", **extra):
+    row = {"symbol": symbol, "name": name, "price": 10.0, "change_pct": 1.5,
+           "rsi": 50.0, "sma50": 9.5, "signal": signal, "currency": "EUR"}
+    row.update(extra)
+    return row
+
+
+class TestScreenerRows:
+    def test_save_and_query(self, tmp_db):
+        saved = app.save_screener_rows("fi", [
+            _screener_row("NOKIA.HE", "Nokia", "🟢 OSTA", pe=12.5, market_cap=2.2e10),
+            _screener_row("NESTE.HE", "Neste"),
+        ], "2026-01-02 10:00:00")
+        df = app.query_screener("fi")
+        assert saved == 2
+        assert list(df["symbol"]) == ["NESTE.HE", "NOKIA.HE"]
+        assert df.loc[df["symbol"] == "NOKIA.HE", "market_cap"].iloc[0] == pytest.approx(2.2e10)
+        assert app.get_screener_synced_at("fi") == "2026-01-02 10:00:00"
+        assert app.query_screener("us").empty
+
+    def test_upsert_keeps_other_symbols(self, tmp_db):
+        app.save_screener_rows("fi", [_screener_row("NOKIA.HE", "Nokia"),
+                                      _screener_row("NESTE.HE", "Neste")], "2026-01-02 10:00:00")
+        app.save_screener_rows("fi", [_screener_row("NOKIA.HE", "Nokia", price=11.0)],
+                               "2026-01-03 10:00:00")
+        df = app.query_screener("fi").set_index("symbol")
+        assert df.loc["NOKIA.HE", "price"] == 11.0
+        assert df.loc["NESTE.HE", "price"] == 10.0
+        assert app.get_screener_synced_at("fi") == "2026-01-03 10:00:00"
+
+    def test_search_and_signal_filter_in_sql(self, tmp_db):
+        app.save_screener_rows("fi", [
+            _screener_row("NOKIA.HE", "Nokia", "🟢 OSTA"),
+            _screener_row("NESTE.HE", "Neste"),
+            _screener_row("UPM.HE", "UPM-Kymmene", "🟢 OSTA"),
+        ])
+        assert list(app.query_screener("fi", search="nok")["symbol"]) == ["NOKIA.HE"]
+        assert list(app.query_screener("fi", search="kymmene")["symbol"]) == ["UPM.HE"]
+        assert list(app.query_screener("fi", signal="🟢 OSTA")["symbol"]) == ["NOKIA.HE", "UPM.HE"]
+        assert list(app.query_screener("fi", search="upm", signal="🟢 OSTA")["symbol"]) == ["UPM.HE"]
+        # LIKE-erikoismerkit tulkitaan kirjaimellisesti
+        assert app.query_screener("fi", search="%").empty
+
+    def test_search_folds_non_ascii_case(self, tmp_db):
+        app.save_screener_rows("fi", [
+            _screener_row("AKTIA.HE", "Ålandsbanken"),
+            _screener_row("KEMIRA.HE", "KÄRKKÄINEN ÖLJY"),
+            _screener_row("NESTE.HE", "Neste"),
+        ])
+        assert list(app.query_screener("fi", search="ålands")["symbol"]) == ["AKTIA.HE"]
+        assert list(app.query_screener("fi", search="kärkkäinen öljy")["symbol"]) == ["KEMIRA.HE"]
+        assert list(app.query_screener("fi", search="ÄINEN")["symbol"]) == ["KEMIRA.HE"]
+        assert list(app.query_screener("fi", search="_")["symbol"]) == []
+
+    def test_display_frame_uses_translated_headers(self, tmp_db):
+        app.save_screener_rows("us", [_screener_row("AAPL", "Apple", market_cap=3.1e12)])
+        out = app.screener_display_frame(app.query_screener("us"), "col_company", "col_price_usd")
+        assert out[app.t("col_market_cap")].iloc[0] == "3100.0 Mrd"
+        assert app.t("col_price_usd") in out.columns
+        etf = app.screener_display_frame(app.query_screener("us"), "col_etf_name",
+                                         "col_price_eur", fundamentals=False)
+        assert app.t("col_pe") not in etf.columns
+
+    def test_legacy_json_cache_is_migrated(self, tmp_path, monkeypatch):
+        import json
+        db_file = str(tmp_path / "legacy.db")
+        monkeypatch.setattr(app, "DB_NAME", db_file)
+        conn = sqlite3.connect(db_file)
+        conn.execute("CREATE TABLE us_cache (id INTEGER PRIMARY KEY CHECK (id = 1), data TEXT, synced_at TEXT)")
+        legacy = [{"Symbol": "AAPL", "Company": "Apple", "Price ($)": 190.0, "Change %": 0.5,
+                   "RSI": 40.0, "SMA50": 185.0, "Signal": "🟡 PIDÄ", "Currency": "USD",
+                   "P/E": 30.0, "Market cap": "3000.0 Mrd"}]
+        conn.execute("INSERT INTO us_cache VALUES (1, ?, ?)", (json.dumps(legacy), "02.01.2026 10:00:00"))
+        conn.commit()
+        conn.close()
+
+        app.init_db()
+
+        df = app.query_screener("us")
+        assert list(df["symbol"]) == ["AAPL"]
+        assert df["market_cap"].iloc[0] == pytest.approx(3e12)
+        assert df["price"].iloc[0] == 190.0
+        assert app.get_screener_synced_at("us") == "2026-01-02 10:00:00"
+
+
+# ===========================================================================
+# 20. screener_history – synkronointiarkisto ja aikamatkakyselyt
+# ===========================================================================
+
+class TestScreenerHistory:
+    def _sync(self, ts, rsi, signal="🟡 PIDÄ", symbols=("NOKIA.HE", "NESTE.HE")):
+        app.save_screener_rows("fi", [_screener_row(s, s, signal, rsi=rsi) for s in symbols], ts)
+
+    def test_every_sync_is_archived(self, tmp_db):
+        self._sync(datetime.now().strftime("%Y-%m-%d 09:00:00"), 40.0)
+        self._sync(datetime.now().strftime("%Y-%m-%d 10:00:00"), 45.0)
+        hist = app.get_symbol_history("NOKIA.HE")
+        assert list(hist["rsi"]) == [40.0, 45.0]
+        assert list(hist["market"]) == ["fi", "fi"]
+        # Nykyinen taulukko näyttää silti vain viimeisimmän
+        assert list(app.query_screener("fi")["rsi"]) == [45.0, 45.0]
+
+    def test_as_of_returns_latest_sync_before_date(self, tmp_db):
+        self._sync("2026-01-05 10:00:00", 25.0, "🟢 OSTA")
+        self._sync("2026-01-06 10:00:00", 75.0, "🔴 MYY", symbols=("NOKIA.HE",))
+        snap = app.get_screener_as_of("fi", "2026-01-05").set_index("symbol")
+        assert snap.loc["NOKIA.HE", "signal"] == "🟢 OSTA"
+        later = app.get_screener_as_of("fi", "2026-01-06").set_index("symbol")
+        assert later.loc["NOKIA.HE", "signal"] == "🔴 MYY"
+        # NESTE ei synkronoitunut 6.1.: edellinen arvo on yhä voimassa
+        assert later.loc["NESTE.HE", "rsi"] == 25.0
+        assert app.get_screener_as_of("fi", "2026-01-04").empty
+
+    def test_history_range_filter(self, tmp_db):
+        for day in (5, 6, 7):
+            self._sync(f"2026-01-0{day} 10:00:00", float(day))
+        hist = app.get_symbol_history("NOKIA.HE", market="fi", start="2026-01-06", end="2026-01-06")
+        assert list(hist["rsi"]) == [6.0]
+
+    def test_old_intraday_snapshots_are_downsampled(self, tmp_db):
+        old_day = (datetime.now() - timedelta(days=20)).strftime("%Y-%m-%d")
+        next_day = (datetime.now() - timedelta(days=19)).strftime("%Y-%m-%d")
+        for hour in (9, 12, 15):
+            self._sync(f"{old_day} {hour}:00:00", float(hour))
+        self._sync(f"{next_day} 09:00:00", 1.0)
+        # Tallennus harventaa heti: vanhasta päivästä jää vain viimeinen synkka
+        hist = app.get_symbol_history("NOKIA.HE")
+        assert list(hist["rsi"]) == [15.0, 1.0]
+        assert app.prune_screener_history() == 0
+
+    def test_recent_intraday_snapshots_are_kept(self, tmp_db):
+        day = (datetime.now() - timedelta(days=3)).strftime("%Y-%m-%d")
+        for hour in (9, 12, 15):
+            self._sync(f"{day} {hour}:00:00", float(hour))
+        assert len(app.get_symbol_history("NOKIA.HE")) == 3
+        # Kun ikkuna on ohitettu, päivästä jää yksi synkka per tunnus
+        assert app.prune_screener_history(now=time.time() + 10 * 86400) == 4
+        assert list(app.get_symbol_history("NOKIA.HE")["rsi"]) == [15.0]
+
+
+# ===========================================================================
+# 21. run_screener – yhteinen seulontamoottori kaikille pörssilistoille
+# ===========================================================================
+
+@pytest.fixture()
+def fake_market(tmp_db, monkeypatch):
+    """Korvaa kurssi- ja perustietohaut: NOKIA nousee, NESTE laskee, UPM:llä ei dataa."""
+    idx = pd.date_range("2026-01-01", periods=80, freq="B")
+    prices = {
+        "NOKIA.HE": pd.DataFrame({"Close": np.linspace(10, 20, 80)}, index=idx),
+        "NESTE.HE": pd.DataFrame({"Close": np.linspace(20, 10, 80)}, index=idx),
+    }
+    monkeypatch.setattr(app, "fetch_prices_bulk",
+                        lambda symbols, period="6mo": {s: prices[s] for s in symbols if s in prices})
+    monkeypatch.setattr(app, "fetch_stock_info",
+                        lambda s: {"currency": "EUR", "trailingPE": 12.345, "marketCap": 5e9})
+    monkeypatch.setattr(app, "prefetch_stock_info", lambda symbols: [])
+    return {"NOKIA.HE": "Nokia", "NESTE.HE": "Neste", "UPM.HE": "UPM"}
+
+
+class TestRunScreener:
+    def test_columnar_result(self, fake_market):
+        df = app.run_screener(fake_market)
+        assert list(df.columns) == app.SCREENER_FIELDS
+        assert list(df["symbol"]) == ["NOKIA.HE", "NESTE.HE"]
+        nokia = df.set_index("symbol").loc["NOKIA.HE"]
+        assert nokia["price"] == 20.0
+        assert nokia["rsi"] > 70 and nokia["signal"] == "🔴 MYY"
+        assert nokia["pe"] == 12.35 and nokia["market_cap"] == 5e9
+
+    def test_market_options_apply(self, fake_market, monkeypatch):
+        monkeypatch.setitem(app.SCREENER_MARKETS, "xsto", dict(
+            app.SCREENER_MARKETS["eu"], universe=fake_market))
+        df = app.run_screener("xsto")
+        assert df["pe"].isna().all() and df["market_cap"].isna().all()
+
+    def test_symbol_list_universe_uses_symbol_as_name(self, fake_market):
+        df = app.run_screener(["NESTE.HE"])
+        assert list(df["name"]) == ["NESTE.HE"]
+        assert df["signal"].iloc[0] in app.SCREENER_SIGNAL_LABELS.values()
+
+    def test_register_and_sync_market(self, tmp_db, fake_market, monkeypatch):
+        monkeypatch.setattr(app, "SCREENER_MARKETS", dict(app.SCREENER_MARKETS))
+        app.register_screener_market("custom", fake_market, price_decimals=1)
+        ok, saved = app.sync_screener_market("custom")
+        assert ok and saved == 2
+        assert list(app.query_screener("custom")["symbol"]) == ["NESTE.HE", "NOKIA.HE"]
+
+    def test_every_market_has_translations(self):
+        for market in app.SCREENER_MARKETS:
+            for key in (f"{market}_header", f"{market}_count", f"tab_{market}"):
+                assert key in app.TRANSLATIONS["fi"] and key in app.TRANSLATIONS["en"]
+
+
+# ===========================================================================
+# 22. Aukioloajat ja taustapäivittäjän tila
+# ===========================================================================
+
+class TestMarketHoursAndWorker:
+    def test_is_market_open(self):
+        from zoneinfo import ZoneInfo
+        hel = ZoneInfo("Europe/Helsinki")
+        assert app.is_market_open("fi", datetime(2026, 3, 4, 12, 0, tzinfo=hel))
+        assert not app.is_market_open("fi", datetime(2026, 3, 4, 19, 0, tzinfo=hel))
+        assert not app.is_market_open("fi", datetime(2026, 3, 7, 12, 0, tzinfo=hel))  # lauantai
+        # 16:30 Helsingissä = 9:30 New Yorkissa
+        assert app.is_market_open("us", datetime(2026, 3, 4, 16, 30, tzinfo=hel))
+
+    def test_portfolio_symbols_across_users(self, tmp_db):
+        app.add_stock("NOKIA.HE", 1)
+        app.add_stock("AAPL", 2)
+        app.add_stock("NOKIA.HE", 2)
+        assert app.get_portfolio_symbols() == ["AAPL", "NOKIA.HE"]
+
+    def test_worker_heartbeat(self, tmp_db):
+        assert app.get_worker_heartbeat() is None
+        assert not app.worker_is_alive()
+        app.record_worker_heartbeat({"fi": 5}, now=1000.0)
+        assert app.get_worker_heartbeat() == (1000.0, {"fi": 5})
+        assert app.worker_is_alive(now=1000.0 + app.WORKER_STALE_AFTER - 1)
+        assert not app.worker_is_alive(now=1000.0 + app.WORKER_STALE_AFTER)
+
+
+# ===========================================================================
+# 23. Kaupankäyntikalenteri
+# ===========================================================================
+
+class TestTradingCalendar:
+    def test_easter(self):
+        assert app._easter(2026) == datetime(2026, 4, 5).date()
+        assert app._easter(2027) == datetime(2027, 3, 28).date()
+
+    def test_nyse_holidays_2026(self):
+        days = {d.strftime("%m-%d") for d in app.exchange_holidays("XNYS", 2026)}
+        assert days == {"01-01", "01-19", "02-16", "04-03", "05-25", "06-19",
+                        "07-03", "09-07", "11-26", "12-25"}
+
+    def test_helsinki_holidays_2026(self):
+        days = {d.strftime("%m-%d") for d in app.exchange_holidays("XHEL", 2026)}
+        # Itsenäisyyspäivä 6.12. on sunnuntai, joten sitä ei lasketa
+        assert days == {"01-01", "01-06", "04-03", "04-06", "05-01", "05-14",
+                        "06-19", "12-24", "12-25", "12-31"}
+
+    def test_exchange_for_symbol(self):
+        assert app.exchange_for_symbol("NOKIA.HE") == "XHEL"
+        assert app.exchange_for_symbol("AAPL") == "XNYS"
+        assert app.exchange_for_symbol("VWRL.L") == "XLON"
+        assert app.exchange_for_symbol("XACT.ST") == "XSTO"
+        assert app.exchange_for_symbol("ABC.XX") is None
+        assert app.market_exchanges("eu") >= {"XLON", "XETR"}
+
+    def test_holiday_and_next_open(self):
+        from zoneinfo import ZoneInfo
+        hel = ZoneInfo("Europe/Helsinki")
+        good_friday = datetime(2026, 4, 3, 12, 0, tzinfo=hel)
+        assert not app.is_exchange_open("XHEL", good_friday)
+        # Pitkäperjantai ja 2. pääsiäispäivä kiinni -> avautuu tiistaina
+        assert app.next_open("XHEL", good_friday) == datetime(2026, 4, 7, 10, 0, tzinfo=hel)
+        assert app.last_close("XHEL", good_friday) == datetime(2026, 4, 2, 18, 30, tzinfo=hel)
+        assert app.is_exchange_open("UNKNOWN", good_friday)
+
+    def test_market_refresh_due_after_close(self):
+        from zoneinfo import ZoneInfo
+        hel = ZoneInfo("Europe/Helsinki")
+        saturday = datetime(2026, 3, 7, 12, 0, tzinfo=hel).timestamp()
+        before_close = datetime(2026, 3, 6, 17, 0, tzinfo=hel).timestamp()
+        after_close = datetime(2026, 3, 6, 19, 0, tzinfo=hel).timestamp()
+        assert app.market_refresh_due("fi", before_close, saturday)
+        assert not app.market_refresh_due("fi", after_close, saturday)
+        wednesday_noon = datetime(2026, 3, 4, 12, 0, tzinfo=hel).timestamp()
+        assert app.market_refresh_due("fi", wednesday_noon - 60, wednesday_noon)
+
+    def test_data_final_since(self):
+        from zoneinfo import ZoneInfo
+        ny = ZoneInfo("America/New_York")
+        sunday = datetime(2026, 3, 8, 12, 0, tzinfo=ny)
+        assert app.data_final_since(["XNYS"], datetime(2026, 3, 6, 16, 5, tzinfo=ny), sunday)
+        assert not app.data_final_since(["XNYS"], datetime(2026, 3, 6, 15, 0, tzinfo=ny), sunday)
+        assert not app.data_final_since([None], datetime(2026, 3, 6, 16, 5, tzinfo=ny), sunday)
+
+
+# ===========================================================================
+# 24. SingleFlight – samanaikaisten hakujen yhdistäminen
+# ===========================================================================
+
+class TestSingleFlight:
+    def _run_concurrently(self, n, target):
+        threads = [threading.Thread(target=target) for _ in range(n)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join(timeout=5)
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = app.SingleFlight()
+        release = threading.Event()
+        calls, results = [], []
+
+        def slow_fetch(symbol):
+            calls.append(symbol)
+            release.wait(timeout=5)
+            return f"data:{symbol}"
+
+        def caller():
+            results.append(flight.do(("data", "NOKIA.HE", "6mo"), slow_fetch, "NOKIA.HE"))
+
+        threads = [threading.Thread(target=caller) for _ in range(5)]
+        for th in threads:
+            th.start()
+        # Odotetaan, että kaikki ovat liittyneet samaan hakuun
+        deadline = time.time() + 5
+        while flight.leaders + flight.followers < 5 and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for th in threads:
+            th.join(timeout=5)
+
+        assert calls == ["NOKIA.HE"]
+        assert results == ["data:NOKIA.HE"] * 5
+        assert (flight.leaders, flight.followers) == (1, 4)
+        assert flight.in_flight() == 0
+
+    def test_error_is_shared_and_key_released(self):
+        flight = app.SingleFlight()
+
+        def broken():
+            raise ValueError("429")
+
+        with pytest.raises(ValueError):
+            flight.do("k", broken)
+        # Avain vapautuu: seuraava kutsu suoritetaan uudelleen
+        assert flight.do("k", lambda: 1) == 1
+        assert flight.leaders == 2
+
+    def test_different_keys_run_independently(self):
+        flight = app.SingleFlight()
+        calls = []
+        self._run_concurrently(4, lambda: flight.do(threading.current_thread().name,
+                                                     lambda: calls.append(1)))
+        assert len(calls) == 4
+
+    def test_fetch_stock_history_is_coalesced(self, tmp_db, monkeypatch):
+        app._get_single_flight.clear()
+        release = threading.Event()
+        calls = []
+
+        def slow_history(symbol, start, end=None):
+            calls.append((symbol, start, end))
+            release.wait(timeout=5)
+            return pd.DataFrame({"Close": [1.0]})
+
+        monkeypatch.setattr(app, "get_price_history", slow_history)
+        threads = [threading.Thread(target=app.fetch_stock_history,
+                                    args=("NOKIA.HE", "2024-01-01", "2025-01-01")) for _ in range(3)]
+        for th in threads:
+            th.start()
+        flight = app._get_single_flight()
+        deadline = time.time() + 5
+        while flight.leaders + flight.followers < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for th in threads:
+            th.join(timeout=5)
+        assert calls == [("NOKIA.HE", "2024-01-01", "2025-01-01")]
+
+
+# ===========================================================================
+# 25. CircuitBreaker ja vanhentuneen datan palvelu (stale-while-revalidate)
+# ===========================================================================
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold_and_fails_fast(self):
+        clock = _FakeClock()
+        breaker = app.CircuitBreaker(threshold=3, cooldown=60, clock=clock)
+        for _ in range(3):
+            breaker.check()
+            breaker.record_failure()
+        assert breaker.state == app.CircuitBreaker.OPEN
+        with pytest.raises(app.ProviderUnavailable) as exc:
+            breaker.check()
+        assert exc.value.retry_after == pytest.approx(60)
+
+    def test_success_resets_failure_count(self):
+        breaker = app.CircuitBreaker(threshold=2, cooldown=60, clock=_FakeClock())
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == app.CircuitBreaker.CLOSED
+
+    def test_half_open_allows_single_trial(self):
+        clock = _FakeClock()
+        breaker = app.CircuitBreaker(threshold=1, cooldown=60, max_cooldown=600, clock=clock)
+        breaker.record_failure()
+        clock.now += 60
+        assert breaker.state == app.CircuitBreaker.HALF_OPEN
+        breaker.check()  # koekutsu
+        with pytest.raises(app.ProviderUnavailable):
+            breaker.check()
+        # Epäonnistunut koe avaa katkaisimen tuplatulla tauolla
+        breaker.record_failure()
+        assert breaker.retry_after() == pytest.approx(120)
+        clock.now += 120
+        breaker.check()
+        breaker.record_success()
+        assert breaker.state == app.CircuitBreaker.CLOSED
+        breaker.check()
+        breaker.check()
+
+    def test_yahoo_call_skips_network_while_open(self, yahoo_breaker, monkeypatch):
+        clock = _FakeClock()
+        bucket = app.TokenBucket(rate=100.0, capacity=10, clock=clock, sleep=clock.sleep)
+        monkeypatch.setattr(app, "_get_yahoo_limiter", lambda: bucket)
+        calls = []
+
+        def down():
+            calls.append(1)
+            raise ConnectionError("Connection refused")
+
+        for _ in range(app.BREAKER_FAILURE_THRESHOLD):
+            with pytest.raises(ConnectionError):
+                app._yahoo_call(down)
+        with pytest.raises(app.ProviderUnavailable):
+            app._yahoo_call(down)
+        assert len(calls) == app.BREAKER_FAILURE_THRESHOLD
+        assert clock.sleeps == []
+        assert not app.yahoo_available()
+
+    def test_answered_errors_do_not_trip(self, yahoo_breaker):
+        def unknown_symbol():
+            raise KeyError("regularMarketPrice")
+
+        for _ in range(app.BREAKER_FAILURE_THRESHOLD + 1):
+            with pytest.raises(KeyError):
+                app._yahoo_call(unknown_symbol)
+        assert app.yahoo_available()
+
+    def test_download_chunk_detects_swallowed_network_error(self, monkeypatch):
+        monkeypatch.setattr(app.yf, "download", lambda *a, **k: pd.DataFrame())
+        monkeypatch.setattr(app.yf, "shared", type("S", (), {
+            "_ERRORS": {"AAA": "Failed to perform, curl: (6) Could not resolve host"}}), raising=False)
+        with pytest.raises(ConnectionError):
+            app._download_chunk(["AAA"], start="2026-01-01")
+
+    def test_download_chunk_ignores_other_chunks_errors(self, monkeypatch):
+        monkeypatch.setattr(app.yf, "download", lambda *a, **k: pd.DataFrame())
+        monkeypatch.setattr(app.yf, "shared", type("S", (), {"_ERRORS": {
+            "ZZZ": "Too Many Requests. Rate limited.",
+            "YYY": "Failed to perform, curl: (6) Could not resolve host"}}), raising=False)
+        assert app._download_chunk(["AAA"], start="2026-01-01").empty
+
+
+class _DataCache:
+    """st.cache_data-tyyppinen kääre: tallentaa paluuarvot, ei poikkeuksia; clear(*args)."""
+
+    def __init__(self, func):
+        self.func = func
+        self.entries = {}
+
+    def __call__(self, *args):
+        if args not in self.entries:
+            self.entries[args] = self.func(*args)
+        return self.entries[args]
+
+    def clear(self, *args):
+        if args:
+            self.entries.pop(args, None)
+        else:
+            self.entries.clear()
+
+
+class TestStaleWhileRevalidate:
+    @pytest.fixture()
+    def outage(self, tmp_db, monkeypatch):
+        """Varastossa on kurssit; sen jälkeen Yahoo ei vastaa ennen kuin up() kutsutaan."""
+        fake = _FakeYahoo()
+        monkeypatch.setattr(app, "data_final_since", lambda *args, **kwargs: False)
+        monkeypatch.setattr(app.yf, "download", fake.download)
+        start = fake.bars.index[0].strftime("%Y-%m-%d")
+        app.refresh_price_bars(["AAA", "BBB"], start)
+        monkeypatch.setattr(app, "PRICE_STORE_TTL", 0)
+        calls = []
+
+        def down(*args, **kwargs):
+            calls.append(args)
+            raise ConnectionError("Read timed out")
+
+        monkeypatch.setattr(app.yf, "download", down)
+        return start, calls, lambda: monkeypatch.setattr(app.yf, "download", fake.download)
+
+    def test_get_price_history_serves_stale_bars(self, outage):
+        start, _, _ = outage
+        df = app.get_price_history("AAA", start)
+        assert len(df) == len(_FakeYahoo().bars)
+        assert app.is_stale(df)
+        # Taustapäivitys ajastettiin (ja epäonnistui, koska katko jatkuu)
+        assert app._get_revalidator().failed + app._get_revalidator().completed == 1
+
+    def test_outage_latency_is_flat(self, outage):
+        start, calls, _ = outage
+        for _ in range(3 * app.BREAKER_FAILURE_THRESHOLD):
+            assert app.is_stale(app.get_price_history("AAA", start))
+        # Katkaisimen auettua Yahoota ei enää kutsuta lainkaan
+        assert len(calls) <= app.BREAKER_FAILURE_THRESHOLD
+
+    def test_revalidation_refreshes_store_after_recovery(self, outage, yahoo_breaker):
+        start, _, up = outage
+        assert app.is_stale(app.get_price_history("AAA", start))
+        up()
+        df = app.get_price_history("AAA", start)
+        assert not app.is_stale(df)
+        assert app.yahoo_available()
+
+    def test_bulk_marks_only_failed_symbols(self, outage, monkeypatch):
+        start, _, _ = outage
+        monkeypatch.setattr(app, "period_start", lambda period: start)
+        monkeypatch.setattr(app, "refresh_price_bars",
+                            lambda symbols, start: {"BBB": ConnectionError("timed out")})
+        frames = app.fetch_prices_bulk(("AAA", "BBB"))
+        assert not app.is_stale(frames["AAA"]) and app.is_stale(frames["BBB"])
+
+    def test_stock_info_falls_back_to_stored(self, tmp_db, monkeypatch):
+        app.save_fundamentals("SAMPO.HE", {"trailingPE": 9.0})
+        conn = sqlite3.connect(tmp_db)
+        conn.execute("UPDATE fundamentals SET fetched_at='2000-01-01 00:00:00'")
+        conn.commit()
+        conn.close()
+
+        class DownTicker:
+            def __init__(self, symbol):
+                pass
+
+            @property
+            def info(self):
+                raise ConnectionError("Connection reset by peer")
+
+        monkeypatch.setattr(app.yf, "Ticker", DownTicker)
+        info = app.fetch_stock_info("SAMPO.HE")
+        assert info["trailingPE"] == 9.0 and app.is_stale(info)
+        assert app.load_fundamentals("SAMPO.HE") == {"trailingPE": 9.0}
+        assert app.is_stale(app.fetch_stock_info("EI.HE"))
+
+    def test_stock_info_revalidation_clears_cache(self, tmp_db, monkeypatch):
+        cleared = []
+        monkeypatch.setattr(app._cached_stock_info, "clear", cleared.append, raising=False)
+        monkeypatch.setattr(app.yf, "Ticker", lambda s: type("T", (), {"info": {"trailingPE": 11.0}})())
+        app._revalidate_stock_info("SAMPO.HE")
+        assert app.load_fundamentals("SAMPO.HE") == {"trailingPE": 11.0}
+        assert cleared == ["SAMPO.HE"]
+
+    def test_stale_info_is_not_cached(self, tmp_db, monkeypatch):
+        """Oikea välimuistikääre: katkon jälkeen kaikki tunnukset saavat tuoreet tiedot heti."""
+        cached = _DataCache(app._cached_stock_info)
+        monkeypatch.setattr(app, "_cached_stock_info", cached)
+        state = {"up": False}
+
+        class Ticker:
+            def __init__(self, symbol):
+                self.symbol = symbol
+
+            @property
+            def info(self):
+                if not state["up"]:
+                    raise ConnectionError("Connection reset by peer")
+                return {"longName": self.symbol}
+
+        monkeypatch.setattr(app.yf, "Ticker", Ticker)
+        symbols = [f"S{i}.HE" for i in range(6)]
+        assert all(app.is_stale(app.fetch_stock_info(s)) for s in symbols)
+        assert not cached.entries
+        state["up"] = True
+        app._get_yahoo_breaker().record_success()
+        assert [app.fetch_stock_info(s) for s in symbols] == [{"longName": s} for s in symbols]
+        assert len(cached.entries) == 6
+
+    def test_stale_bars_are_not_cached(self, outage, yahoo_breaker, monkeypatch):
+        """Oikeat välimuistikääreet: taustapäivityksen jälkeen kurssit ovat heti tuoreita."""
+        start, _, up = outage
+        monkeypatch.setattr(app, "period_start", lambda period: start)
+        monkeypatch.setattr(app, "fetch_stock_info", lambda s: {"longName": s})
+        caches = {name: _DataCache(getattr(app, name))
+                  for name in ("_cached_prices_bulk", "_cached_stock_data", "_cached_stock_history")}
+        for name, cache in caches.items():
+            monkeypatch.setattr(app, name, cache)
+
+        def fetch_all():
+            return [app.fetch_prices_bulk(("AAA", "BBB"))["AAA"], app.fetch_stock_data("AAA")[0],
+                    app.fetch_stock_history("AAA", start, "2100-01-01")]
+
+        assert all(app.is_stale(df) for df in fetch_all())
+        assert not any(cache.entries for cache in caches.values())
+        up()
+        yahoo_breaker.record_success()
+        assert app.refresh_price_bars(["AAA", "BBB"], start) == {}  # taustapäivitys onnistuu
+        assert not any(app.is_stale(df) for df in fetch_all())
+        assert all(len(cache.entries) == 1 for cache in caches.values())
+
+    def test_revalidator_retries_until_success(self):
+        sleeps, attempts = [], []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise app.ProviderUnavailable(0.0)
+
+        revalidator = app.BackgroundRevalidator(executor=_InlineExecutor(), sleep=sleeps.append)
+        revalidator.schedule("k", flaky)
+        assert (revalidator.completed, revalidator.failed, revalidator.retried) == (1, 0, 2)
+        assert sleeps == [app.REVALIDATE_RETRY_DELAY] * 2 and revalidator.pending() == 0
+
+    def test_revalidator_gives_up_after_max_attempts(self):
+        revalidator = app.BackgroundRevalidator(executor=_InlineExecutor(), sleep=lambda s: None, max_attempts=3)
+        calls = []
+        revalidator.schedule("k", lambda: calls.append(1) or (_ for _ in ()).throw(ConnectionError("timed out")))
+        revalidator.schedule("v", lambda: (_ for _ in ()).throw(ValueError("ei katko")))
+        assert len(calls) == 3 and revalidator.failed == 2 and revalidator.retried == 2
+
+    def test_default_executor_does_not_block_shutdown(self):
+        done = threading.Event()
+        revalidator = app.BackgroundRevalidator()
+        revalidator.schedule("k", done.set)
+        assert done.wait(5)
+        workers = [t for t in threading.enumerate() if t.name.startswith(app.REVALIDATE_THREAD_PREFIX)]
+        assert workers and all(t.daemon for t in workers)
+
+    def test_revalidator_counters_are_consistent_across_workers(self):
+        revalidator = app.BackgroundRevalidator(executor=app._DaemonExecutor(8), sleep=lambda s: None,
+                                                max_attempts=2)
+        attempts = {}
+
+        def job(i):
+            attempts[i] = attempts.get(i, 0) + 1
+            if i % 2 and attempts[i] == 1:
+                raise ConnectionError("timed out")
+
+        for i in range(400):
+            revalidator.schedule(i, job, i)
+        deadline = time.monotonic() + 10
+        while revalidator.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert revalidator.pending() == 0
+        assert (revalidator.completed, revalidator.failed, revalidator.retried) == (400, 0, 200)
+
+    def test_analysis_is_marked_stale(self, outage, monkeypatch):
+        monkeypatch.setattr(app, "fetch_stock_info", lambda s: app.mark_stale({"longName": "A Oyj"}))
+        ok, result = app.get_stock_analysis("AAA", "1y")
+        assert ok and result["stale"] is True and result["company"] == "A Oyj"
+
+    def test_analysis_error_without_stored_data(self, tmp_db, yahoo_breaker):
+        for _ in range(app.BREAKER_FAILURE_THRESHOLD):
+            yahoo_breaker.record_failure()
+        ok, message = app.get_stock_analysis("UUSI.HE")
+        assert not ok and "ei vastaa" in message
+
+    def test_revalidator_deduplicates_pending_keys(self):
+        class Queue:
+            def __init__(self):
+                self.jobs = []
+
+            def submit(self, fn, *args):
+                self.jobs.append((fn, args))
+
+        queue = Queue()
+        revalidator = app.BackgroundRevalidator(executor=queue)
+        calls = []
+        assert revalidator.schedule("k", calls.append, 1)
+        assert not revalidator.schedule("k", calls.append, 2)
+        assert revalidator.pending() == 1
+        fn, args = queue.jobs[0]
+        fn(*args)
+        assert calls == [1] and revalidator.pending() == 0 and revalidator.completed == 1
+
+    def test_screener_keeps_last_good_row_for_stale_symbol(self, tmp_db, fake_market, monkeypatch):
+        monkeypatch.setattr(app, "SCREENER_MARKETS", dict(app.SCREENER_MARKETS))
+        app.register_screener_market("custom", fake_market)
+        app.save_screener_rows("custom", [{"symbol": "NESTE.HE", "name": "Neste", "price": 99.0}],
+                               synced_at="2026-01-01 10:00:00")
+        fresh_bulk = app.fetch_prices_bulk
+
+        def partly_stale(symbols, period="6mo"):
+            frames = fresh_bulk(symbols, period)
+            frames["NESTE.HE"] = app.mark_stale(frames["NESTE.HE"].copy())
+            return frames
+
+        monkeypatch.setattr(app, "fetch_prices_bulk", partly_stale)
+        results = app.run_screener("custom")
+        assert results.attrs == {"stale": ["NESTE.HE"], "skipped": ["UPM.HE"]}
+
+        ok, saved = app.sync_screener_market("custom")
+        assert ok and saved == 1
+        rows = app.query_screener("custom").set_index("symbol")
+        assert rows.loc["NESTE.HE", "price"] == 99.0
+        assert app.screener_coverage("custom") == (["NESTE.HE"], ["UPM.HE"])
+
+
+# ===========================================================================
+# 26. IndicatorState – inkrementaalinen indikaattoritila
+# ===========================================================================
+
+def _random_walk(n: int, seed: int = 7) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+
+
+def _assert_matches_batch(values: dict, close: np.ndarray) -> None:
+    batch = app.compute_indicators(close)
+    assert set(values) == set(batch)
+    for key, arr in batch.items():
+        if np.isnan(arr[-1]):
+            assert values[key] is None, key
+        else:
+            assert values[key] == pytest.approx(arr[-1], abs=app.INDICATOR_TOLERANCE), key
+
+
+class TestIndicatorState:
+    @pytest.mark.parametrize("n", [1, 14, 30, 260, 1500])
+    def test_streaming_matches_batch(self, n):
+        close = _random_walk(n)
+        state = app.IndicatorState()
+        for value in close:
+            state.append(value)
+        _assert_matches_batch(state.latest(), close)
+
+    def test_peek_does_not_mutate(self):
+        close = _random_walk(120)
+        state = app.IndicatorState()
+        for value in close[:-1]:
+            state.append(value)
+        before = state.to_dict()
+        _assert_matches_batch(state.peek(close[-1]), close)
+        assert state.to_dict() == before
+
+    def test_custom_params(self):
+        close = _random_walk(200)
+        state = app.IndicatorState(rsi_window=7, sma_windows=(5, 20), macd_windows=(5, 10, 4))
+        for value in close:
+            state.append(value)
+        batch = app.compute_indicators(close, rsi_window=7, sma_windows=(5, 20), macd_windows=(5, 10, 4))
+        for key in ("RSI", "SMA5", "SMA20", "MACD", "MACD_signal"):
+            assert state.latest()[key] == pytest.approx(batch[key][-1], abs=app.INDICATOR_TOLERANCE)
+
+    def test_serialization_roundtrip(self, tmp_db):
+        close = _random_walk(250)
+        state = app.IndicatorState()
+        for value in close[:-1]:
+            state.append(value)
+        app.save_indicator_states({"AAA": ("2026-10-15", state)})
+        last_date, loaded = app.load_indicator_states(["AAA", "EI"])["AAA"]
+        assert last_date == "2026-10-15"
+        assert loaded.peek(close[-1]) == state.peek(close[-1])
+
+
+class TestStreamingIndicators:
+    @staticmethod
+    def _frame(close: np.ndarray, end: str = "2026-10-16") -> pd.DataFrame:
+        return pd.DataFrame({"Close": close}, index=pd.bdate_range(end=end, periods=len(close)))
+
+    def test_commits_all_but_last_bar(self, tmp_db):
+        close = _random_walk(130)
+        frame = self._frame(close)
+        latest = app.streaming_indicators({"AAA": frame})
+        _assert_matches_batch(latest["AAA"], close)
+        last_date, state = app.load_indicator_states(["AAA"])["AAA"]
+        assert last_date == frame.index[-2].strftime("%Y-%m-%d")
+        assert state.count == len(close) - 1
+
+    def test_new_bar_appends_incrementally(self, tmp_db, monkeypatch):
+        close = _random_walk(131)
+        app.streaming_indicators({"AAA": self._frame(close[:-1], end="2026-10-15")})
+        appended = []
+        original = app.IndicatorState.append
+        monkeypatch.setattr(app.IndicatorState, "append",
+                            lambda self, v: appended.append(v) or original(self, v))
+        latest = app.streaming_indicators({"AAA": self._frame(close)})
+        # Yksi vahvistettu päivä ja viimeisen päivän peek – ei koko sarjaa
+        assert len(appended) == 2
+        assert app.load_indicator_states(["AAA"])["AAA"][1].count == len(close) - 1
+        _assert_matches_batch(latest["AAA"], close)
+
+    def test_live_bar_update_is_not_committed(self, tmp_db):
+        close = _random_walk(60)
+        app.streaming_indicators({"AAA": self._frame(close)})
+        revised = close.copy()
+        revised[-1] *= 1.05  # viimeinen päivä muuttui kesken päivän
+        latest = app.streaming_indicators({"AAA": self._frame(revised)})
+        _assert_matches_batch(latest["AAA"], revised)
+
+    def test_readjusted_history_rebuilds(self, tmp_db):
+        close = _random_walk(80)
+        app.streaming_indicators({"AAA": self._frame(close)})
+        adjusted = close * 0.97
+        latest = app.streaming_indicators({"AAA": self._frame(adjusted)})
+        _assert_matches_batch(latest["AAA"], adjusted)
+
+    def test_replaced_bars_drop_state(self, tmp_db):
+        frame = pd.DataFrame({"Open": 1.0, "High": 1.0, "Low": 1.0, "Close": _random_walk(30),
+                              "Volume": 1.0}, index=pd.bdate_range(end="2026-10-16", periods=30))
+        app.streaming_indicators({"AAA": frame})
+        app.save_price_bars("AAA", frame, replace=True)
+        assert app.load_indicator_states(["AAA"]) == {}
+
+
+# ===========================================================================
+# 27. IndicatorCache – jaettu indikaattorivälimuisti
+# ===========================================================================
+
+class TestIndicatorCache:
+    @pytest.fixture()
+    def cache(self, monkeypatch):
+        fresh = app.IndicatorCache()
+        monkeypatch.setattr(app, "_get_indicator_cache", lambda: fresh)
+        return fresh
+
+    @staticmethod
+    def _frame(n: int = 300, seed: int = 3) -> pd.DataFrame:
+        return pd.DataFrame({"Close": _random_walk(n, seed)},
+                            index=pd.bdate_range(end="2026-10-16", periods=n, name="Date"))
+
+    def test_matches_uncached_columns(self, cache):
+        cached = app.add_indicators(self._frame().reset_index(), symbol="AAA")
+        plain = app.add_indicators(self._frame().reset_index())
+        for col in app.INDICATOR_COLUMNS:
+            np.testing.assert_allclose(cached[col], plain[col], atol=app.INDICATOR_TOLERANCE, equal_nan=True)
+
+    def test_same_bars_compute_once(self, cache, monkeypatch):
+        calls = []
+        original = app._rsi_panel
+        monkeypatch.setattr(app, "_rsi_panel", lambda x, w: calls.append(w) or original(x, w))
+        frame = self._frame()
+        app.add_indicators(frame.copy(), symbol="AAA")
+        app.add_indicators(frame.reset_index(), ["RSI"], symbol="AAA")
+        assert calls == [14]
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_new_or_changed_bar_changes_key(self, cache):
+        frame = self._frame()
+        first = app.indicator_memo("AAA", frame)
+        live = frame.copy()
+        live.iloc[-1, 0] *= 1.01  # keskeneräisen päivän kurssi muuttui
+        assert app.indicator_memo("AAA", live) is not first
+        assert app.indicator_memo("AAA", frame.iloc[:-1]) is not first
+        assert app.indicator_memo("BBB", frame) is not first
+        assert app.indicator_memo("AAA", frame) is first
+
+    def test_lru_eviction(self):
+        cache = app.IndicatorCache(max_entries=2)
+        frame = self._frame(60)
+        first = cache.memo("A", frame)
+        cache.memo("B", frame)
+        cache.memo("A", frame)
+        cache.memo("C", frame)  # B poistuu
+        assert len(cache) == 2
+        assert cache.memo("A", frame) is first
+        assert cache.misses == 3
+
+    @pytest.mark.parametrize("strategy", app.STRATEGIES)
+    def test_signals_match_with_shared_memo(self, cache, strategy):
+        df = self._frame().reset_index()
+        plain = app._generate_signals(df, strategy)
+        shared = app._generate_signals(df, strategy, symbol="AAA")
+        assert list(shared["Signal"]) == list(plain["Signal"])
+
+    def test_analysis_reruns_hit_cache(self, cache, monkeypatch):
+        frame = self._frame()
+        monkeypatch.setattr(app, "fetch_stock_data", lambda symbol, period="6mo": (frame, {}))
+        first = app.get_stock_analysis("AAA")[1]
+        second = app.get_stock_analysis("AAA")[1]
+        assert first["rsi"] == second["rsi"] and cache.hits == 1
+
+
+# ===========================================================================
+# 28. FrameStore – jaettu kehysvarasto ja istunnon muistibudjetti
+# ===========================================================================
+
+class TestFrameStore:
+    @staticmethod
+    def _frame(n: int = 300, seed: int = 5) -> pd.DataFrame:
+        return pd.DataFrame({"Close": _random_walk(n, seed)},
+                            index=pd.bdate_range(end="2026-10-16", periods=n, name="Date"))
+
+    def test_estimate_size_measures_frames(self):
+        df = pd.DataFrame({"a": np.zeros(1000), "b": ["x" * 10] * 1000})
+        assert app.estimate_size(df) == df.memory_usage(deep=True).sum()
+        assert app.estimate_size({"df": df, "n": 1}) > app.estimate_size(df)
+        assert app.estimate_size([np.zeros(100)]) >= 800
+
+    def test_lru_eviction_within_budget(self):
+        frame = {"df": pd.DataFrame({"v": np.zeros(1000)})}
+        size = app.estimate_size(frame)
+        store = app.FrameStore(budget=int(size * 2.5))
+        for key in ("a", "b"):
+            store.put((key,), frame)
+        store.get(("a",))  # a on nyt tuoreempi kuin b
+        store.put(("c",), frame)
+        assert ("a",) in store and ("c",) in store and ("b",) not in store
+        assert store.evictions == 1 and store.bytes == 2 * size
+
+    def test_newest_entry_kept_over_budget(self):
+        store = app.FrameStore(budget=10)
+        store.put(("iso",), {"df": pd.DataFrame({"v": np.zeros(100)})})
+        assert len(store) == 1 and store.get(("iso",)) is not None
+
+    def test_analysis_result_is_compact(self, frame_store, monkeypatch):
+        frame = self._frame()
+        monkeypatch.setattr(app, "fetch_stock_data",
+                            lambda symbol, period="6mo": (frame, {"longName": "A Oyj", "trailingPE": 9.0}))
+        ok, result = app.get_stock_analysis("AAA")
+        assert ok and "df" not in result and "info" not in result
+        assert result["pe_ratio"] == 9.0 and result[app.FRAMES_KEY] == ("analysis", "AAA", "6mo")
+        assert all(np.isscalar(v) or v is None for k, v in result.items() if k != app.FRAMES_KEY)
+        assert "RSI" in app.result_frames(result)["df"].columns
+
+    def test_evicted_analysis_frame_is_recomputed(self, frame_store, monkeypatch):
+        frame = self._frame()
+        monkeypatch.setattr(app, "fetch_stock_data", lambda symbol, period="6mo": (frame, {}))
+        result = app.get_stock_analysis("AAA")[1]
+        first = app.result_frames(result)["df"]
+        frame_store._entries.clear()
+        again = app.result_frames(result)["df"]
+        pd.testing.assert_frame_equal(first, again)
+        assert result[app.FRAMES_KEY] in frame_store
+
+    def test_backtest_frames_are_lazy_and_shared(self, frame_store, monkeypatch):
+        hist = _make_history(400, seed=6)
+        calls = []
+        monkeypatch.setattr(app, "fetch_stock_history", lambda *a: calls.append(a) or hist)
+        ok, result = app.backtest_strategy("AAA", 2, 10000, 0.001, "MACD-risteytys")
+        assert ok and not set(app.BACKTEST_FRAME_KEYS) & set(result)
+        frames = app.result_frames(result)
+        assert len(frames["equity_df"]) == len(hist) and len(calls) == 1
+        frame_store._entries.clear()
+        rebuilt = app.result_frames(result)
+        assert len(calls) == 2
+        pd.testing.assert_frame_equal(rebuilt["equity_df"], frames["equity_df"])
+
+    def test_failed_rebuild_returns_empty(self, frame_store, monkeypatch):
+        monkeypatch.setattr(app, "fetch_stock_data",
+                            lambda symbol, period="6mo": (_ for _ in ()).throw(app.ProviderUnavailable("katko")))
+        assert app.result_frames({app.FRAMES_KEY: ("analysis", "AAA", "6mo")}) == {}
+        assert app.result_frames({"symbol": "AAA"}) == {}
+
+    def test_portfolio_result_compacted(self, frame_store):
+        frames = {s: _make_history(400, seed=i) for i, s in enumerate(["AAA", "BBB"], start=7)}
+        ok, full = app.backtest_portfolio(list(frames), frames=frames)
+        handle = app.portfolio_handle(list(frames), 5, 10000, 0.001, app.STRATEGIES[0])
+        compact = app.compact_result(full, handle, app.PORTFOLIO_FRAME_KEYS)
+        assert ok and "equity_df" not in compact and compact["sharpe_ratio"] == full["sharpe_ratio"]
+        assert app.result_frames(compact)["equity_df"] is full["equity_df"]
+
+    def test_session_budget_drops_largest_results(self):
+        big = {"equity_df": pd.DataFrame({"v": np.zeros(20_000)})}
+        state = {"lang": "fi", "backtest_results": [big], "optimizer_results": ("x", pd.DataFrame({"v": [1.0]}))}
+        sizes = app.session_memory_usage(state)
+        assert sizes["backtest_results"] > 100_000
+        dropped = app.enforce_session_budget(state, budget=50_000)
+        assert dropped == ["backtest_results"]
+        assert "optimizer_results" in state and "lang" in state
+        assert app.enforce_session_budget(state, budget=50_000) == []
+
+    def test_compact_results_fit_session_budget(self, frame_store, monkeypatch):
+        hist = _make_history(1300, seed=8)
+        monkeypatch.setattr(app, "fetch_stock_history", lambda *a: hist)
+        results = [app.backtest_strategy(s, 5)[1] for s in ("AAA", "BBB", "CCC")]
+        state = {"backtest_results": results}
+        assert sum(app.session_memory_usage(state).values()) < 10_000
+        assert frame_store.bytes > 100_000
+
+
+# ===========================================================================
+# 29. Kaavioiden harvennus (LTTB ja min/max)
+# ===========================================================================
+
+class TestChartDownsampling:
+    @staticmethod
+    def _chart_df(n: int = 2500, seed: int = 9) -> pd.DataFrame:
+        df = pd.DataFrame({"Date": pd.bdate_range("2016-01-01", periods=n),
+                           "Close": _random_walk(n, seed)})
+        df["Volume"] = np.random.default_rng(seed).integers(1_000, 100_000, n)
+        return app.add_indicators(df)
+
+    @staticmethod
+    def _points(fig) -> int:
+        return max(len(trace.x) for trace in fig.data)
+
+    @pytest.mark.parametrize("method", app.DOWNSAMPLE_METHODS)
+    def test_indices_are_bounded_sorted_and_keep_ends(self, method):
+        y = _random_walk(10_000, 1)
+        idx = app.downsample_indices(y, 500, method)
+        assert len(idx) <= 500 and idx[0] == 0 and idx[-1] == len(y) - 1
+        assert (np.diff(idx) > 0).all()
+
+    @pytest.mark.parametrize("method", app.DOWNSAMPLE_METHODS)
+    def test_forced_indices_are_kept(self, method):
+        y = _random_walk(5000, 2)
+        keep = [17, 2345, 4999]
+        idx = app.downsample_indices(y, 300, method, keep=keep)
+        assert set(keep) <= set(idx) and len(idx) <= 300
+
+    def test_short_series_untouched(self):
+        assert list(app.downsample_indices(np.arange(10.0), 800)) == list(range(10))
+        assert list(app.downsample_indices(np.arange(10.0), None)) == list(range(10))
+        with pytest.raises(ValueError):
+            app.downsample_indices(np.arange(1000.0), 10, "tuntematon")
+
+    def test_lttb_keeps_spike(self):
+        y = np.zeros(3000)
+        y[1234] = 50.0
+        assert 1234 in app.lttb_indices(y, 100)
+
+    def test_minmax_handles_leading_nan(self):
+        y = np.r_[np.full(500, np.nan), _random_walk(2000, 3)]
+        idx = app.minmax_indices(y, 200)
+        assert len(idx) <= 200 and np.nanargmax(y) in idx
+
+    def test_charts_are_opt_in(self):
+        df = self._chart_df()
+        assert self._points(app.plot_rsi_chart(df)) == len(df)
+
+    @pytest.mark.parametrize("method", app.DOWNSAMPLE_METHODS)
+    def test_all_charts_bounded_with_extrema(self, method):
+        df = self._chart_df()
+        opts = {"max_points": 400, "method": method}
+        figs = [app.plot_price_chart(df, "AAA", **opts), app.plot_macd_chart(df, **opts),
+                app.plot_rsi_chart(df, **opts), app.plot_volume_chart(df, "AAA", **opts)]
+        for fig in figs:
+            assert self._points(fig) <= 400
+        price = figs[0].data[0]
+        assert max(price.y) == df["Close"].max() and min(price.y) == df["Close"].min()
+        assert max(figs[3].data[0].y) == df["Volume"].max()
+
+    def test_trade_markers_survive_downsampling(self):
+        df = self._chart_df()
+        history = [("BUY", df["Date"].iloc[i], df["Close"].iloc[i]) for i in (101, 1501)]
+        history += [("SELL", df["Date"].iloc[i], df["Close"].iloc[i]) for i in (777, 2222)]
+        fig = app.plot_price_chart(df, "AAA", history, max_points=300)
+        markers = {tr.name: tr for tr in fig.data if tr.mode == "markers"}
+        assert len(markers["Osto"].x) == 2 and len(markers["Myynti"].x) == 2
+        line_dates = set(pd.to_datetime(fig.data[0].x))
+        assert all(pd.Timestamp(d) in line_dates for _, d, _ in history)
+
+    def test_equity_and_volume_colors_follow_full_series(self):
+        df = self._chart_df()
+        equity = pd.DataFrame({"Date": df["Date"], "Value": df["Close"] * 100})
+        fig = app.plot_equity_curve(equity, "AAA", 10000, max_points=250)
+        assert len(fig.data[0].x) <= 250 and max(fig.data[0].y) == equity["Value"].max()
+        full = app.plot_volume_chart(df, "AAA")
+        light = app.plot_volume_chart(df, "AAA", max_points=250)
+        colors = dict(zip(pd.to_datetime(full.data[0].x), full.data[0].marker.color))
+        assert all(colors[pd.Timestamp(x)] == c for x, c in zip(light.data[0].x, light.data[0].marker.color))
+
+    def test_chart_options_from_session(self, monkeypatch):
+        monkeypatch.setitem(st.session_state, "chart_downsample", False)
+        assert app.chart_options() == {"max_points": None, "webgl": False}
+        monkeypatch.setitem(st.session_state, "chart_downsample", True)
+        monkeypatch.setitem(st.session_state, "chart_downsample_method", "minmax")
+        monkeypatch.setitem(st.session_state, "chart_webgl", True)
+        assert app.chart_options() == {"max_points": app.CHART_MAX_POINTS, "method": "minmax", "webgl": True}
+
+
+# ===========================================================================
+# 30. FigureCache – WebGL-tila ja kaavioiden välimuisti
+# ===========================================================================
+
+class TestFigureCache:
+    @pytest.fixture()
+    def cache(self, monkeypatch):
+        fresh = app.FigureCache(max_entries=4)
+        monkeypatch.setattr(app, "_get_figure_cache", lambda: fresh)
+        return fresh
+
+    @staticmethod
+    def _chart_df(n: int = 1500, seed: int = 11) -> pd.DataFrame:
+        return TestChartDownsampling._chart_df(n, seed)
+
+    def test_webgl_only_for_long_series(self):
+        df = self._chart_df()
+        gl = app.plot_price_chart(df, "AAA", webgl=True)
+        assert {type(tr).__name__ for tr in gl.data} == {"Scattergl"}
+        assert all(type(tr).__name__ == "Scatter" for tr in app.plot_price_chart(df, "AAA").data)
+        short = app.plot_rsi_chart(df.tail(200), webgl=True)
+        assert type(short.data[0]).__name__ == "Scatter"
+
+    def test_webgl_keeps_bars_and_markers(self):
+        df = self._chart_df()
+        history = [("BUY", df["Date"].iloc[10], df["Close"].iloc[10])]
+        price = app.plot_price_chart(df, "AAA", history, webgl=True)
+        assert type(price.data[-1]).__name__ == "Scatter" and price.data[-1].mode == "markers"
+        kinds = [type(tr).__name__ for tr in app.plot_volume_chart(df, "AAA", webgl=True).data]
+        assert kinds == ["Bar", "Scattergl"]
+        macd = [type(tr).__name__ for tr in app.plot_macd_chart(df, webgl=True).data]
+        assert macd == ["Scattergl", "Scattergl", "Bar"]
+        equity = pd.DataFrame({"Date": df["Date"], "Value": df["Close"]})
+        assert type(app.plot_equity_curve(equity, "AAA", 100, webgl=True).data[0]).__name__ == "Scattergl"
+
+    def test_same_series_returns_same_figure(self, cache):
+        df = self._chart_df()
+        first = app.cached_figure("rsi", "AAA", df, app.plot_rsi_chart, df)
+        again = app.cached_figure("rsi", "AAA", df.copy(), app.plot_rsi_chart, df.copy())
+        assert again is first and (cache.hits, cache.misses) == (1, 1)
+
+    def test_key_covers_kind_lang_options_variant_and_new_bar(self, cache, monkeypatch):
+        df = self._chart_df()
+        base = app.cached_figure("rsi", "AAA", df, app.plot_rsi_chart, df)
+        assert app.cached_figure("macd", "AAA", df, app.plot_macd_chart, df) is not base
+        assert app.cached_figure("rsi", "AAA", df, app.plot_rsi_chart, df, max_points=300) is not base
+        assert app.cached_figure("rsi", "AAA", df, app.plot_rsi_chart, df, variant=("bt",)) is not base
+        monkeypatch.setitem(st.session_state, "lang", "en")
+        assert app.cached_figure("rsi", "AAA", df, app.plot_rsi_chart, df) is not base
+        monkeypatch.setitem(st.session_state, "lang", "fi")
+        longer = self._chart_df(1501)
+        assert app.cached_figure("rsi", "AAA", longer, app.plot_rsi_chart, longer) is not base
+        assert cache.hits == 0 and len(cache) == 4
+
+    def test_lru_evicts_oldest(self, cache):
+        df = self._chart_df(300)
+        figs = [app.cached_figure("rsi", s, df, app.plot_rsi_chart, df) for s in "ABCDE"]
+        assert len(cache) == 4
+        assert app.cached_figure("rsi", "E", df, app.plot_rsi_chart, df) is figs[-1]
+        assert app.cached_figure("rsi", "A", df, app.plot_rsi_chart, df) is not figs[0]
+
+    def test_equity_fingerprint_uses_value(self, cache):
+        df = self._chart_df(300)
+        equity = pd.DataFrame({"Date": df["Date"], "Value": df["Close"] * 10})
+        fig = app.cached_figure("equity", "Salkku", equity, app.plot_equity_curve, equity, "Salkku", 1000)
+        bumped = equity.assign(Value=equity["Value"] + 1)
+        other = app.cached_figure("equity", "Salkku", bumped, app.plot_equity_curve, bumped, "Salkku", 1000)
+        assert fig is not other
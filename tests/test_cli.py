@@ -0,0 +1,154 @@
+"""
+Yksikkötestit – komentorivikäyttöliittymä (cli.py)
+===================================================
+Kattaa:
+  - resolve_symbols : tunnukset komentoriviltä tai käyttäjän salkusta
+  - write_output    : CSV/JSON/Parquet-tulostus ja muodon päättely
+  - main            : analyze/screen/backtest-alikomennot ja paluuarvot
+"""
+
+import json
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import app
+import cli
+
+
+# ===========================================================================
+# Fixtures
+# ===========================================================================
+
+@pytest.fixture()
+def tmp_db(tmp_path, monkeypatch):
+    """Väliaikainen tietokanta; main() saa sen --db-valitsimella."""
+    db_file = str(tmp_path / "cli_stocks.db")
+    monkeypatch.setattr(app, "DB_NAME", db_file)
+    app.init_db()
+    return db_file
+
+
+@pytest.fixture()
+def user_with_stocks(tmp_db):
+    """Käyttäjä, jonka oletussalkussa on kaksi osaketta."""
+    ok, _ = app.create_user("cron", "salainen123")
+    assert ok
+    user_id = app.get_user_by_username("cron")[0]
+    app.ensure_user_portfolio(user_id)
+    portfolio_id = app.get_portfolios(user_id)[0][0]
+    app.add_stock("NOKIA.HE", portfolio_id)
+    app.add_stock("AAPL", portfolio_id)
+    return "cron"
+
+
+def _fake_analysis(symbol, period="6mo"):
+    if symbol == "BAD":
+        return False, "Ei dataa osakkeelle BAD"
+    return True, {"symbol": symbol, "price": 10.0, "rsi": 50.0, "signal": "PIDÄ",
+                  "df": pd.DataFrame({"Close": [1, 2]}), "info": {}, "summary": "…"}
+
+
+# ===========================================================================
+# 1. resolve_symbols
+# ===========================================================================
+
+class TestResolveSymbols:
+    def test_explicit_symbols_are_normalized(self):
+        assert cli.resolve_symbols([" nokia.he", "aapl"]) == (True, ["NOKIA.HE", "AAPL"])
+
+    def test_symbols_from_user_portfolio(self, user_with_stocks):
+        ok, symbols = cli.resolve_symbols([], user=user_with_stocks)
+        assert ok and sorted(symbols) == ["AAPL", "NOKIA.HE"]
+
+    def test_unknown_user_or_portfolio(self, user_with_stocks):
+        assert cli.resolve_symbols([], user="nobody")[0] is False
+        assert cli.resolve_symbols([], user=user_with_stocks, portfolio="Puuttuva")[0] is False
+        assert cli.resolve_symbols([])[0] is False
+
+
+# ===========================================================================
+# 2. write_output
+# ===========================================================================
+
+class TestWriteOutput:
+    df = pd.DataFrame({"symbol": ["NOKIA.HE", "UPM.HE"], "price": [4.1, 30.5]})
+
+    def test_format_from_extension(self, tmp_path):
+        for ext in ("csv", "json"):
+            path = str(tmp_path / f"out.{ext}")
+            assert cli.write_output(self.df, path) == ext
+        assert list(pd.read_csv(tmp_path / "out.csv")["symbol"]) == ["NOKIA.HE", "UPM.HE"]
+        assert json.loads((tmp_path / "out.json").read_text())[1]["price"] == 30.5
+
+    def test_parquet_roundtrip(self, tmp_path):
+        pytest.importorskip("pyarrow")
+        path = str(tmp_path / "out.parquet")
+        cli.write_output(self.df, path)
+        pd.testing.assert_frame_equal(pd.read_parquet(path), self.df)
+
+    def test_stdout_defaults_to_csv(self, capsys):
+        assert cli.write_output(self.df) == "csv"
+        assert capsys.readouterr().out.startswith("symbol,price")
+
+    def test_parquet_requires_path(self):
+        with pytest.raises(ValueError):
+            cli.write_output(self.df, None, "parquet")
+
+
+# ===========================================================================
+# 3. main – alikomennot
+# ===========================================================================
+
+class TestMain:
+    def test_analyze_writes_tabular_rows(self, tmp_db, tmp_path, monkeypatch, capsys):
+        monkeypatch.setattr(app, "get_stock_analysis", _fake_analysis)
+        monkeypatch.setattr(app, "refresh_price_bars", lambda symbols, start: {})
+        monkeypatch.setattr(app, "prefetch_stock_info", lambda symbols: [{} for _ in symbols])
+        out = tmp_path / "analyysi.csv"
+
+        rc = cli.main(["--db", tmp_db, "analyze", "NOKIA.HE", "BAD", "-o", str(out)])
+
+        df = pd.read_csv(out)
+        assert rc == 1  # BAD epäonnistui
+        assert list(df["symbol"]) == ["NOKIA.HE"]
+        assert "df" not in df.columns and "summary" not in df.columns
+        assert "BAD" in capsys.readouterr().err
+
+    def test_backtest_per_symbol(self, tmp_db, tmp_path, monkeypatch):
+        monkeypatch.setattr(app, "backtest_strategy", lambda s, *a: (True, {
+            "symbol": s, "strategy_return": 12.5, "equity_df": pd.DataFrame(), "trade_history": []}))
+        out = tmp_path / "bt.json"
+
+        rc = cli.main(["--db", tmp_db, "backtest", "NOKIA.HE", "UPM.HE", "--years", "3", "-o", str(out)])
+
+        assert rc == 0
+        assert [r["symbol"] for r in json.loads(out.read_text())] == ["NOKIA.HE", "UPM.HE"]
+
+    def test_screen_without_saving(self, tmp_db, monkeypatch, capsys):
+        monkeypatch.setattr(app, "run_screener", lambda market: pd.DataFrame(
+            [{"symbol": "NOKIA.HE", "signal": "🟡 PIDÄ"}]))
+
+        rc = cli.main(["--db", tmp_db, "screen", "--market", "fi", "--no-save"])
+
+        assert rc == 0
+        assert "NOKIA.HE" in capsys.readouterr().out
+        assert app.query_screener("fi").empty
+
+    def test_screen_reports_stale_and_skipped(self, tmp_db, monkeypatch, capsys):
+        def partial(market):
+            df = pd.DataFrame([{"symbol": "NOKIA.HE", "signal": "🟡 PIDÄ"}])
+            df.attrs.update(stale=["NOKIA.HE"], skipped=["UPM.HE"])
+            return df
+
+        monkeypatch.setattr(app, "run_screener", partial)
+        rc = cli.main(["--db", tmp_db, "screen", "--market", "fi", "--no-save"])
+        err = capsys.readouterr().err
+        assert rc == 1
+        assert "NOKIA.HE: vanhentunut" in err and "UPM.HE: ei dataa" in err
+
+    def test_missing_symbols_is_usage_error(self, tmp_db):
+        assert cli.main(["--db", tmp_db, "analyze"]) == 2
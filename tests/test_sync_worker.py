@@ -0,0 +1,123 @@
+"""
+Yksikkötestit – taustapäivittäjä (sync_worker.py)
+==================================================
+Kattaa:
+  - due_jobs               : aukioloaikoihin perustuva ajastus
+  - warm_portfolio_symbols : salkkujen kurssien ja perustietojen esilämmitys
+  - run_once               : kierros, sykäys, edellisten ajojen kirjanpito ja katkon aikainen lykkäys
+"""
+
+import os
+import sys
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import app
+import sync_worker
+
+
+# ===========================================================================
+# Fixtures
+# ===========================================================================
+
+@pytest.fixture()
+def tmp_db(tmp_path, monkeypatch):
+    """Väliaikainen tietokanta."""
+    db_file = str(tmp_path / "worker_stocks.db")
+    monkeypatch.setattr(app, "DB_NAME", db_file)
+    app.init_db()
+    return db_file
+
+
+@pytest.fixture()
+def fake_jobs(monkeypatch):
+    """Korvaa verkkohaut ja kirjaa ajetut työt."""
+    calls = []
+    monkeypatch.setattr(app, "sync_screener_market", lambda m: calls.append(m) or (True, 3))
+    monkeypatch.setattr(app, "refresh_price_bars", lambda symbols, start: calls.extend(symbols) or {})
+    monkeypatch.setattr(app, "fetch_parallel", lambda func, items: [{} for _ in items])
+    return calls
+
+
+def _epoch(text: str, tz: str = "Europe/Helsinki") -> float:
+    return datetime.strptime(text, "%Y-%m-%d %H:%M").replace(tzinfo=ZoneInfo(tz)).timestamp()
+
+
+# ===========================================================================
+# 1. due_jobs
+# ===========================================================================
+
+class TestDueJobs:
+    def test_open_market_refreshes_often(self):
+        now = _epoch("2026-03-04 12:00")  # keskiviikko: Helsinki ja Frankfurt auki, New York kiinni
+        last = {m: now - sync_worker.OPEN_INTERVAL for m in app.SCREENER_MARKETS}
+        last[sync_worker.PORTFOLIO_KEY] = now - sync_worker.OPEN_INTERVAL
+        assert sync_worker.due_jobs(last, now) == ["fi", "eu", sync_worker.PORTFOLIO_KEY]
+
+    def test_weekend_uses_closed_interval(self):
+        now = _epoch("2026-03-07 12:00")  # lauantai
+        recent = {m: now - 600 for m in [*app.SCREENER_MARKETS, sync_worker.PORTFOLIO_KEY]}
+        assert sync_worker.due_jobs(recent, now) == []
+        assert "fi" in sync_worker.due_jobs({}, now)
+
+
+# ===========================================================================
+# 2. run_once
+# ===========================================================================
+
+class TestRunOnce:
+    def test_force_runs_every_job_and_records_heartbeat(self, tmp_db, fake_jobs):
+        ok, _ = app.add_stock("NOKIA.HE", 1)
+        summary = sync_worker.run_once(last_run={}, now=1000.0, force=True)
+        assert fake_jobs == [*app.SCREENER_MARKETS, "NOKIA.HE"]
+        assert summary == {"fi": 3, "us": 3, "eu": 3, sync_worker.PORTFOLIO_KEY: 1}
+        assert app.get_worker_heartbeat() == (1000.0, summary)
+
+    def test_last_run_is_updated(self, tmp_db, fake_jobs):
+        last_run = {}
+        now = _epoch("2026-03-07 12:00")
+        sync_worker.run_once(last_run, now=now)
+        assert set(last_run) == {*app.SCREENER_MARKETS, sync_worker.PORTFOLIO_KEY}
+        fake_jobs.clear()
+        # Heti perään mikään ei ole erääntynyt, mutta sykäys kirjataan silti
+        assert sync_worker.run_once(last_run, now=now + 60) == {}
+        assert fake_jobs == []
+        assert app.worker_is_alive(now=now + 61)
+
+    def test_outage_defers_remaining_jobs(self, tmp_db, fake_jobs, monkeypatch):
+        available = iter([True, False, False])
+        monkeypatch.setattr(app, "yahoo_available", lambda: next(available))
+        last_run = {}
+        summary = sync_worker.run_once(last_run, now=1000.0, force=True)
+        # Ensimmäinen työ ajettiin, mutta katkaisin aukesi kesken: mitään ei kirjata ajetuksi
+        assert fake_jobs == ["fi"]
+        assert summary["deferred"] == ["us", "eu", sync_worker.PORTFOLIO_KEY]
+        assert last_run == {}
+
+    def test_stale_fundamentals_are_errors(self, tmp_db, fake_jobs, monkeypatch):
+        app.add_stock("NOKIA.HE", 1)
+        monkeypatch.setattr(app, "fetch_parallel", lambda func, items: [app.mark_stale({}) for _ in items])
+        assert sync_worker.warm_portfolio_symbols() == (0, {"NOKIA.HE": "perustiedot vanhentuneet"})
+
+    def test_portfolio_errors_are_counted(self, tmp_db, fake_jobs, monkeypatch):
+        app.add_stock("NOKIA.HE", 1)
+        app.add_stock("BAD", 1)
+        monkeypatch.setattr(app, "refresh_price_bars", lambda symbols, start: {"BAD": ValueError("x")})
+        assert sync_worker.warm_portfolio_symbols() == (1, {"BAD": "x"})
+
+
+# ===========================================================================
+# 3. Kaupankäyntikalenterin mukainen ajastus
+# ===========================================================================
+
+class TestCalendarSchedule:
+    def test_closed_market_syncs_once_after_close(self):
+        friday_close = _epoch("2026-03-06 18:30")
+        saturday = _epoch("2026-03-07 12:00")
+        before_close = {"fi": friday_close - 3600}
+        after_close = {"fi": friday_close + 60}
+        assert "fi" in sync_worker.due_jobs(before_close, saturday)
+        assert "fi" not in sync_worker.due_jobs(after_close, saturday)